@@ -1,55 +1,175 @@
 from datetime import timedelta
 import os
 
-from flask import Flask
-from flask_login import LoginManager
+from flask import Flask, g
+from flask_login import LoginManager, current_user
 from dotenv import load_dotenv
 
-from .models import db, User, create_tables
+from .auth import bearer_token, user_cache
+from .catalog import catalog_cache
+from .instrumentation import instrumentation
+from .models import db, User, RevenueRollup, create_tables
+from .passwords import login_throttle, password_hasher
+from .pdf_cache import pdf_cache
+from .rendering import pdf_renderer
+from .serialization import FastJSONProvider
+from .tokens import api_tokens
 load_dotenv()
 login_manager = LoginManager()
 
 
 def create_app():
     app = Flask(__name__)
+    # orjson when it is installed; encodes Decimal and date values either way
+    app.json = FastJSONProvider(app)
 
     # In production, load this from env variable
     app.config["SECRET_KEY"] = os.getenv("FLASK_SECRET_KEY", "fallback-secret")
     app.config["REMEMBER_COOKIE_DURATION"] = os.getenv("COOKIE_DURATION")
 
+    # Rendered PDFs are cached on disk; set PDF_CACHE_DIR="" to disable
+    app.config["PDF_CACHE_DIR"] = os.getenv(
+        "PDF_CACHE_DIR", os.path.join(app.instance_path, "pdf-cache")
+    )
+    app.config["PDF_CACHE_MAX_BYTES"] = int(
+        os.getenv("PDF_CACHE_MAX_BYTES", 100 * 1024 * 1024)
+    )
+
+    # seconds a /dashboard/summary result is reused for
+    app.config["DASHBOARD_CACHE_TTL"] = int(os.getenv("DASHBOARD_CACHE_TTL", 30))
+
+    # users are cached for USER_CACHE_TTL seconds by the user_loader; set
+    # USER_CACHE_PATH to share the cache between worker processes
+    app.config["USER_CACHE_TTL"] = int(os.getenv("USER_CACHE_TTL", 60))
+    app.config["USER_CACHE_SIZE"] = int(os.getenv("USER_CACHE_SIZE", 4096))
+    app.config["USER_CACHE_PATH"] = os.getenv("USER_CACHE_PATH", "")
+
+    # catalog items looked up by invoice writes; same options as above.
+    # Without CATALOG_CACHE_PATH an item edit only clears the editing
+    # worker's cache, so with several workers the others can bill the old
+    # price for up to CATALOG_CACHE_TTL: set the path (or a low TTL) there
+    app.config["CATALOG_CACHE_TTL"] = int(os.getenv("CATALOG_CACHE_TTL", 300))
+    app.config["CATALOG_CACHE_SIZE"] = int(os.getenv("CATALOG_CACHE_SIZE", 10000))
+    app.config["CATALOG_CACHE_PATH"] = os.getenv("CATALOG_CACHE_PATH", "")
+
+    # bearer token lifetimes (seconds), see /auth/token
+    app.config["TOKEN_TTL"] = int(os.getenv("TOKEN_TTL", 900))
+    app.config["TOKEN_REFRESH_TTL"] = int(
+        os.getenv("TOKEN_REFRESH_TTL", 30 * 24 * 3600)
+    )
+
+    # password hashing: werkzeug method (changing it rehashes on next
+    # login), dedicated pool size, max queued/running, seconds to wait
+    app.config["PASSWORD_HASH_METHOD"] = os.getenv("PASSWORD_HASH_METHOD", "scrypt")
+    app.config["PASSWORD_HASH_WORKERS"] = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    app.config["PASSWORD_HASH_QUEUE"] = int(os.getenv("PASSWORD_HASH_QUEUE", 16))
+    app.config["PASSWORD_HASH_TIMEOUT"] = float(os.getenv("PASSWORD_HASH_TIMEOUT", 5))
+
+    # failed logins allowed per username / per IP within the window (seconds)
+    app.config["LOGIN_MAX_ATTEMPTS_USER"] = int(os.getenv("LOGIN_MAX_ATTEMPTS_USER", 5))
+    app.config["LOGIN_MAX_ATTEMPTS_IP"] = int(os.getenv("LOGIN_MAX_ATTEMPTS_IP", 20))
+    app.config["LOGIN_THROTTLE_WINDOW"] = int(os.getenv("LOGIN_THROTTLE_WINDOW", 900))
+
+    # WeasyPrint runs in a process pool; PDF_WORKERS=0 renders inline
+    app.config["PDF_WORKERS"] = int(os.getenv("PDF_WORKERS", 2))
+    app.config["PDF_MAX_QUEUE"] = int(os.getenv("PDF_MAX_QUEUE", 8))
+    app.config["PDF_RENDER_TIMEOUT"] = float(os.getenv("PDF_RENDER_TIMEOUT", 30))
+
+    # Server-Timing headers, GET /metrics and slow-request profiles; off
+    # by default. PROFILE_SAMPLE_RATE (0-1) of requests run under cProfile,
+    # dumped to PROFILE_DIR when they take over PROFILE_SLOW_MS
+    app.config["INSTRUMENTATION"] = (
+        os.getenv("INSTRUMENTATION", "0") not in ("0", "false", "")
+    )
+    app.config["PROFILE_SAMPLE_RATE"] = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+    app.config["PROFILE_SLOW_MS"] = float(os.getenv("PROFILE_SLOW_MS", 500))
+    app.config["PROFILE_DIR"] = os.getenv(
+        "PROFILE_DIR", os.path.join(app.instance_path, "profiles")
+    )
+
+    # first, so its request hooks wrap everyone else's
+    instrumentation.init_app(app)
+
     # --- Flask-Login setup ---
     login_manager.init_app(app)
     login_manager.login_view = "auth.login"
 
+    pdf_cache.init_app(app)
+    pdf_renderer.init_app(app)
+    user_cache.init_app(app)
+    catalog_cache.init_app(app)
+    api_tokens.init_app(app)
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        try:
-            return User.get_by_id(int(user_id))
-        except User.DoesNotExist:
+        return user_cache.get(int(user_id))
+
+    # Authorization: Bearer <token>; the signed claims are enough to
+    # build the user, so no session or database lookup is involved
+    @login_manager.request_loader
+    def load_user_from_token(req):
+        claims = api_tokens.verify(bearer_token(req) or "")
+        if claims is None:
             return None
+        return User(id=claims["uid"], username=claims["name"])
 
     # --- Peewee DB connection per request ---
+    # (with DB_POOL on, close() just hands the connection back to the pool)
     @app.before_request
     def _db_connect():
         if db.is_closed():
             db.connect()
 
+    # --- Tenant shard per request (DB_SHARDS) ---
+    @app.before_request
+    def _db_route_tenant():
+        if db.shards is not None and current_user.is_authenticated:
+            g.shard_token = db.use_tenant(current_user.id)
+
     @app.teardown_request
     def _db_close(exc):
-        if not db.is_closed():
-            db.close()
+        # the replica and shard (if any) are connected lazily on first use
+        for database in db.databases:
+            if not database.is_closed():
+                database.close()
+        if "shard_token" in g:
+            db.reset_tenant(g.pop("shard_token"))
 
     # --- Register blueprints ---
     from .auth import auth_bp
-    from .routes import api_bp
+    from .routes import api_bp, summary_cache
     from .views import views_bp
+    from .bulk import bulk_bp
+    from .exports import export_bp
+    from .imports import import_bp
+    from .search import search_bp
+    from .reports import reports_bp, rebuild_rollups
 
     app.register_blueprint(auth_bp, url_prefix="/auth")
     app.register_blueprint(api_bp)
     app.register_blueprint(views_bp)
+    app.register_blueprint(bulk_bp)
+    app.register_blueprint(export_bp)
+    app.register_blueprint(import_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(reports_bp)
+
+    instrumentation.register_cache("user", user_cache)
+    instrumentation.register_cache("catalog", catalog_cache)
+    instrumentation.register_cache("dashboard", summary_cache)
+
+    # --- CLI commands (flask --app run <command>) ---
+    from .commands import register_commands
+    register_commands(app)
 
     # --- Create tables if not exist ---
     with app.app_context():
+        # rollup tables added to an existing database start out empty
+        needs_rollups = not db.table_exists(RevenueRollup)
         create_tables()
+        if needs_rollups:
+            rebuild_rollups()
 
     return app
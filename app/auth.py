@@ -1,11 +1,127 @@
 from flask import Blueprint, request, jsonify
-from flask_login import login_user, logout_user, login_required
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask_login import login_user, logout_user, login_required, current_user
 
+from .cache import SQLiteCache, TTLCache
 from .models import User
+from .passwords import HasherBusy, login_throttle, password_hasher
+from .tokens import api_tokens
 
 auth_bp = Blueprint("auth", __name__)
 
+# what the user_loader and token checks need; never the password hash,
+# which would end up on disk with USER_CACHE_PATH set
+CACHED_USER_FIELDS = ("id", "username", "token_generation")
+
+
+class UserCache:
+    """
+    User rows by id for the Flask-Login user_loader, so an authenticated
+    request doesn't cost a user query. In-process by default; with
+    USER_CACHE_PATH set, shared by every worker on the host through a
+    local SQLite file.
+    """
+
+    def __init__(self, maxsize=4096, ttl=60):
+        self.backend = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        cfg = app.config
+        maxsize = int(cfg.get("USER_CACHE_SIZE", self.backend.maxsize))
+        ttl = int(cfg.get("USER_CACHE_TTL", self.backend.ttl))
+        if cfg.get("USER_CACHE_PATH"):
+            self.backend = SQLiteCache(cfg["USER_CACHE_PATH"], maxsize, ttl)
+        else:
+            self.backend = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, user_id):
+        data = self.backend.get(user_id)
+        if data is not None:
+            return User(**data)
+        try:
+            user = User.get_by_id(user_id)
+        except User.DoesNotExist:
+            return None
+        self.backend.set(
+            user_id, {name: user.__data__[name] for name in CACHED_USER_FIELDS}
+        )
+        return user
+
+    def forget(self, user_id):
+        self.backend.pop(user_id)
+
+    def stats(self):
+        return self.backend.stats()
+
+
+user_cache = UserCache()
+
+
+def set_password(user, password, revoke_tokens=True):
+    """
+    Store a new hash of password. Unless revoke_tokens is false (a rehash
+    of the same password), the user's bearer tokens stop working.
+    Raises HasherBusy when the hashing pool is saturated.
+    """
+    user.password_hash = password_hasher.hash(password)
+    fields = [User.password_hash]
+    if revoke_tokens:
+        user.token_generation += 1
+        fields.append(User.token_generation)
+    user.save(only=fields)
+    user_cache.forget(user.id)
+
+
+@api_tokens.generation_loader
+def token_generation(user_id):
+    user = user_cache.get(user_id)
+    return user and user.token_generation
+
+
+def hasher_busy():
+    response = jsonify({"error": "too many logins in progress, retry shortly"})
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
+def authenticate(data):
+    """(user, None) for valid username/password, else (None, response)."""
+    username = data.get("username")
+    password = data.get("password")
+
+    if not username or not password:
+        return None, (jsonify({"error": "username and password required"}), 400)
+
+    # checked before any hashing, so refused attempts cost nothing
+    ip = request.remote_addr
+    if login_throttle.blocked(username, ip):
+        response = jsonify({"error": "too many failed logins, try again later"})
+        response.headers["Retry-After"] = str(login_throttle.window)
+        return None, (response, 429)
+
+    try:
+        user = User.get(User.username == username)
+    except User.DoesNotExist:
+        login_throttle.failed(username, ip)
+        return None, (jsonify({"error": "invalid credentials"}), 401)
+
+    try:
+        valid = password_hasher.check(user.password_hash, password)
+    except HasherBusy:
+        return None, hasher_busy()
+    if not valid:
+        login_throttle.failed(username, ip)
+        return None, (jsonify({"error": "invalid credentials"}), 401)
+
+    login_throttle.succeeded(username, ip)
+    if password_hasher.needs_rehash(user.password_hash):
+        # hash parameters changed since this one was made; upgrade it
+        # while we have the plain password (or on a later login if busy)
+        try:
+            set_password(user, password, revoke_tokens=False)
+        except HasherBusy:
+            pass
+    return user, None
+
 
 @auth_bp.route("/register", methods=["POST"])
 def register():
@@ -26,10 +142,11 @@ def register():
     if User.select().where(User.username == username).exists():
         return jsonify({"error": "username already taken"}), 400
 
-    user = User.create(
-        username=username,
-        password_hash=generate_password_hash(password),
-    )
+    try:
+        password_hash = password_hasher.hash(password)
+    except HasherBusy:
+        return hasher_busy()
+    user = User.create(username=username, password_hash=password_hash)
 
     return jsonify({"id": user.id, "username": user.username}), 201
 
@@ -43,20 +160,9 @@ def login():
       "password": "secret"
     }
     """
-    data = request.get_json() or {}
-    username = data.get("username")
-    password = data.get("password")
-
-    if not username or not password:
-        return jsonify({"error": "username and password required"}), 400
-
-    try:
-        user = User.get(User.username == username)
-    except User.DoesNotExist:
-        return jsonify({"error": "invalid credentials"}), 401
-
-    if not check_password_hash(user.password_hash, password):
-        return jsonify({"error": "invalid credentials"}), 401
+    user, error = authenticate(request.get_json() or {})
+    if error:
+        return error
 
     login_user(user)
     return jsonify(
@@ -64,8 +170,85 @@ def login():
     )
 
 
+@auth_bp.route("/token", methods=["POST"])
+def issue_token():
+    """
+    Bearer tokens instead of a session cookie. JSON body as for /login;
+    send the access token as "Authorization: Bearer <access_token>".
+    """
+    user, error = authenticate(request.get_json() or {})
+    if error:
+        return error
+    return jsonify(api_tokens.issue(user))
+
+
+@auth_bp.route("/token/refresh", methods=["POST"])
+def refresh_token():
+    """
+    JSON body: {"refresh_token": "..."}
+    Returns a new token pair; the old refresh token stops working.
+    """
+    data = request.get_json() or {}
+    claims = api_tokens.verify(data.get("refresh_token") or "", "refresh")
+    # the only token call that looks the user up: deleted users can't refresh
+    user = claims and user_cache.get(claims["uid"])
+    if not user:
+        return jsonify({"error": "invalid refresh token"}), 401
+
+    api_tokens.revoke(claims)
+    return jsonify(api_tokens.issue(user))
+
+
+@auth_bp.route("/token/revoke", methods=["POST"])
+def revoke_token():
+    """
+    JSON body: {"token": "..."} (access or refresh token). Without a body
+    the bearer token of the request itself is revoked.
+    """
+    data = request.get_json(silent=True) or {}
+    token = data.get("token") or bearer_token(request)
+    claims = token and (
+        api_tokens.verify(token) or api_tokens.verify(token, "refresh")
+    )
+    if not claims:
+        return jsonify({"error": "invalid token"}), 400
+
+    api_tokens.revoke(claims)
+    return jsonify({"message": "token revoked"})
+
+
+def bearer_token(req):
+    scheme, _, token = req.headers.get("Authorization", "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+
+@auth_bp.route("/password", methods=["POST"])
+@login_required
+def change_password():
+    """
+    JSON body:
+    {
+      "password": "old-secret",
+      "new_password": "new-secret"
+    }
+    """
+    data = request.get_json() or {}
+    if not data.get("password") or not data.get("new_password"):
+        return jsonify({"error": "password and new_password required"}), 400
+
+    user = User.get_by_id(current_user.id)
+    try:
+        if not password_hasher.check(user.password_hash, data["password"]):
+            return jsonify({"error": "invalid credentials"}), 401
+        set_password(user, data["new_password"])
+    except HasherBusy:
+        return hasher_busy()
+    return jsonify({"message": "password changed"})
+
+
 @auth_bp.route("/logout", methods=["POST"])
 @login_required
 def logout():
+    user_cache.forget(current_user.id)
     logout_user()
     return jsonify({"message": "logged out"})
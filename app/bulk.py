@@ -0,0 +1,427 @@
+from datetime import date
+from decimal import Decimal, InvalidOperation
+import json
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from peewee import DatabaseError
+
+from .catalog import ItemGone, catalog_cache
+from .models import db, Customer, Invoice, Item, InvoiceItem, parse_id, stamp
+from .pdf_cache import pdf_cache
+from .reports import locked_invoices, record_change, snapshot
+from .routes import (
+    parse_date, resolve_catalog_items, build_invoice_lines, invoice_ids_for
+)
+
+bulk_bp = Blueprint("bulk", __name__)
+
+BULK_MAX_ROWS = 10000
+BULK_CHUNK_SIZE = 100
+# the Invoice columns a bulk row can set
+INVOICE_COLUMNS = ["customer", "issue_date", "due_date", "status", "total"]
+
+
+# -------- Helpers ----------------
+
+def read_bulk_rows():
+    """
+    Rows come as a JSON array, or as NDJSON (one object per line) when the
+    Content-Type is application/x-ndjson.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    if request.mimetype in ("application/x-ndjson", "application/ndjson"):
+        rows = []
+        for n, line in enumerate(request.get_data(as_text=True).splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                raise ValueError(f"invalid JSON on line {n}")
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ValueError("expected a JSON array of rows")
+
+    if len(rows) > BULK_MAX_ROWS:
+        raise ValueError(f"at most {BULK_MAX_ROWS} rows per request")
+    return rows
+
+
+def parse_mode():
+    mode = request.args.get("mode", "atomic")
+    if mode not in ("atomic", "best_effort"):
+        raise ValueError("mode must be atomic or best_effort")
+    return mode
+
+
+def chunked(seq, size=BULK_CHUNK_SIZE):
+    for start in range(0, len(seq), size):
+        yield seq[start:start + size]
+
+
+def owned_ids(model, ids):
+    """Which of ids (parsed with parse_id) belong to the current user, in
+    one IN query."""
+    ids = {parse_id(i) for i in ids} - {None}
+    if not ids:
+        return set()
+    return {
+        row_id for (row_id,) in
+        model.select(model.id)
+        .where((model.id.in_(ids)) & (model.user == current_user))
+        .tuples()
+    }
+
+
+def full_row(model, names, values):
+    """
+    values with every one of names set, missing ones to the field's
+    default: insert_many() takes its columns from the first row, so a
+    field only later rows set would be dropped from all of them.
+    """
+    row = {}
+    for name in names:
+        if name in values:
+            row[name] = values[name]
+        else:
+            default = model._meta.fields[name].default
+            row[name] = default() if callable(default) else default
+    return row
+
+
+def row_ids(rows, key):
+    return [r.get(key) for r in rows if isinstance(r, dict)]
+
+
+def run_bulk(rows, mode, validate, insert, update):
+    """
+    Validate every row, then write them in chunks.
+
+    validate(row) returns (id or None, payload) or raises ValueError.
+    insert(ops) / update(ops) receive lists of (index, id, payload) and
+    return {index: id}.
+
+    atomic: any invalid row or failing write leaves the database
+    untouched. best_effort: invalid rows are skipped, each chunk commits on
+    its own and a chunk that fails is retried row by row.
+    """
+    results = []
+    creates, updates = [], []
+    for index, row in enumerate(rows):
+        try:
+            row_id, payload = validate(row)
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": str(e)})
+            continue
+        if row_id is None:
+            results.append({"index": index, "status": "created"})
+            creates.append((index, None, payload))
+        else:
+            results.append({"index": index, "status": "updated"})
+            updates.append((index, row_id, payload))
+
+    def apply(write, ops):
+        for index, row_id in write(ops).items():
+            results[index]["id"] = row_id
+
+    batches = [(insert, creates), (update, updates)]
+    if mode == "atomic":
+        if any(r["status"] == "error" for r in results):
+            return bulk_response(results, mode, "no rows were written")
+        try:
+            with db.atomic():
+                for write, ops in batches:
+                    for chunk in chunked(ops):
+                        apply(write, chunk)
+        except (DatabaseError, ItemGone) as e:
+            return bulk_response(results, mode, f"no rows were written: {e}")
+        return bulk_response(results, mode)
+
+    for write, ops in batches:
+        for chunk in chunked(ops):
+            try:
+                with db.atomic():
+                    apply(write, chunk)
+                continue
+            except (DatabaseError, ItemGone):
+                pass
+            for op in chunk:
+                try:
+                    with db.atomic():
+                        apply(write, [op])
+                except (DatabaseError, ItemGone) as e:
+                    results[op[0]] = {
+                        "index": op[0], "status": "error", "error": str(e)
+                    }
+    return bulk_response(results, mode)
+
+
+def bulk_response(results, mode, error=None):
+    if error:
+        # nothing was committed, so valid rows were skipped too
+        for r in results:
+            if r["status"] != "error":
+                r["status"] = "skipped"
+                r.pop("id", None)
+
+    counts = {"created": 0, "updated": 0, "skipped": 0, "failed": 0}
+    for r in results:
+        counts["failed" if r["status"] == "error" else r["status"]] += 1
+
+    body = dict(counts, mode=mode, results=results)
+    if error:
+        body["error"] = error
+        return jsonify(body), 400
+    return jsonify(body)
+
+
+def bulk_simple(model, fields, required, decimal_fields=(), on_update=None):
+    """
+    Bulk create/update for flat per-user models (customers, items).
+    on_update(ids) is called with the ids of the updated rows once the
+    writes have committed (evicting before the commit would let a
+    concurrent read cache the old row again).
+    """
+    try:
+        mode = parse_mode()
+        rows = read_bulk_rows()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    owned = owned_ids(model, row_ids(rows, "id"))
+    updated = []
+
+    def validate(row):
+        if not isinstance(row, dict):
+            raise ValueError("row must be an object")
+
+        values = {f: row[f] for f in fields if f in row}
+        for f in decimal_fields:
+            if f in values:
+                try:
+                    values[f] = Decimal(str(values[f]))
+                except InvalidOperation:
+                    raise ValueError(f"{f} must be a number")
+
+        row_id = parse_id(row.get("id"))
+        if row.get("id") is not None and row_id not in owned:
+            raise ValueError("not found")
+        for f in required:
+            if (row_id is None or f in values) and values.get(f) in (None, ""):
+                raise ValueError(f"{f} is required")
+        return row_id, values
+
+    def insert(ops):
+        version = stamp(current_user.id)
+        new_ids = (
+            model
+            .insert_many([
+                dict(full_row(model, fields, v), user=current_user.id, **version)
+                for _, _, v in ops
+            ])
+            .returning(model.id)
+            .tuples()
+            .execute()
+        )
+        return {index: new_id for (index, _, _), (new_id,) in zip(ops, new_ids)}
+
+    def update(ops):
+        version = stamp(current_user.id)
+        for _, row_id, values in ops:
+            if values:
+                (model
+                 .update(dict(values, **version))
+                 .where(model.id == row_id)
+                 .execute())
+        updated.extend(row_id for _, row_id, _ in ops)
+        return {index: row_id for index, row_id, _ in ops}
+
+    response = run_bulk(rows, mode, validate, insert, update)
+    if on_update and updated:
+        on_update(updated)
+    return response
+
+
+# -------- Endpoints ----------------
+
+@bulk_bp.route("/customers/bulk", methods=["POST"])
+@login_required
+def bulk_customers():
+    """
+    JSON array (or NDJSON) of customers; rows with "id" are updates:
+    [
+      {"name": "Acme", "email": "billing@acme.test"},
+      {"id": 4, "phone": "9999999999"}
+    ]
+    ?mode=atomic (default) | best_effort
+    """
+    def on_update(ids):
+        pdf_cache.invalidate(*invoice_ids_for(Invoice.customer.in_(ids)))
+
+    return bulk_simple(
+        Customer, ["name", "email", "address", "phone"], ["name"],
+        on_update=on_update,
+    )
+
+
+@bulk_bp.route("/items/bulk", methods=["POST"])
+@login_required
+def bulk_items():
+    """
+    JSON array (or NDJSON) of catalog items; rows with "id" are updates:
+    [
+      {"name": "Consulting Hour", "unit_price": 100.0},
+      {"id": 2, "unit_price": 120.0}
+    ]
+    ?mode=atomic (default) | best_effort
+    """
+    def on_update(ids):
+        catalog_cache.forget(current_user.id, *ids)
+        pdf_cache.invalidate(*invoice_ids_for(
+            Invoice.id.in_(
+                InvoiceItem.select(InvoiceItem.invoice)
+                .where(InvoiceItem.item.in_(ids))
+            )
+        ))
+
+    return bulk_simple(
+        Item, ["name", "description", "unit_price"], ["name", "unit_price"],
+        decimal_fields=["unit_price"], on_update=on_update,
+    )
+
+
+@bulk_bp.route("/invoices/bulk", methods=["POST"])
+@login_required
+def bulk_invoices():
+    """
+    JSON array (or NDJSON) of invoices, same shape as POST /invoices;
+    rows with "id" are updates (and replace lines if "items" is given):
+    [
+      {"customer_id": 1, "items": [{"item_id": 1, "quantity": 2}]},
+      {"id": 7, "status": "paid"}
+    ]
+    ?mode=atomic (default) | best_effort
+    """
+    try:
+        mode = parse_mode()
+        rows = read_bulk_rows()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # ownership for every referenced row is checked up front, one query
+    # per table
+    owned = owned_ids(Invoice, row_ids(rows, "id"))
+    customers = owned_ids(Customer, row_ids(rows, "customer_id"))
+    catalog = resolve_catalog_items(
+        line.get("item_id")
+        for row in rows if isinstance(row, dict)
+        for line in (row.get("items") or []) if isinstance(line, dict)
+    )
+
+    def validate(row):
+        if not isinstance(row, dict):
+            raise ValueError("row must be an object")
+
+        row_id = parse_id(row.get("id"))
+        if row.get("id") is not None and row_id not in owned:
+            raise ValueError("not found")
+
+        values = {}
+        if row_id is None and not row.get("customer_id"):
+            raise ValueError("customer_id is required")
+        if "customer_id" in row:
+            customer_id = parse_id(row["customer_id"])
+            if customer_id not in customers:
+                raise ValueError("customer not found")
+            values["customer"] = customer_id
+
+        for field in ("issue_date", "due_date"):
+            if field in row:
+                try:
+                    values[field] = parse_date(row[field])
+                except (TypeError, ValueError):
+                    raise ValueError(f"{field} must be YYYY-MM-DD")
+        if "status" in row:
+            values["status"] = row["status"]
+
+        if row_id is None:
+            values["issue_date"] = values.get("issue_date") or date.today()
+            values["status"] = values.get("status") or "draft"
+
+        lines = None
+        if row_id is None or "items" in row:
+            items = row.get("items") or []
+            if not isinstance(items, list) or not all(
+                isinstance(line, dict) for line in items
+            ):
+                raise ValueError("items must be a list of objects")
+            lines, values["total"] = build_invoice_lines(items, catalog)
+        return row_id, (values, lines)
+
+    def insert_lines(ops):
+        version = stamp(current_user.id)
+        line_rows = [
+            dict(line, invoice=inv_id, **version)
+            for _, inv_id, (_, lines) in ops if lines
+            for line in lines
+        ]
+        catalog_cache.check(current_user.id, [line["item"] for line in line_rows])
+        for chunk in chunked(line_rows):
+            InvoiceItem.insert_many(chunk).execute()
+
+    def insert(ops):
+        version = stamp(current_user.id)
+        new_ids = (
+            Invoice
+            .insert_many([
+                dict(
+                    full_row(Invoice, INVOICE_COLUMNS, values),
+                    user=current_user.id, **version,
+                )
+                for _, _, (values, _) in ops
+            ])
+            .returning(Invoice.id)
+            .tuples()
+            .execute()
+        )
+        ops = [
+            (index, inv_id, payload)
+            for (index, _, payload), (inv_id,) in zip(ops, new_ids)
+        ]
+        insert_lines(ops)
+        for _, _, (values, _) in ops:
+            record_change(new={
+                "user": current_user.id,
+                "customer": values["customer"],
+                "issue_date": values["issue_date"],
+                "due_date": values.get("due_date"),
+                "status": values["status"],
+                "total": values["total"],
+            })
+        return {index: inv_id for index, inv_id, _ in ops}
+
+    def update(ops):
+        before = locked_invoices([op[1] for op in ops])
+        version = stamp(current_user.id)
+        for _, inv_id, (values, _) in ops:
+            if values:
+                (Invoice
+                 .update(dict(values, **version))
+                 .where(Invoice.id == inv_id)
+                 .execute())
+                record_change(
+                    snapshot(before[inv_id]),
+                    snapshot(before[inv_id], **values),
+                )
+
+        replaced = [inv_id for _, inv_id, (_, lines) in ops if lines is not None]
+        if replaced:
+            InvoiceItem.delete().where(InvoiceItem.invoice.in_(replaced)).execute()
+        insert_lines(ops)
+
+        pdf_cache.invalidate(*[inv_id for _, inv_id, _ in ops])
+        return {index: inv_id for index, inv_id, _ in ops}
+
+    return run_bulk(rows, mode, validate, insert, update)
@@ -0,0 +1,113 @@
+from .cache import SQLiteCache, TTLCache
+from .models import Item, parse_id
+
+
+class ItemGone(Exception):
+    """A cached catalog item was deleted (seen by CatalogCache.check)."""
+
+    def __init__(self, item_id):
+        super().__init__(f"item {item_id} not found")
+        self.item_id = item_id
+
+
+class CatalogCache:
+    """
+    Catalog items by (user id, item id) for invoice writes, which look up
+    the price of every line's item. In-process by default; with
+    CATALOG_CACHE_PATH set, shared by every worker on the host through a
+    local SQLite file, so an item edit is seen by all of them at once.
+    In-process caches are only invalidated in the process that made the
+    edit: other workers can use the old price for up to the TTL.
+
+    Cached items are detached copies for reading; load items to be
+    edited from the database.
+    """
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.backend = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def init_app(self, app):
+        cfg = app.config
+        maxsize = int(cfg.get("CATALOG_CACHE_SIZE", self.backend.maxsize))
+        ttl = int(cfg.get("CATALOG_CACHE_TTL", self.backend.ttl))
+        if cfg.get("CATALOG_CACHE_PATH"):
+            self.backend = SQLiteCache(cfg["CATALOG_CACHE_PATH"], maxsize, ttl)
+        else:
+            self.backend = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_many(self, user_id, item_ids):
+        """{id: Item} for those of item_ids the user owns; the ones not
+        cached are loaded with one IN query. Ids are keyed as ints ("1"
+        finds item 1); ones that aren't numbers are never found."""
+        found, missing = {}, set()
+        for item_id in int_ids(item_ids):
+            data = self.backend.get((user_id, item_id))
+            if data is None:
+                missing.add(item_id)
+            else:
+                found[item_id] = load(data)
+
+        if missing:
+            for it in Item.select().where(
+                (Item.id.in_(missing)) & (Item.user == user_id)
+            ):
+                self.backend.set((user_id, it.id), dump(it))
+                found[it.id] = it
+        return found
+
+    def get(self, user_id, item_id):
+        found = self.get_many(user_id, [item_id])
+        return next(iter(found.values()), None)
+
+    def check(self, user_id, item_ids):
+        """
+        Raise ItemGone unless every one of item_ids is still in the
+        user's catalog, with one primary key query. Call it inside the
+        write's transaction, after its first write (so on SQLite the write
+        lock is held): an item deleted by another worker can still be in
+        this worker's cache, and a line must never point at it.
+        """
+        ids = int_ids(item_ids)
+        if not ids:
+            return
+        present = {
+            item_id for (item_id,) in
+            Item.select(Item.id)
+            .where((Item.id.in_(ids)) & (Item.user == user_id))
+            .tuples()
+        }
+        gone = ids - present
+        if gone:
+            self.forget(user_id, *gone)
+            raise ItemGone(min(gone))
+
+    def forget(self, user_id, *item_ids):
+        for item_id in int_ids(item_ids):
+            self.backend.pop((user_id, item_id))
+
+    def stats(self):
+        return self.backend.stats()
+
+
+def int_ids(item_ids):
+    return {parse_id(i) for i in item_ids} - {None}
+
+
+def dump(item):
+    # JSON-safe for the SQLite backend: Decimal and datetime values are
+    # kept as strings, which their fields parse back in load()
+    return {
+        name: value if value is None or isinstance(value, (int, str))
+        else str(value)
+        for name, value in item.__data__.items()
+    }
+
+
+def load(data):
+    fields = Item._meta.fields
+    return Item(**{
+        name: fields[name].python_value(value) for name, value in data.items()
+    })
+
+
+catalog_cache = CatalogCache()
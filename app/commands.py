@@ -0,0 +1,388 @@
+from collections import defaultdict
+import logging
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+
+import click
+from peewee import (
+    JOIN, IntegerField, Model, OperationalError, SqliteDatabase, fn
+)
+
+from .models import (
+    db, User, Customer, Invoice, Item, InvoiceItem, RevenueRollup,
+    AgingRollup, Tombstone, create_tables, current_version, make_database,
+    raise_version, stamp,
+)
+from .reports import rebuild_rollups
+
+REPAIR_CHUNK_SIZE = 500
+COPY_CHUNK_SIZE = 500
+
+
+def line_totals():
+    """Per-invoice SUM of line totals, as a subquery."""
+    return (
+        InvoiceItem
+        .select(
+            InvoiceItem.invoice,
+            fn.SUM(InvoiceItem.quantity * InvoiceItem.unit_price)
+            .alias("line_total"),
+        )
+        .group_by(InvoiceItem.invoice)
+        .alias("sums")
+    )
+
+
+def drifted_invoices(user_id=None):
+    """Invoices whose stored total doesn't match the sum of their lines."""
+    sums = line_totals()
+    computed = fn.ROUND(fn.COALESCE(sums.c.line_total, 0), 2)
+    query = (
+        Invoice
+        .select(
+            Invoice.id, Invoice.user, Invoice.total,
+            computed.alias("line_total"),
+        )
+        .join(sums, JOIN.LEFT_OUTER, on=(sums.c.invoice_id == Invoice.id))
+        .where(fn.ROUND(Invoice.total, 2) != computed)
+        .order_by(Invoice.id)
+    )
+    if user_id is not None:
+        query = query.where(Invoice.user == user_id)
+    return query
+
+
+def repair_totals(user_id, invoice_ids):
+    """Recompute totals for user_id's invoice_ids with one UPDATE per
+    chunk."""
+    line_sum = (
+        InvoiceItem
+        .select(fn.COALESCE(
+            fn.SUM(InvoiceItem.quantity * InvoiceItem.unit_price), 0
+        ))
+        .where(InvoiceItem.invoice == Invoice.id)
+    )
+    for start in range(0, len(invoice_ids), REPAIR_CHUNK_SIZE):
+        chunk = invoice_ids[start:start + REPAIR_CHUNK_SIZE]
+        with db.atomic():
+            (Invoice
+             .update(total=fn.ROUND(line_sum, 2), **stamp(user_id))
+             .where(Invoice.id.in_(chunk))
+             .execute())
+
+
+def tenant_databases(user_id=None):
+    """
+    Route to each database holding tenant data in turn: the main one, or
+    with DB_SHARDS on every shard (only user_id's when given).
+    """
+    if db.shards is None:
+        yield db.primary
+        return
+    if user_id is not None:
+        shards = [db.shards.for_user(user_id)]
+    else:
+        shards = db.shards.all()
+    for shard in shards:
+        with db.using(shard):
+            yield shard
+
+
+@click.command("check-totals")
+@click.option("--repair", is_flag=True, help="Fix the totals that drifted.")
+@click.option("--user-id", type=int, help="Only check this user's invoices.")
+def check_totals(repair, user_id):
+    """Find invoices whose stored total drifted from their line items."""
+    count = 0
+    for _ in tenant_databases(user_id):
+        drifted = defaultdict(list)  # user id -> invoice ids
+        for row in drifted_invoices(user_id).dicts().iterator():
+            drifted[row["user"]].append(row["id"])
+            click.echo(
+                f"invoice {row['id']}: stored {row['total']}, "
+                f"lines {row['line_total']}"
+            )
+        if repair:
+            for uid, invoice_ids in drifted.items():
+                repair_totals(uid, invoice_ids)
+                # the rollups were built from the wrong totals
+                rebuild_rollups(uid)
+        count += sum(len(invoice_ids) for invoice_ids in drifted.values())
+
+    if not count:
+        click.echo("all invoice totals are consistent")
+        return
+
+    click.echo(f"{count} invoice(s) drifted")
+    if repair:
+        click.echo(f"repaired {count} invoice(s)")
+
+
+@click.command("rebuild-rollups")
+@click.option("--user-id", type=int, help="Only rebuild this user's rollups.")
+def rebuild_rollups_command(user_id):
+    """Recompute the reporting rollup tables from the invoices."""
+    for _ in tenant_databases(user_id):
+        rebuild_rollups(user_id)
+    click.echo("rollups rebuilt")
+
+
+@click.command("migrate-indexes")
+def migrate_indexes():
+    """Bring an existing database's indexes up to date with models.py."""
+    databases = [db.primary] + (db.shards.all() if db.shards else [])
+    for database in databases:
+        with db.using(database):
+            # CREATE ... IF NOT EXISTS for every table and index in models.py
+            create_tables()
+
+            # refresh planner statistics so the new indexes get picked
+            db.execute_sql("ANALYZE")
+    click.echo("indexes up to date")
+
+
+class _QueryCapture(logging.Handler):
+    """Collects the (sql, params) pairs peewee logs at DEBUG level."""
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.queries = []
+
+    def emit(self, record):
+        if isinstance(record.msg, tuple):
+            self.queries.append(record.msg)
+
+
+def hot_queries(user_id):
+    """Run the per-user queries behind the API and return their SQL."""
+    from .routes import build_summary, filter_invoices, invoice_lines
+
+    invoice_filters = [
+        {"status": "sent"},
+        {"customer_id": "1"},
+        {"issue_date_from": "2025-01-01", "issue_date_to": "2025-12-31"},
+        {"due_date_from": "2025-01-01", "due_date_to": "2025-12-31"},
+    ]
+    queries = [
+        Customer.select().where(Customer.user == user_id)
+        .where(Customer.id > 0).order_by(Customer.id).limit(50),
+        Item.select().where(Item.user == user_id)
+        .where(Item.id > 0).order_by(Item.id).limit(50),
+        Item.select().where((Item.id.in_([1, 2])) & (Item.user == user_id)),
+        # duplicate checks of the CSV imports
+        Customer.select(Customer.name, Customer.email)
+        .where(Customer.user == user_id),
+        Item.select(Item.name).where(Item.user == user_id),
+        Invoice.select().where(Invoice.user == user_id)
+        .where(Invoice.id > 0).order_by(Invoice.id).limit(50),
+        invoice_lines(1),
+        RevenueRollup.select().where(
+            (RevenueRollup.user == user_id) & (RevenueRollup.month >= "2025-01")
+        ),
+        AgingRollup.select().where(AgingRollup.user == user_id),
+    ] + [
+        filter_invoices(Invoice.select().where(Invoice.user == user_id), args)
+        for args in invoice_filters
+    ]
+
+    capture = _QueryCapture()
+    logger = logging.getLogger("peewee")
+    old_level = logger.level
+    logger.addHandler(capture)
+    logger.setLevel(logging.DEBUG)
+    try:
+        for query in queries:
+            list(query)
+        build_summary(user_id)
+    finally:
+        logger.removeHandler(capture)
+        logger.setLevel(old_level)
+    return capture.queries
+
+
+# "SCAN invoice" (or "SCAN TABLE invoice" on older SQLite) without
+# "USING ... INDEX" means every row is read
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?!.*USING)")
+
+
+def query_plan(sql, params=()):
+    """The detail lines of EXPLAIN QUERY PLAN sql (SQLite only)."""
+    return [
+        row[-1] for row in db.execute_sql("EXPLAIN QUERY PLAN " + sql, params)
+    ]
+
+
+def full_scans(plan):
+    """The lines of a query plan that read a whole tenant table."""
+    tables = {
+        m._meta.table_name for m in
+        (Customer, Invoice, Item, InvoiceItem, RevenueRollup, AgingRollup)
+    }
+    return [
+        line for line in plan
+        if (m := _FULL_SCAN.match(line)) and m.group(1) in tables
+    ]
+
+
+@click.command("check-query-plans")
+@click.option("--user-id", type=int, default=1, show_default=True)
+@click.option("--verbose", "-v", is_flag=True, help="Print every plan.")
+def check_query_plans(user_id, verbose):
+    """
+    EXPLAIN QUERY PLAN the hot per-user queries and exit non-zero if any
+    of them falls back to a full table scan (SQLite only).
+    """
+    if not isinstance(db.primary, SqliteDatabase):
+        click.echo("query plan check only supports SQLite")
+        return
+
+    failures = 0
+    for _ in tenant_databases(user_id):
+        for sql, params in hot_queries(user_id):
+            plan = query_plan(sql, params)
+            scans = full_scans(plan)
+            if scans:
+                failures += 1
+            if scans or verbose:
+                click.echo(("FULL SCAN: " if scans else "ok: ") + sql)
+                for line in plan:
+                    click.echo(f"    {line}")
+
+    if failures:
+        click.echo(f"{failures} query(s) fall back to a full table scan")
+        sys.exit(1)
+    click.echo("no full table scans")
+
+
+@click.command("split-shards")
+@click.option("--user-id", type=int, help="Only move this user.")
+@click.option("--purge", is_flag=True,
+              help="Delete the moved rows from the main database.")
+def split_shards(user_id, purge):
+    """
+    Copy each user's customers, items and invoices from the main database
+    into their shard (DB_SHARDS). Ids are kept; safe to re-run.
+    """
+    if db.shards is None:
+        click.echo("set DB_SHARDS first")
+        sys.exit(1)
+
+    users = User.select(User.id).order_by(User.id)
+    if user_id is not None:
+        users = users.where(User.id == user_id)
+
+    for (uid,) in users.tuples():
+        owned_invoices = Invoice.select(Invoice.id).where(Invoice.user == uid)
+        tables = [
+            (Customer, Customer.user == uid),
+            (Item, Item.user == uid),
+            (Invoice, Invoice.user == uid),
+            (InvoiceItem, InvoiceItem.invoice.in_(owned_invoices)),
+            (Tombstone, Tombstone.user == uid),
+        ]
+        shard = db.shards.for_user(uid)
+        copied = 0
+        for model, owned in tables:
+            with db.using(db.primary):
+                rows = model.select().where(owned).dicts().iterator()
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == COPY_CHUNK_SIZE:
+                    copied += copy_rows(shard, model, batch)
+                    batch = []
+            copied += copy_rows(shard, model, batch)
+
+        with db.using(db.primary):
+            version = current_version(uid)
+        with db.using(shard):
+            # the copied rows keep their versions; later writes in the
+            # shard must still come after them for ?since= clients
+            raise_version(uid, version)
+            rebuild_rollups(uid)
+
+        if purge:
+            with db.using(db.primary), db.atomic():
+                for model, owned in reversed(tables):
+                    model.delete().where(owned).execute()
+                for model in (RevenueRollup, AgingRollup):
+                    model.delete().where(model.user == uid).execute()
+        click.echo(f"user {uid}: {copied} row(s) -> {shard.database}")
+
+
+def copy_rows(shard, model, rows):
+    if rows:
+        with db.using(shard), db.atomic():
+            # rows already copied by an earlier run are left alone
+            model.insert_many(rows).on_conflict_ignore().execute()
+    return len(rows)
+
+
+@click.command("stress-db")
+@click.option("--threads", default=16, show_default=True)
+@click.option("--writes", default=200, show_default=True,
+              help="Write transactions per thread.")
+def stress_db(threads, writes):
+    """
+    Hammer a scratch database, opened with the configured pragmas and
+    pooling, from concurrent reader/writer threads. Exits non-zero if any
+    transaction failed (e.g. "database is locked").
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = make_database(os.path.join(tmp, "stress.db"))
+
+        class Counter(Model):
+            worker = IntegerField(index=True)
+            value = IntegerField()
+
+            class Meta:
+                database = scratch
+
+        scratch.create_tables([Counter])
+        errors = []
+
+        def work(worker):
+            for n in range(writes):
+                # one connection per "request", like the app does
+                try:
+                    with scratch.connection_context():
+                        with scratch.atomic():
+                            Counter.insert(worker=worker, value=n).execute()
+                        Counter.select().where(Counter.worker == worker).count()
+                except OperationalError as e:
+                    errors.append(str(e))
+
+        started = time.perf_counter()
+        pool = [threading.Thread(target=work, args=(i,)) for i in range(threads)]
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.perf_counter() - started
+
+        with scratch.connection_context():
+            written = Counter.select().count()
+            journal = scratch.execute_sql("PRAGMA journal_mode").fetchone()[0]
+        if hasattr(scratch, "close_all"):
+            scratch.close_all()
+
+    click.echo(
+        f"{written} writes from {threads} threads in {elapsed:.2f}s "
+        f"({written / elapsed:.0f}/s, journal_mode={journal})"
+    )
+    if errors:
+        click.echo(f"{len(errors)} transaction(s) failed, e.g. {errors[0]}")
+        sys.exit(1)
+
+
+def register_commands(app):
+    app.cli.add_command(check_totals)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(migrate_indexes)
+    app.cli.add_command(check_query_plans)
+    app.cli.add_command(split_shards)
+    app.cli.add_command(stress_db)
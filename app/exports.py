@@ -0,0 +1,175 @@
+import csv
+from datetime import date
+from decimal import Decimal
+import io
+from itertools import groupby
+
+from flask import Blueprint, Response, current_app, jsonify, request
+from flask_login import login_required, current_user
+from peewee import JOIN
+
+from .models import Customer, Invoice, Item, InvoiceItem
+from .routes import db_stream, filter_invoices, replica_reads
+from .serialization import json_default
+
+export_bp = Blueprint("export", __name__)
+
+# invoices per keyset batch; memory use is bounded by one batch's rows
+EXPORT_BATCH_SIZE = 500
+
+CSV_COLUMNS = [
+    "invoice_id", "customer_id", "customer_name", "customer_email",
+    "issue_date", "due_date", "status", "invoice_total",
+    "line_id", "item_id", "item_name", "quantity", "unit_price", "line_total",
+]
+
+
+def export_rows(invoices, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Flat dicts, one per invoice line (one with empty line fields for an
+    invoice without lines), ordered by invoice then line. The invoices are
+    walked in keyset batches and each batch is read with .iterator(), so
+    neither the database driver nor peewee buffers the whole export.
+    """
+    last_id = 0
+    while True:
+        batch = [
+            inv_id for (inv_id,) in
+            invoices.select(Invoice.id)
+            .where(Invoice.id > last_id)
+            .order_by(Invoice.id)
+            .limit(batch_size)
+            .tuples()
+        ]
+        if not batch:
+            return
+
+        rows = (
+            Invoice
+            .select(
+                Invoice.id.alias("invoice_id"),
+                Invoice.customer.alias("customer_id"),
+                Customer.name.alias("customer_name"),
+                Customer.email.alias("customer_email"),
+                Invoice.issue_date,
+                Invoice.due_date,
+                Invoice.status,
+                Invoice.total.alias("invoice_total"),
+                InvoiceItem.id.alias("line_id"),
+                InvoiceItem.item.alias("item_id"),
+                Item.name.alias("item_name"),
+                InvoiceItem.quantity,
+                InvoiceItem.unit_price,
+            )
+            .join(Customer)
+            .switch(Invoice)
+            .join(InvoiceItem, JOIN.LEFT_OUTER)
+            .join(Item, JOIN.LEFT_OUTER)
+            .where(Invoice.id.in_(batch))
+            .order_by(Invoice.id, InvoiceItem.id)
+            .dicts()
+            .iterator()
+        )
+        for row in rows:
+            if row["line_id"] is not None:
+                row["line_total"] = row["quantity"] * row["unit_price"]
+            else:
+                row["line_total"] = None
+            yield row
+        last_id = batch[-1]
+
+
+def invoices_to_export():
+    """The current user's invoices, narrowed by the GET /invoices filters."""
+    return filter_invoices(
+        Invoice.select().where(Invoice.user == current_user), request.args
+    )
+
+
+def csv_cell(value):
+    # numbers and dates written the way the JSON responses encode them
+    if isinstance(value, (Decimal, date)):
+        return json_default(value)
+    return value
+
+
+def csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for n, row in enumerate(rows, 1):
+        writer.writerow([csv_cell(row[c]) for c in CSV_COLUMNS])
+        # hand out a chunk every few hundred rows, not one per row
+        if n % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_lines(rows):
+    """One JSON object per invoice, with its lines under "items"."""
+    dumps = current_app.json.dumps
+    for invoice_id, lines in groupby(rows, key=lambda r: r["invoice_id"]):
+        first = next(lines)
+        invoice = {
+            "id": invoice_id,
+            "customer_id": first["customer_id"],
+            "customer_name": first["customer_name"],
+            "customer_email": first["customer_email"],
+            "issue_date": first["issue_date"],
+            "due_date": first["due_date"],
+            "status": first["status"],
+            "total": first["invoice_total"],
+            "items": [
+                {
+                    "id": line["line_id"],
+                    "item_id": line["item_id"],
+                    "item_name": line["item_name"],
+                    "quantity": line["quantity"],
+                    "unit_price": line["unit_price"],
+                    "total": line["line_total"],
+                }
+                for line in [first, *lines] if line["line_id"] is not None
+            ],
+        }
+        yield dumps(invoice) + "\n"
+
+
+def export_response(render, mimetype, filename):
+    try:
+        invoices = invoices_to_export()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    response = Response(
+        db_stream(lambda: render(export_rows(invoices))), mimetype=mimetype
+    )
+    response.headers["Content-Disposition"] = (
+        f'attachment; filename="{filename}"'
+    )
+    return response
+
+
+@export_bp.route("/export/invoices.csv", methods=["GET"])
+@login_required
+@replica_reads
+def export_invoices_csv():
+    """
+    One row per invoice line, with invoice and customer columns repeated.
+    Takes the same filters as GET /invoices (status, customer_id, dates).
+    """
+    return export_response(csv_lines, "text/csv", "invoices.csv")
+
+
+@export_bp.route("/export/invoices.ndjson", methods=["GET"])
+@login_required
+@replica_reads
+def export_invoices_ndjson():
+    """
+    One JSON object per line of output, per invoice with its items.
+    Takes the same filters as GET /invoices (status, customer_id, dates).
+    """
+    return export_response(
+        ndjson_lines, "application/x-ndjson", "invoices.ndjson"
+    )
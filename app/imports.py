@@ -0,0 +1,240 @@
+import csv
+from decimal import Decimal, InvalidOperation
+import io
+import json
+
+from flask import Blueprint, Response, jsonify, request
+from flask_login import login_required, current_user
+from peewee import DatabaseError, fn
+
+from .models import db, Customer, Item, stamp
+from .routes import db_stream
+
+import_bp = Blueprint("import", __name__)
+
+IMPORT_CHUNK_SIZE = 1000
+# per-row errors listed in the report; further ones are only counted
+IMPORT_MAX_ERRORS = 1000
+
+
+# -------- Helpers ----------------
+
+def csv_rows(required):
+    """
+    csv.DictReader over the upload, read incrementally: either a
+    multipart "file" field or a raw text/csv body. Header names are
+    matched case-insensitively.
+    Raises ValueError with a client-facing message on a bad header.
+    """
+    if "file" in request.files:
+        # take the upload's file away from the request: Flask closes the
+        # request's files before a streamed (?progress=1) body is read
+        upload = request.files["file"]
+        stream, upload.stream = upload.stream, io.BytesIO()
+    else:
+        stream = io.BufferedReader(request.stream)
+    reader = csv.DictReader(
+        io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    )
+    if not reader.fieldnames:
+        raise ValueError("expected a CSV file with a header row")
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    missing = [f for f in required if f not in reader.fieldnames]
+    if missing:
+        raise ValueError(f"missing columns: {', '.join(missing)}")
+    return reader
+
+
+def folded_in(column, values):
+    """
+    column equal to one of values, ignoring case. LOWER() on SQLite only
+    folds ASCII, hence the exact match as well.
+    """
+    return fn.LOWER(column).in_({v.lower() for v in values}) | column.in_(values)
+
+
+def cell(row, name):
+    """A stripped cell value, None for a blank or missing one."""
+    value = (row.get(name) or "").strip()
+    return value or None
+
+
+def insert_rows(model, rows):
+    """
+    Same as model.insert_many(rows) for rows with the same keys, but the
+    statement is built once and the driver binds every row (executemany)
+    instead of peewee rendering thousands of VALUES tuples; about five
+    times faster for import-sized chunks.
+    """
+    fields = [f for f in model._meta.sorted_fields if f.name in rows[0]]
+    sql, _ = model.insert({f: None for f in fields}).sql()
+    db.cursor().executemany(
+        sql, [[f.db_value(row[f.name]) for f in fields] for row in rows]
+    )
+
+
+def run_import(model, reader, parse, existing):
+    """
+    Validate and insert rows from reader, IMPORT_CHUNK_SIZE per
+    transaction. parse(row) returns (dedupe key, values) or raises
+    ValueError. Rows whose key repeats within the chunk, or is among
+    existing(values) (the keys of stored rows matching a chunk's values,
+    the file's earlier chunks included), are skipped; so memory stays at
+    one chunk whatever the size of the file or of the table.
+
+    Yields a progress report after every chunk; the last one has
+    "done": true and the per-row errors (by CSV line number).
+    """
+    report = {"rows": 0, "created": 0, "duplicates": 0, "failed": 0}
+    errors = []
+    batch = {}  # dedupe key -> (line, values)
+
+    def fail(line, message):
+        report["failed"] += 1
+        if len(errors) < IMPORT_MAX_ERRORS:
+            errors.append({"line": line, "error": message})
+
+    def flush():
+        stored = batch.keys() & existing([v for _, v in batch.values()])
+        report["duplicates"] += len(stored)
+        rows = [row for key, row in batch.items() if key not in stored]
+        batch.clear()
+        if not rows:
+            return
+        try:
+            with db.atomic():
+                version = stamp(current_user.id)
+                insert_rows(
+                    model, [dict(values, **version) for _, values in rows]
+                )
+            report["created"] += len(rows)
+        except DatabaseError:
+            # find the offending rows; the rest still go in
+            for line, values in rows:
+                try:
+                    with db.atomic():
+                        model.insert(
+                            dict(values, **stamp(current_user.id))
+                        ).execute()
+                    report["created"] += 1
+                except DatabaseError as e:
+                    fail(line, str(e))
+
+    for row in reader:
+        report["rows"] += 1
+        line = reader.line_num
+        try:
+            key, values = parse(row)
+        except ValueError as e:
+            fail(line, str(e))
+            continue
+        if key in batch:
+            report["duplicates"] += 1
+            continue
+        batch[key] = (line, dict(values, user=current_user.id))
+
+        if len(batch) >= IMPORT_CHUNK_SIZE:
+            flush()
+            yield dict(report, done=False)
+
+    if batch:
+        flush()
+    yield dict(report, done=True, errors=errors)
+
+
+def import_response(model, required, parse, existing):
+    """
+    The final report as JSON, or with ?progress=1 every progress report
+    as NDJSON while the file is being imported.
+    """
+    try:
+        reader = csv_rows(required)
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    reports = run_import(model, reader, parse, existing)
+    if request.args.get("progress") in ("1", "true"):
+        return Response(
+            db_stream(lambda: (json.dumps(r) + "\n" for r in reports)),
+            mimetype="application/x-ndjson",
+        )
+
+    try:
+        for report in reports:
+            pass
+    except UnicodeDecodeError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(report)
+
+
+# -------- Endpoints ----------------
+
+@import_bp.route("/import/customers", methods=["POST"])
+@login_required
+def import_customers():
+    """
+    CSV upload (multipart "file" field or a text/csv body) with a header
+    row: name,email,address,phone (only name is required).
+    A customer is keyed by email, or by name when it has no email, in the
+    file and in the database alike; one whose key already exists is
+    skipped as a duplicate. ?progress=1 streams progress as NDJSON.
+    """
+    def key_for(name, email):
+        return ("email", email.lower()) if email else ("name", name.lower())
+
+    def existing(rows):
+        emails = {v["email"] for v in rows if v["email"]}
+        names = {v["name"] for v in rows if not v["email"]}
+        query = (
+            Customer.select(Customer.name, Customer.email)
+            .where(
+                (Customer.user == current_user) & (
+                    folded_in(Customer.email, emails) | (
+                        (Customer.email.is_null() | (Customer.email == "")) &
+                        folded_in(Customer.name, names)
+                    )
+                )
+            )
+        )
+        return {key_for(name, email) for name, email in query.tuples()}
+
+    def parse(row):
+        values = {
+            f: cell(row, f) for f in ("name", "email", "address", "phone")
+        }
+        if not values["name"]:
+            raise ValueError("name is required")
+        return key_for(values["name"], values["email"]), values
+
+    return import_response(Customer, ["name"], parse, existing)
+
+
+@import_bp.route("/import/items", methods=["POST"])
+@login_required
+def import_items():
+    """
+    CSV upload (multipart "file" field or a text/csv body) with a header
+    row: name,description,unit_price (name and unit_price required).
+    An item whose name already exists is skipped as a duplicate.
+    ?progress=1 streams progress as NDJSON.
+    """
+    def existing(rows):
+        query = Item.select(Item.name).where(
+            (Item.user == current_user) &
+            folded_in(Item.name, {v["name"] for v in rows})
+        )
+        return {name.lower() for (name,) in query.tuples()}
+
+    def parse(row):
+        values = {f: cell(row, f) for f in ("name", "description", "unit_price")}
+        if not values["name"]:
+            raise ValueError("name is required")
+        try:
+            values["unit_price"] = Decimal(values["unit_price"] or "")
+        except InvalidOperation:
+            raise ValueError("unit_price must be a number")
+        if not values["unit_price"].is_finite():
+            raise ValueError("unit_price must be a number")
+        return values["name"].lower(), values
+
+    return import_response(Item, ["name", "unit_price"], parse, existing)
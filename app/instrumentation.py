@@ -0,0 +1,247 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+
+from flask import (
+    Response, before_render_template, g, has_request_context, request,
+    template_rendered
+)
+
+from .models import query_hooks
+
+# upper bounds (seconds) of the per-route latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# phases timed within a request besides the database: templates, WeasyPrint
+# (including the wait for a pool worker) and jsonify
+PHASES = ("render", "pdf", "json")
+
+
+class Instrumentation:
+    """
+    Opt-in (INSTRUMENTATION=1) request instrumentation: a Server-Timing
+    header on every response with the time spent in SQL (and the query
+    count), templates, PDF rendering and JSON encoding; per-route
+    counters and latency histograms at GET /metrics in the Prometheus
+    text format; and, with PROFILE_SAMPLE_RATE set, a cProfile dump of
+    sampled requests slower than PROFILE_SLOW_MS.
+
+    Times run until the view returns, so a streamed body (exports, the
+    unpaged lists, ?progress=1 imports) is not included. Metrics are per
+    process; scrape every worker.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.enabled = False
+        self.buckets = buckets
+        self.profile_rate = 0.0
+        self.profile_slow = 0.5
+        self.profile_dir = None
+        self.caches = {}
+        self._lock = threading.Lock()
+        # (method, route) -> bucket counts, then the +Inf count
+        self._latency = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._latency_sum = defaultdict(float)
+        self._requests = defaultdict(int)  # (method, route, status)
+        self._queries = defaultdict(int)  # (method, route)
+        self._phase_seconds = defaultdict(float)  # (method, route, phase)
+
+    def init_app(self, app):
+        cfg = app.config
+        self.enabled = bool(cfg.get("INSTRUMENTATION"))
+        if not self.enabled:
+            return
+        self.profile_rate = float(cfg.get("PROFILE_SAMPLE_RATE", 0))
+        self.profile_slow = float(cfg.get("PROFILE_SLOW_MS", 500)) / 1000
+        self.profile_dir = cfg.get("PROFILE_DIR") or os.path.join(
+            app.instance_path, "profiles"
+        )
+
+        # registered before the app's other hooks, so the request timing
+        # starts first and (after_request runs in reverse) ends last
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._template_started, app)
+        template_rendered.connect(self._template_done, app)
+        if self._query_done not in query_hooks:
+            query_hooks.append(self._query_done)
+        app.add_url_rule("/metrics", "metrics", self.metrics)
+
+    def register_cache(self, name, cache):
+        """Report cache.stats() (hits, misses, size) under cache="name"."""
+        self.caches[name] = cache
+
+    @contextmanager
+    def timer(self, phase):
+        """Add the time spent in the block to the current request's phase;
+        does nothing when instrumentation is off or outside a request."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if has_request_context() and "timings" in g:
+                g.timings[phase] += time.perf_counter() - start
+
+    # -------- Request hooks ----------------
+
+    def _start(self):
+        g.timings = dict.fromkeys(("db", *PHASES), 0.0)
+        g.query_count = 0
+        if self.profile_rate and random.random() < self.profile_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # another profiler is already active
+                pass
+            else:
+                g.profiler = profiler
+        g.request_start = time.perf_counter()
+
+    def _finish(self, response):
+        if "request_start" not in g:  # a before_request hook of ours failed
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        timings = g.timings
+
+        entries = [
+            f'db;dur={timings["db"] * 1000:.1f};desc="{g.query_count} queries"'
+        ]
+        entries += [
+            f"{phase};dur={timings[phase] * 1000:.1f}"
+            for phase in PHASES if timings[phase]
+        ]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response.headers["Server-Timing"] = ", ".join(entries)
+
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        key = (request.method, route)
+        with self._lock:
+            counts = self._latency[key]
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._latency_sum[key] += elapsed
+            self._requests[(*key, response.status_code)] += 1
+            self._queries[key] += g.query_count
+            for phase, seconds in timings.items():
+                self._phase_seconds[(*key, phase)] += seconds
+
+        profiler = g.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            if elapsed >= self.profile_slow:
+                self._dump(profiler, elapsed)
+        return response
+
+    def _query_done(self, event):
+        if has_request_context() and "timings" in g:
+            g.timings["db"] += event.duration
+            g.query_count += 1
+
+    def _template_started(self, sender, template, context, **extra):
+        g.setdefault("template_starts", []).append(time.perf_counter())
+
+    def _template_done(self, sender, template, context, **extra):
+        starts = g.get("template_starts")
+        if starts and "timings" in g:
+            g.timings["render"] += time.perf_counter() - starts.pop()
+
+    def _dump(self, profiler, elapsed):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        endpoint = re.sub(r"[^\w.-]", "_", request.endpoint or "unmatched")
+        name = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{request.method}-{endpoint}-"
+            f"{elapsed * 1000:.0f}ms-{os.getpid()}.prof"
+        )
+        # load with pstats.Stats(path) or snakeviz
+        profiler.dump_stats(os.path.join(self.profile_dir, name))
+
+    # -------- /metrics ----------------
+
+    def metrics(self):
+        """Prometheus text exposition format, version 0.0.4."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            latency = {k: list(v) for k, v in self._latency.items()}
+            latency_sum = dict(self._latency_sum)
+            requests = dict(self._requests)
+            queries = dict(self._queries)
+            phase_seconds = dict(self._phase_seconds)
+
+        family("http_requests_total", "counter",
+               "Requests handled, by route and status.")
+        for (method, route, status), n in sorted(requests.items()):
+            lines.append(
+                f"http_requests_total{labels(method=method, route=route, status=status)} {n}"
+            )
+
+        family("http_request_duration_seconds", "histogram",
+               "Time until the view's response was ready.")
+        for (method, route), counts in sorted(latency.items()):
+            bounds = [*map(str, self.buckets), "+Inf"]
+            for bound, n in zip(bounds, counts):
+                lines.append(
+                    "http_request_duration_seconds_bucket"
+                    f"{labels(method=method, route=route, le=bound)} {n}"
+                )
+            route_labels = labels(method=method, route=route)
+            lines.append(
+                f"http_request_duration_seconds_sum{route_labels} "
+                f"{latency_sum[(method, route)]:.6f}"
+            )
+            lines.append(
+                f"http_request_duration_seconds_count{route_labels} {counts[-1]}"
+            )
+
+        family("http_request_db_queries_total", "counter",
+               "SQL queries run by requests, by route.")
+        for (method, route), n in sorted(queries.items()):
+            lines.append(
+                f"http_request_db_queries_total{labels(method=method, route=route)} {n}"
+            )
+
+        family("http_request_phase_seconds_total", "counter",
+               "Time requests spent in db, render, pdf and json, by route.")
+        for (method, route, phase), seconds in sorted(phase_seconds.items()):
+            lines.append(
+                "http_request_phase_seconds_total"
+                f"{labels(method=method, route=route, phase=phase)} {seconds:.6f}"
+            )
+
+        stats = {name: cache.stats() for name, cache in sorted(self.caches.items())}
+        for metric, kind, field, help_text in (
+            ("cache_hits_total", "counter", "hits", "Cache hits."),
+            ("cache_misses_total", "counter", "misses", "Cache misses."),
+            ("cache_entries", "gauge", "size", "Entries currently cached."),
+        ):
+            family(metric, kind, help_text)
+            for name, s in stats.items():
+                lines.append(f"{metric}{labels(cache=name)} {s[field]}")
+
+        return Response(
+            "\n".join(lines) + "\n",
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
+
+
+def labels(**values):
+    def escape(value):
+        return (
+            str(value).replace("\\", r"\\").replace("\n", r"\n")
+            .replace('"', r"\"")
+        )
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in values.items()) + "}"
+
+
+instrumentation = Instrumentation()
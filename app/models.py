@@ -1,14 +1,223 @@
-from datetime import date
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime, timezone
+import glob
 import os
+import re
+import threading
 
 from peewee import (
-    Model, SqliteDatabase, CharField, TextField,
-    DateField, ForeignKeyField, IntegerField, DecimalField
+    Model, SqliteDatabase, DatabaseProxy, CharField, TextField, SQL,
+    DateField, DateTimeField, ForeignKeyField, IntegerField, BigIntegerField,
+    DecimalField
 )
 from flask_login import UserMixin
+from playhouse import db_url
+from playhouse.migrate import SchemaMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
+
 DATABASE_PATH = os.getenv("DATABASE_PATH", "invoicing.db")
+# a path or a URL: sqlite:///invoicing.db, postgresql://user:pw@host/db, ...
+DATABASE_URL = os.getenv("DATABASE_URL") or DATABASE_PATH
+# optional read replica for GET handlers, same format
+DATABASE_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+# optional tenant sharding: "user" (a file per user) or a number of buckets
+DB_SHARDS = os.getenv("DB_SHARDS", "")
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+
+
+def sqlite_pragmas():
+    """Per-connection SQLite settings, overridable through DB_* env vars."""
+    return {
+        # readers don't block the writer (and vice versa) in WAL mode
+        "journal_mode": os.getenv("DB_JOURNAL_MODE", "wal"),
+        # NORMAL is durable across app crashes in WAL mode, and much
+        # cheaper than FULL (one fsync per checkpoint, not per commit)
+        "synchronous": os.getenv("DB_SYNCHRONOUS", "normal"),
+        # ms to wait for the write lock before "database is locked"
+        "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT", 5000)),
+        # negative = KiB, so 64 MB of page cache per connection
+        "cache_size": int(os.getenv("DB_CACHE_SIZE", -64000)),
+        "mmap_size": int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024)),
+    }
+
+
+def pool_options():
+    return {
+        "max_connections": int(os.getenv("DB_MAX_CONNECTIONS", 32)),
+        # recycle connections idle for longer than this (seconds)
+        "stale_timeout": int(os.getenv("DB_STALE_TIMEOUT", 300)),
+    }
+
+
+# peewee query hooks (called with a QueryEvent after every query), shared
+# by every database make_database() opens, shards included
+query_hooks = []
+
+
+def make_database(target, pool=None):
+    """
+    Database for a file path or a URL (see playhouse.db_url; "+pool"
+    schemes are pooled). A bare path is SQLite, pooled unless DB_POOL=0,
+    so connections are handed back out instead of being reopened for
+    every request. SQLite always gets the pragmas above.
+    """
+    if "://" in target:
+        scheme = target.split("://", 1)[0]
+        options = {}
+        if scheme.startswith("sqlite"):
+            options["pragmas"] = sqlite_pragmas()
+        if scheme.endswith("+pool"):
+            options.update(pool_options())
+            if scheme.startswith("sqlite"):
+                options["check_same_thread"] = False
+        database = db_url.connect(target, **options)
+    else:
+        if pool is None:
+            pool = os.getenv("DB_POOL", "1") not in ("0", "false", "")
+        if not pool:
+            database = SqliteDatabase(target, pragmas=sqlite_pragmas())
+        else:
+            database = PooledSqliteDatabase(
+                target,
+                pragmas=sqlite_pragmas(),
+                # pooled connections move between request threads
+                check_same_thread=False,
+                **pool_options(),
+            )
+    database.query_hooks = query_hooks
+    return database
+
+
+class Shards:
+    """
+    SQLite files under `directory` holding tenant data: one per user
+    (count=None) or one per bucket of users (user_id % count). Files are
+    created, with their tables, on first use.
+    """
+
+    def __init__(self, directory, count=None):
+        self.directory = directory
+        self.count = count
+        self._databases = {}
+        self._lock = threading.Lock()
 
-db = SqliteDatabase(DATABASE_PATH)
+    def key_for(self, user_id):
+        return user_id if self.count is None else user_id % self.count
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f"shard-{key}.db")
+
+    def get(self, key):
+        database = self._databases.get(key)
+        if database is None:
+            with self._lock:
+                database = self._databases.get(key)
+                if database is None:
+                    os.makedirs(self.directory, exist_ok=True)
+                    database = make_database(self.path_for(key))
+                    with db.using(database):
+                        create_tables()
+                    self._databases[key] = database
+        return database
+
+    def for_user(self, user_id):
+        return self.get(self.key_for(user_id))
+
+    def all(self):
+        """Every shard: all buckets, or each per-user file on disk."""
+        if self.count is not None:
+            keys = range(self.count)
+        else:
+            keys = sorted(
+                int(m.group(1)) for path in
+                glob.glob(os.path.join(self.directory, "shard-*.db"))
+                if (m := re.search(r"shard-(\d+)\.db$", path))
+            )
+        return [self.get(key) for key in keys]
+
+
+class ReadWriteDatabase(DatabaseProxy):
+    """
+    What the tenant models are bound to. Queries go to the primary,
+    except:
+    - inside `with db.replica_reads():` they go to the read replica (when
+      one is configured). Replicas may lag, so only wrap code that doesn't
+      write or need to see its own writes.
+    - with sharding on, once a request is routed to a tenant
+      (use_tenant() / using()) they go to that tenant's shard.
+    """
+
+    def __init__(self, primary, replica=None, shards=None):
+        super().__init__()
+        self.initialize(primary)
+        self.replica = replica
+        self.shards = shards
+        self._reading = ContextVar("replica_reads", default=False)
+        self._shard = ContextVar("shard", default=None)
+
+    # Proxy only allows its own slots to be set
+    __setattr__ = object.__setattr__
+
+    @property
+    def primary(self):
+        return self.obj
+
+    @property
+    def current(self):
+        shard = self._shard.get()
+        if shard is not None:
+            return shard
+        if self.replica is not None and self._reading.get():
+            return self.replica
+        return self.obj
+
+    @property
+    def databases(self):
+        """The databases this thread may have connected to."""
+        return [
+            d for d in (self.obj, self.replica, self._shard.get())
+            if d is not None
+        ]
+
+    def __getattr__(self, attr):
+        return getattr(self.current, attr)
+
+    @contextmanager
+    def replica_reads(self):
+        token = self._reading.set(True)
+        try:
+            yield
+        finally:
+            self._reading.reset(token)
+
+    def use_tenant(self, user_id):
+        """Route to user_id's shard until reset_tenant(token)."""
+        return self._shard.set(self.shards.for_user(user_id))
+
+    def reset_tenant(self, token):
+        self._shard.reset(token)
+
+    @contextmanager
+    def using(self, database):
+        token = self._shard.set(database)
+        try:
+            yield
+        finally:
+            self._shard.reset(token)
+
+
+def make_shards():
+    if not DB_SHARDS:
+        return None
+    return Shards(SHARD_DIR, None if DB_SHARDS == "user" else int(DB_SHARDS))
+
+
+db = ReadWriteDatabase(
+    make_database(DATABASE_URL),
+    make_database(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else None,
+    make_shards(),
+)
 
 
 class BaseModel(Model):
@@ -16,12 +225,65 @@ class BaseModel(Model):
         database = db
 
 
+def utcnow():
+    # naive UTC, the format DateTimeField reads back on every backend
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_id(value):
+    """
+    A row id from request JSON or a query string as an int, or None if it
+    isn't one. JSON clients send "7" as often as 7; bools, floats and
+    non-ASCII digits are not ids.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isascii() and value.isdigit():
+            return int(value)
+    return None
+
+
+class Versioned(BaseModel):
+    """
+    A row that records when it was last written: `version` is taken from
+    its owner's VersionCounter on every write, so "changed since N" is
+    `version > N` within the owner's rows and a row's version works as
+    its ETag.
+    save() stamps the row itself; query-level writes (insert_many,
+    update) must pass **stamp(user_id) along.
+    """
+    # the DEFAULT lets migrate_versions() add the column to existing rows
+    version = BigIntegerField(default=1, constraints=[SQL("DEFAULT 1")])
+    updated_at = DateTimeField(default=utcnow)
+
+    @property
+    def owner_id(self):
+        return self.user_id
+
+    def save(self, *args, **kwargs):
+        with self._meta.database.atomic():
+            for name, value in stamp(self.owner_id).items():
+                setattr(self, name, value)
+            return super().save(*args, **kwargs)
+
+
 class User(UserMixin, BaseModel):
     username = CharField(unique=True)
     password_hash = CharField()
+    # bumped by a password change; tokens signed with an older one are
+    # no longer accepted (see TokenAuth.verify)
+    token_generation = IntegerField(default=0, constraints=[SQL("DEFAULT 0")])
+
+    class Meta:
+        # users are looked up before we know their shard
+        database = db.primary
 
 
-class Customer(BaseModel):
+class Customer(Versioned):
     # owner
     user = ForeignKeyField(User, backref="customers", on_delete="CASCADE")
 
@@ -30,8 +292,18 @@ class Customer(BaseModel):
     address = TextField(null=True)
     phone = CharField(null=True)
 
+    class Meta:
+        # lists page by (user_id, rowid), which the plain user_id index
+        # already covers, so there's no (user, id) index
+        indexes = (
+            # ?since= feeds and list ETags
+            (("user", "version"), False),
+            # the CSV import's duplicate check (covering)
+            (("user", "name", "email"), False),
+        )
+
 
-class Invoice(BaseModel):
+class Invoice(Versioned):
     # owner
     user = ForeignKeyField(User, backref="invoices", on_delete="CASCADE")
 
@@ -41,9 +313,24 @@ class Invoice(BaseModel):
     status = CharField(default="sent")  # sent, paid, etc.
     total = DecimalField(max_digits=10, decimal_places=2, default=0)
 
+    class Meta:
+        # every invoice query is scoped to the owner first; the plain
+        # user_id index still serves keyset pagination (user_id, rowid)
+        indexes = (
+            # status filters, dashboard/aging sums (covering)
+            (("user", "status", "due_date", "total"), False),
+            # customer filter, top customers (covering)
+            (("user", "customer", "total"), False),
+            # issue/due date range filters
+            (("user", "issue_date"), False),
+            (("user", "due_date"), False),
+            # ?since= feeds and list ETags
+            (("user", "version"), False),
+        )
+
 
 # CATALOG ITEM (maintained by user)
-class Item(BaseModel):
+class Item(Versioned):
     # owner
     user = ForeignKeyField(User, backref="items", on_delete="CASCADE")
 
@@ -51,20 +338,280 @@ class Item(BaseModel):
     description = TextField(null=True)
     unit_price = DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        # as for customers, user_id serves the (user_id, rowid) pages and
+        # the catalog lookups go by primary key
+        indexes = (
+            # ?since= feeds and list ETags
+            (("user", "version"), False),
+            # the CSV import's duplicate check (covering)
+            (("user", "name"), False),
+        )
+
 
 # LINE ITEM ON INVOICE (joins Invoice + Item)
-class InvoiceItem(BaseModel):
+# A line change also stamps its invoice (see adjust_invoice_total), so
+# the invoice's version covers its lines.
+# Lines have no user column: they're always reached through an invoice
+# the user owns, and the invoice_id index is (invoice_id, rowid), which
+# already returns them in id order. item_id serves the catalog cascade.
+class InvoiceItem(Versioned):
     invoice = ForeignKeyField(Invoice, backref="invoice_items", on_delete="CASCADE")
     item = ForeignKeyField(Item, backref="invoice_items", on_delete="CASCADE")
     quantity = IntegerField(default=1)
     # snapshot price at time of invoice (can override catalog price)
     unit_price = DecimalField(max_digits=10, decimal_places=2)
 
+    @property
+    def owner_id(self):
+        return self.invoice.user_id
+
     @property
     def total(self):
         return self.quantity * self.unit_price
 
 
+# REPORTING ROLLUPS (maintained by app/reports.py, never edited by hand)
+class RevenueRollup(BaseModel):
+    user = ForeignKeyField(User, on_delete="CASCADE")
+    month = CharField(max_length=7)  # "YYYY-MM" of issue_date
+    customer = ForeignKeyField(Customer, on_delete="CASCADE")
+    status = CharField()
+    invoice_count = IntegerField(default=0)
+    total = DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = (
+            (("user", "month", "customer", "status"), True),
+        )
+
+
+# open (not paid/draft) invoices by due date, for the aging report
+class AgingRollup(BaseModel):
+    user = ForeignKeyField(User, on_delete="CASCADE")
+    customer = ForeignKeyField(Customer, on_delete="CASCADE")
+    due_date = DateField(null=True)
+    invoice_count = IntegerField(default=0)
+    total = DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        indexes = (
+            (("user", "due_date", "customer"), False),
+        )
+
+
+# ROW VERSIONS
+class VersionCounter(BaseModel):
+    """
+    A row per user: the last version next_version() handed out for the
+    user's rows. Per user, so tenants' writes don't queue on one row.
+    """
+    user = ForeignKeyField(User, unique=True, on_delete="CASCADE")
+    value = BigIntegerField(default=0)
+
+
+# deleted customers, items and invoices, for ?since= feeds
+class Tombstone(BaseModel):
+    user = ForeignKeyField(User, on_delete="CASCADE")
+    table_name = CharField()
+    row_id = IntegerField()
+    version = BigIntegerField()
+    deleted_at = DateTimeField(default=utcnow)
+
+    class Meta:
+        indexes = (
+            (("user", "table_name", "version"), False),
+        )
+
+
+VERSIONED_MODELS = [Customer, Item, Invoice, InvoiceItem]
+
+
+def next_version(user_id):
+    """
+    The next version of user_id's rows. Call it inside the transaction
+    that writes the row: the user's counter row stays locked until that
+    commits, so their versions become visible in increasing order and a
+    reader that has seen version N has seen every write of theirs up to N.
+    """
+    (value,), = (
+        VersionCounter
+        .insert(user=user_id, value=1)
+        .on_conflict(
+            conflict_target=[VersionCounter.user],
+            update={VersionCounter.value: VersionCounter.value + 1},
+        )
+        .returning(VersionCounter.value)
+        .tuples()
+        .execute()
+    )
+    return value
+
+
+def current_version(user_id):
+    """The newest committed version of user_id's rows; a client that has
+    read up to it is in sync."""
+    return (
+        VersionCounter
+        .select(VersionCounter.value)
+        .where(VersionCounter.user == user_id)
+        .scalar()
+    ) or 0
+
+
+def raise_version(user_id, version):
+    """Make user_id's next version come after `version` (for rows copied
+    in with their versions)."""
+    raised = (
+        VersionCounter
+        .update(value=version)
+        .where(
+            (VersionCounter.user == user_id) & (VersionCounter.value < version)
+        )
+        .execute()
+    )
+    if not raised:
+        (VersionCounter
+         .insert(user=user_id, value=version)
+         .on_conflict_ignore()
+         .execute())
+
+
+def stamp(user_id):
+    """Field values for a write to user_id's rows of a Versioned model."""
+    return {"version": next_version(user_id), "updated_at": utcnow()}
+
+
+def bury(model, ids, user_id):
+    """Leave tombstones for deleted rows of model, in the deleting
+    transaction."""
+    if not ids:
+        return
+    version = next_version(user_id)
+    Tombstone.insert_many([
+        {
+            "user": user_id,
+            "table_name": model._meta.table_name,
+            "row_id": row_id,
+            "version": version,
+        }
+        for row_id in ids
+    ]).execute()
+
+
+def migrate_versions():
+    """Add version/updated_at to tables created before they existed."""
+    migrator = SchemaMigrator.from_database(db.current)
+    for model in VERSIONED_MODELS:
+        table = model._meta.table_name
+        if not db.table_exists(table):
+            continue
+        columns = {c.name for c in db.get_columns(table)}
+        if "version" not in columns:
+            migrate(migrator.add_column(
+                table, "version", model.version, allow_not_null=True
+            ))
+        if "updated_at" not in columns:
+            # SQLite can only add a NOT NULL column with a constant
+            # default, so add it nullable and backfill
+            migrate(migrator.add_column(
+                table, "updated_at", DateTimeField(null=True)
+            ))
+            model.update(updated_at=utcnow()).execute()
+
+
+def migrate_users():
+    """Add token_generation to a user table created before it existed."""
+    database = User._meta.database
+    table = User._meta.table_name
+    if not database.table_exists(table):
+        return
+    if "token_generation" not in {c.name for c in database.get_columns(table)}:
+        migrate(SchemaMigrator.from_database(database).add_column(
+            table, "token_generation", User.token_generation
+        ))
+
+
+def migrate_version_counters():
+    """
+    Replace the database-wide counter row of older databases with a row
+    per user. Every user with rows here continues from its value, so
+    their ?since= cursors stay valid.
+    """
+    table = VersionCounter._meta.table_name
+    if not db.table_exists(table):
+        return
+    if "user_id" in {c.name for c in db.get_columns(table)}:
+        return
+    value = db.execute_sql(f'SELECT MAX("value") FROM "{table}"').fetchone()[0]
+    owners = set()
+    for model in (Customer, Item, Invoice, Tombstone):
+        if db.table_exists(model._meta.table_name):
+            owners.update(
+                uid for (uid,) in model.select(model.user).distinct().tuples()
+            )
+    with db.atomic():
+        db.execute_sql(f'DROP TABLE "{table}"')
+        VersionCounter.create_table()
+        if owners and value:
+            VersionCounter.insert_many([
+                {"user": uid, "value": value} for uid in sorted(owners)
+            ]).execute()
+
+
+# FTS5 indexes over the searchable text columns (see app/search.py).
+# They are external-content tables kept in sync by triggers, so every write
+# path (API, bulk, import, shard split) updates them in the same transaction.
+SEARCH_INDEXES = {
+    "customer": ["name", "email", "address", "phone"],
+    "item": ["name", "description"],
+}
+
+
+def create_search_tables():
+    """Create the FTS5 tables and triggers (SQLite only), filling new ones."""
+    for table, columns in SEARCH_INDEXES.items():
+        fts = f"{table}_fts"
+        cols = ", ".join(columns)
+        new = ", ".join(f"new.{c}" for c in columns)
+        old = ", ".join(f"old.{c}" for c in columns)
+        exists = db.table_exists(fts)
+
+        db.execute_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+            f"{cols}, content='{table}', content_rowid='id', "
+            # prefix indexes keep 2-3 letter type-ahead queries fast
+            f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        db.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+            f"BEGIN INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        db.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+            f"BEGIN INSERT INTO {fts}({fts}, rowid, {cols}) "
+            f"VALUES ('delete', old.id, {old}); END"
+        )
+        db.execute_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {table} "
+            f"BEGIN INSERT INTO {fts}({fts}, rowid, {cols}) "
+            f"VALUES ('delete', old.id, {old}); "
+            f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.id, {new}); END"
+        )
+        if not exists:
+            # index the rows that were there before the table
+            db.execute_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
 def create_tables():
     with db:
-        db.create_tables([User, Customer, Invoice, Item, InvoiceItem])
+        # before create_tables(), which indexes the version columns
+        migrate_versions()
+        migrate_users()
+        migrate_version_counters()
+        db.create_tables([
+            User, Customer, Invoice, Item, InvoiceItem,
+            RevenueRollup, AgingRollup, VersionCounter, Tombstone,
+        ])
+        if isinstance(db.current, SqliteDatabase):
+            create_search_tables()
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import threading
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from .cache import TTLCache
+
+
+class HasherBusy(Exception):
+    """Too many password hashes queued; the client should retry later."""
+
+
+class PasswordHasher:
+    """
+    Runs the (deliberately slow) password hashing on a small dedicated
+    thread pool, so a burst of logins queues here instead of tying up
+    every request thread. hashlib's KDFs release the GIL, so threads are
+    enough.
+
+    At most max_queue hashes may be queued or running at once; beyond
+    that, or when one waits longer than `timeout` seconds, HasherBusy is
+    raised. With workers=0 hashing happens inline.
+    """
+
+    def __init__(self, method="scrypt", workers=2, max_queue=16, timeout=5):
+        self.method = method
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_queue)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        cfg = app.config
+        method = cfg.get("PASSWORD_HASH_METHOD", self.method)
+        # normalise shorthands ("scrypt") to the full prefix werkzeug
+        # stores ("scrypt:32768:8:1"), so needs_rehash() can compare them
+        self.method = generate_password_hash("", method).split("$", 1)[0]
+        self.workers = int(cfg.get("PASSWORD_HASH_WORKERS", self.workers))
+        self.max_queue = int(cfg.get("PASSWORD_HASH_QUEUE", self.max_queue))
+        self.timeout = float(cfg.get("PASSWORD_HASH_TIMEOUT", self.timeout))
+        self._slots = threading.BoundedSemaphore(self.max_queue)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="pwhash"
+                )
+            return self._executor
+
+    def _run(self, fn, *args):
+        if self.workers <= 0:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # still queued: drop it rather than hash for nobody
+            future.cancel()
+            raise HasherBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def check(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with other parameters than configured."""
+        return pwhash.split("$", 1)[0] != self.method
+
+
+class LoginThrottle:
+    """
+    Counts failed logins per username and per client IP. Once either
+    reaches its limit, further attempts are refused until `window`
+    seconds pass without a failure. A successful login clears the
+    username's count (not the IP's).
+    """
+
+    def __init__(self, max_per_user=5, max_per_ip=20, window=900):
+        self.max_per_user = max_per_user
+        self.max_per_ip = max_per_ip
+        self.window = window
+        self._failures = TTLCache(maxsize=100000, ttl=window)
+
+    def init_app(self, app):
+        cfg = app.config
+        self.max_per_user = int(cfg.get("LOGIN_MAX_ATTEMPTS_USER", self.max_per_user))
+        self.max_per_ip = int(cfg.get("LOGIN_MAX_ATTEMPTS_IP", self.max_per_ip))
+        self.window = int(cfg.get("LOGIN_THROTTLE_WINDOW", self.window))
+        self._failures = TTLCache(maxsize=100000, ttl=self.window)
+
+    def _limits(self, username, ip):
+        return [
+            (("user", username), self.max_per_user),
+            (("ip", ip), self.max_per_ip),
+        ]
+
+    def blocked(self, username, ip):
+        return any(
+            self._failures.get(key, 0) >= limit
+            for key, limit in self._limits(username, ip)
+        )
+
+    def failed(self, username, ip):
+        for key, _ in self._limits(username, ip):
+            self._failures.set(key, self._failures.get(key, 0) + 1)
+
+    def succeeded(self, username, ip):
+        self._failures.pop(("user", username))
+
+
+password_hasher = PasswordHasher()
+login_throttle = LoginThrottle()
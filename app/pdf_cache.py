@@ -0,0 +1,160 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from .rendering import STYLESHEET_PATH
+
+
+class PDFCache:
+    """
+    Bounded on-disk cache of rendered invoice PDFs.
+
+    Entries are content addressed: the key is a hash of the rendered
+    invoice HTML and of the stylesheet, so a changed invoice or style is
+    never served from a stale entry.
+
+    Each invoice's entries live in their own "<invoice_id>/" directory,
+    so dropping them on an edit only lists that directory. The file
+    mtime is the LRU clock: once the bytes this process wrote since its
+    last scan reach a tenth of max_bytes, the whole store is scanned and
+    the least recently used files are evicted down to max_bytes.
+    """
+
+    def __init__(self, directory=None, max_bytes=100 * 1024 * 1024,
+                 stylesheet=STYLESHEET_PATH):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stylesheet = stylesheet
+        self._stylesheet_hash = None
+        self._lock = threading.Lock()
+        # None until the first put, which scans the store once
+        self._written = None
+
+    def init_app(self, app):
+        self.directory = app.config.get("PDF_CACHE_DIR")
+        self.max_bytes = int(app.config.get("PDF_CACHE_MAX_BYTES", self.max_bytes))
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return bool(self.directory) and self.max_bytes > 0
+
+    def key_for(self, html):
+        digest = hashlib.sha256(self._stylesheet_digest())
+        digest.update(html.encode("utf-8"))
+        return digest.hexdigest()
+
+    def _stylesheet_digest(self):
+        # read once, like the renderer loads the stylesheet once per
+        # process: an edited file takes effect for both on restart
+        if self._stylesheet_hash is None:
+            with open(self.stylesheet, "rb") as f:
+                self._stylesheet_hash = hashlib.sha256(f.read()).digest()
+        return self._stylesheet_hash
+
+    def _invoice_dir(self, invoice_id):
+        return os.path.join(self.directory, str(invoice_id))
+
+    def _path(self, invoice_id, key):
+        return os.path.join(self._invoice_dir(invoice_id), f"{key}.pdf")
+
+    def get(self, invoice_id, key):
+        if not self.enabled:
+            return None
+        path = self._path(invoice_id, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, invoice_id, key, data):
+        if not self.enabled:
+            return
+        # write to a temp file first so readers never see a partial PDF
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        with self._lock:
+            self._remove_invoice(invoice_id)
+            os.makedirs(self._invoice_dir(invoice_id), exist_ok=True)
+            os.replace(tmp, self._path(invoice_id, key))
+            if self._written is None or self._written >= self.max_bytes // 10:
+                self._evict()
+                self._written = 0
+            self._written += len(data)
+
+    def invalidate(self, *invoice_ids):
+        if not self.enabled:
+            return
+        with self._lock:
+            for invoice_id in invoice_ids:
+                self._remove_invoice(invoice_id)
+
+    def clear(self):
+        if not self.enabled:
+            return
+        with self._lock:
+            for entry in self._entries():
+                self._unlink(entry.path)
+
+    # -- internals (call with the lock held) --
+
+    @staticmethod
+    def _pdfs(directory):
+        try:
+            with os.scandir(directory) as it:
+                return [
+                    e for e in it if e.is_file() and e.name.endswith(".pdf")
+                ]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+    def _entries(self):
+        """Every cached file; flat "<id>-<key>.pdf" files from the old
+        layout are included so they age out."""
+        entries = self._pdfs(self.directory)
+        try:
+            with os.scandir(self.directory) as it:
+                subdirs = [e.path for e in it if e.is_dir()]
+        except FileNotFoundError:
+            return entries
+        for subdir in subdirs:
+            entries.extend(self._pdfs(subdir))
+        return entries
+
+    def _remove_invoice(self, invoice_id):
+        for entry in self._pdfs(self._invoice_dir(invoice_id)):
+            self._unlink(entry.path)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in self._entries():
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+pdf_cache = PDFCache()
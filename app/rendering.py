@@ -0,0 +1,252 @@
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+import zipfile
+
+STYLESHEET_PATH = os.path.join(os.path.dirname(__file__), "static", "invoice.css")
+
+# Fonts and the invoice stylesheet are loaded once per worker (or per
+# thread when rendering inline) and reused for every document.
+_local = threading.local()
+
+
+def _weasy_resources():
+    if not hasattr(_local, "stylesheets"):
+        from weasyprint import CSS
+        from weasyprint.text.fonts import FontConfiguration
+
+        _local.font_config = FontConfiguration()
+        _local.stylesheets = [
+            CSS(filename=STYLESHEET_PATH, font_config=_local.font_config)
+        ]
+    return _local.font_config, _local.stylesheets
+
+
+def render_pdf(html):
+    """Runs in a worker process: HTML string -> PDF bytes."""
+    from weasyprint import HTML
+
+    font_config, stylesheets = _weasy_resources()
+    return HTML(string=html).write_pdf(
+        stylesheets=stylesheets, font_config=font_config
+    )
+
+
+class RendererBusy(Exception):
+    """The render queue is full; the client should retry later."""
+
+
+class PDFRenderer:
+    """
+    Runs WeasyPrint in a pool of worker processes so PDF rendering doesn't
+    hold the request thread (or the GIL) while it burns CPU.
+
+    At most max_queue renders may be queued or running at once; submit()
+    raises RendererBusy beyond that instead of letting requests pile up.
+    It also keeps a small in-memory table of asynchronous render jobs.
+    With workers=0 rendering happens inline on the calling thread.
+    """
+
+    def __init__(self, workers=2, max_queue=8, timeout=30, job_ttl=600,
+                 max_jobs=1000):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+
+    def init_app(self, app):
+        cfg = app.config
+        self.workers = int(cfg.get("PDF_WORKERS", self.workers))
+        self.max_queue = int(cfg.get("PDF_MAX_QUEUE", self.max_queue))
+        self.timeout = float(cfg.get("PDF_RENDER_TIMEOUT", self.timeout))
+        self.job_ttl = int(cfg.get("PDF_JOB_TTL", self.job_ttl))
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn so workers don't inherit the server's threads/sockets
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def submit(self, html):
+        """Queue a render and return a Future for the PDF bytes."""
+        if self.workers <= 0:
+            future = Future()
+            try:
+                future.set_result(render_pdf(html))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        with self._lock:
+            if self._pending >= self.max_queue:
+                raise RendererBusy()
+            self._pending += 1
+            try:
+                future = self._get_executor().submit(render_pdf, html)
+            except BrokenProcessPool:
+                # a worker died; start a fresh pool for this and later jobs
+                self._executor = None
+                future = self._get_executor().submit(render_pdf, html)
+            except Exception:
+                self._pending -= 1
+                raise
+
+        future.add_done_callback(self._release)
+        return future
+
+    def render(self, html, timeout=None):
+        """
+        Render synchronously through the pool. Raises RendererBusy when the
+        queue is full and concurrent.futures.TimeoutError on timeout.
+        """
+        future = self.submit(html)
+        return future.result(timeout=timeout or self.timeout)
+
+    def render_many(self, documents, window=None):
+        """
+        Render (name, html) pairs from an iterable and yield
+        (name, pdf_bytes) in the same order. At most `window` renders of
+        this batch are in flight, so memory stays flat however many
+        documents are fed in.
+        """
+        window = window or max(1, self.workers)
+        in_flight = deque()
+
+        for name, html in documents:
+            if len(in_flight) >= window:
+                done_name, future = in_flight.popleft()
+                yield done_name, future.result(timeout=self.timeout)
+
+            deadline = time.monotonic() + self.timeout
+            while True:
+                try:
+                    future = self.submit(html)
+                    break
+                except RendererBusy:
+                    # pool is shared with other requests: drain our own
+                    # work first, otherwise wait for a free slot
+                    if in_flight:
+                        done_name, done = in_flight.popleft()
+                        yield done_name, done.result(timeout=self.timeout)
+                    elif time.monotonic() > deadline:
+                        raise
+                    else:
+                        time.sleep(0.05)
+            in_flight.append((name, future))
+
+        while in_flight:
+            name, future = in_flight.popleft()
+            yield name, future.result(timeout=self.timeout)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    # -------- async jobs --------
+
+    def create_job(self, user_id, invoice_id, key, html=None, pdf_bytes=None):
+        """
+        Start a background render of html. If pdf_bytes is given (cache
+        hit) the job is created already finished.
+        """
+        if pdf_bytes is not None:
+            future = Future()
+            future.set_result(pdf_bytes)
+        else:
+            future = self.submit(html)
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "invoice_id": invoice_id,
+            "key": key,
+            "created": time.time(),
+            "future": future,
+        }
+        with self._lock:
+            self._prune_jobs()
+            self._jobs[job["id"]] = job
+        return job
+
+    def get_job(self, job_id, user_id):
+        with self._lock:
+            self._prune_jobs()
+            job = self._jobs.get(job_id)
+        if not job or job["user_id"] != user_id:
+            return None
+        return job
+
+    @staticmethod
+    def job_status(job):
+        future = job["future"]
+        if not future.done():
+            return "running" if future.running() else "queued"
+        if future.cancelled() or future.exception() is not None:
+            return "failed"
+        return "done"
+
+    def _prune_jobs(self):
+        # jobs are kept in creation order; drop expired or excess ones
+        cutoff = time.time() - self.job_ttl
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job["created"] >= cutoff and len(self._jobs) < self.max_jobs:
+                break
+            self._jobs.popitem(last=False)
+
+
+class _ChunkSink:
+    """Write-only file object collecting what ZipFile writes so it can be
+    handed out chunk by chunk."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def zip_stream(files):
+    """
+    Build a ZIP archive from (name, bytes) pairs, yielding it piece by
+    piece. Only the current file is held in memory.
+    """
+    sink = _ChunkSink()
+    # PDFs are already compressed; storing them keeps this cheap
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as zf:
+        for name, data in files:
+            zf.writestr(name, data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+pdf_renderer = PDFRenderer()
@@ -0,0 +1,314 @@
+from datetime import date
+from decimal import Decimal, ROUND_HALF_UP
+from functools import reduce
+import operator
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from peewee import PostgresqlDatabase, fn
+
+from .models import db, Invoice, RevenueRollup, AgingRollup
+
+reports_bp = Blueprint("reports", __name__)
+
+# invoices in these states are not owed money
+CLOSED_STATUSES = ("paid", "draft")
+
+CENT = Decimal("0.01")
+
+AGING_BUCKETS = [
+    # (name, min days overdue, max days overdue)
+    ("current", None, 0),
+    ("1-30", 1, 30),
+    ("31-60", 31, 60),
+    ("61-90", 61, 90),
+    ("90+", 91, None),
+]
+
+
+# -------- Rollup maintenance ----------------
+
+def snapshot(inv, **changes):
+    """
+    The fields of an invoice that feed the rollups. Take one before and
+    one after a change and hand both to record_change(). The total is
+    rounded to the cent, as the rollups and rebuild_rollups() store it.
+    """
+    state = {
+        "user": inv.user_id,
+        "customer": inv.customer_id,
+        "issue_date": inv.issue_date,
+        "due_date": inv.due_date,
+        "status": inv.status,
+        "total": inv.total,
+    }
+    state.update(changes)
+    state["total"] = cents(state["total"])
+    return state
+
+
+def locked_invoices(invoice_ids):
+    """
+    The invoices with these ids, {id: Invoice}, as stored. Call it
+    inside the write's transaction, before the write, and take the
+    "before" snapshots from it: it locks the invoices (their rows on
+    Postgres, the database on SQLite) so a concurrent change can't land
+    between the snapshot and the write and be counted twice.
+    """
+    query = Invoice.select().where(Invoice.id.in_(list(invoice_ids)))
+    if isinstance(db.current, PostgresqlDatabase):
+        query = query.for_update()
+    else:
+        # SQLite has no row locks; the transaction's first write takes
+        # the write lock, and reads after it see the latest commit
+        (Invoice
+         .update(total=Invoice.total)
+         .where(Invoice.id.in_(list(invoice_ids)))
+         .execute())
+    return {inv.id: inv for inv in query}
+
+
+def locked_snapshot(invoice_id):
+    """snapshot() of one invoice from locked_invoices()."""
+    return snapshot(locked_invoices([invoice_id])[invoice_id])
+
+
+def cents(value):
+    return Decimal(str(value or 0)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def _matches(model, keys):
+    return reduce(operator.and_, [
+        getattr(model, name).is_null() if value is None
+        else getattr(model, name) == value
+        for name, value in keys.items()
+    ])
+
+
+def _bump(model, keys, count, total):
+    """Add count/total to the rollup row for keys, creating it if needed."""
+    cond = _matches(model, keys)
+    updated = (
+        model
+        .update(
+            invoice_count=model.invoice_count + count,
+            total=fn.ROUND(model.total + total, 2),
+        )
+        .where(cond)
+        .execute()
+    )
+    if not updated:
+        model.insert(invoice_count=count, total=total, **keys).execute()
+    elif count < 0:
+        model.delete().where(cond & (model.invoice_count <= 0)).execute()
+
+
+def _apply(state, sign):
+    total = sign * cents(state["total"])
+    _bump(
+        RevenueRollup,
+        {
+            "user": state["user"],
+            "month": state["issue_date"].strftime("%Y-%m"),
+            "customer": state["customer"],
+            "status": state["status"],
+        },
+        sign, total,
+    )
+    if state["status"] not in CLOSED_STATUSES:
+        _bump(
+            AgingRollup,
+            {
+                "user": state["user"],
+                "customer": state["customer"],
+                "due_date": state["due_date"],
+            },
+            sign, total,
+        )
+
+
+def record_change(old=None, new=None):
+    """
+    Move an invoice's contribution from `old` to `new` (snapshots). Pass
+    only new for a created invoice, only old for a deleted one. Call
+    inside the transaction that changes the invoice.
+    """
+    if old == new:
+        return
+    if old is not None:
+        _apply(old, -1)
+    if new is not None:
+        _apply(new, +1)
+
+
+def month_of(column):
+    if isinstance(db.primary, PostgresqlDatabase):
+        return fn.to_char(column, "YYYY-MM")
+    return fn.strftime("%Y-%m", column)
+
+
+def rebuild_rollups(user_id=None):
+    """Recompute the rollup tables from the invoices with INSERT ... SELECT."""
+    month = month_of(Invoice.issue_date)
+    # each invoice rounded to the cent first, as snapshot() does
+    total = fn.ROUND(fn.SUM(fn.ROUND(Invoice.total, 2)), 2)
+    invoices = Invoice.select()
+    if user_id is not None:
+        invoices = invoices.where(Invoice.user == user_id)
+
+    with db.atomic():
+        for model in (RevenueRollup, AgingRollup):
+            query = model.delete()
+            if user_id is not None:
+                query = query.where(model.user == user_id)
+            query.execute()
+
+        RevenueRollup.insert_from(
+            invoices
+            .select(
+                Invoice.user, month, Invoice.customer, Invoice.status,
+                fn.COUNT(Invoice.id), total,
+            )
+            .group_by(Invoice.user, month, Invoice.customer, Invoice.status),
+            [
+                RevenueRollup.user, RevenueRollup.month,
+                RevenueRollup.customer, RevenueRollup.status,
+                RevenueRollup.invoice_count, RevenueRollup.total,
+            ],
+        ).execute()
+
+        AgingRollup.insert_from(
+            invoices
+            .select(
+                Invoice.user, Invoice.customer, Invoice.due_date,
+                fn.COUNT(Invoice.id), total,
+            )
+            .where(Invoice.status.not_in(CLOSED_STATUSES))
+            .group_by(Invoice.user, Invoice.customer, Invoice.due_date),
+            [
+                AgingRollup.user, AgingRollup.customer, AgingRollup.due_date,
+                AgingRollup.invoice_count, AgingRollup.total,
+            ],
+        ).execute()
+
+
+# -------- Endpoints ----------------
+
+def parse_month(value, name):
+    try:
+        date.fromisoformat(value + "-01")
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be YYYY-MM")
+    return value
+
+
+@reports_bp.route("/reports/revenue", methods=["GET"])
+@login_required
+def revenue_report():
+    """
+    Query params (all optional):
+    from=2025-01, to=2025-12 (months, inclusive),
+    group_by=month,customer,status (default: month)
+    status=paid[,sent], customer_id=1
+    """
+    args = request.args
+    columns = {
+        "month": RevenueRollup.month,
+        "customer": RevenueRollup.customer,
+        "status": RevenueRollup.status,
+    }
+    group_by = [g for g in args.get("group_by", "month").split(",") if g]
+    if not group_by or any(g not in columns for g in group_by):
+        return jsonify({"error": "group_by must be month, customer or status"}), 400
+
+    query = RevenueRollup.select(
+        *[columns[g].alias(g) for g in group_by],
+        fn.SUM(RevenueRollup.invoice_count).alias("invoices"),
+        fn.SUM(RevenueRollup.total).alias("total"),
+    ).where(RevenueRollup.user == current_user.id)
+
+    try:
+        if args.get("from"):
+            query = query.where(
+                RevenueRollup.month >= parse_month(args["from"], "from")
+            )
+        if args.get("to"):
+            query = query.where(
+                RevenueRollup.month <= parse_month(args["to"], "to")
+            )
+        if args.get("customer_id"):
+            query = query.where(RevenueRollup.customer == int(args["customer_id"]))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if args.get("status"):
+        query = query.where(RevenueRollup.status.in_(args["status"].split(",")))
+
+    rows = (
+        query
+        .group_by(*[columns[g] for g in group_by])
+        .order_by(*[columns[g] for g in group_by])
+        .dicts()
+    )
+    result = []
+    for row in rows:
+        if "customer" in row:
+            row["customer_id"] = row.pop("customer")
+        row["total"] = float(row["total"] or 0)
+        result.append(row)
+    return jsonify(result)
+
+
+def bucket_for(due_date, today):
+    overdue = (today - due_date).days if due_date else 0
+    for name, low, high in AGING_BUCKETS:
+        if (low is None or overdue >= low) and (high is None or overdue <= high):
+            return name
+
+
+@reports_bp.route("/reports/aging", methods=["GET"])
+@login_required
+def aging_report():
+    """
+    Open invoices by days past due. ?by_customer=1 adds a per-customer
+    breakdown.
+    """
+    by_customer = request.args.get("by_customer") in ("1", "true")
+    today = date.today()
+
+    fields = [AgingRollup.due_date]
+    if by_customer:
+        fields.append(AgingRollup.customer)
+    rows = (
+        AgingRollup
+        .select(
+            *fields,
+            fn.SUM(AgingRollup.invoice_count).alias("invoices"),
+            fn.SUM(AgingRollup.total).alias("total"),
+        )
+        .where(AgingRollup.user == current_user.id)
+        .group_by(*fields)
+        .dicts()
+    )
+
+    def empty():
+        return {name: {"invoices": 0, "total": 0.0} for name, _, _ in AGING_BUCKETS}
+
+    buckets = empty()
+    customers = {}
+    for row in rows:
+        name = bucket_for(row["due_date"], today)
+        targets = [buckets]
+        if by_customer:
+            targets.append(customers.setdefault(row["customer"], empty()))
+        for target in targets:
+            target[name]["invoices"] += row["invoices"]
+            target[name]["total"] = round(
+                target[name]["total"] + float(row["total"] or 0), 2
+            )
+
+    data = {"as_of": today.isoformat(), "buckets": buckets}
+    if by_customer:
+        data["customers"] = [
+            {"customer_id": cid, "buckets": b} for cid, b in sorted(customers.items())
+        ]
+    return jsonify(data)
@@ -1,18 +1,104 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import date
+from decimal import Decimal, InvalidOperation
+from functools import wraps
 
 from flask import (
-    Blueprint, request, jsonify,
-    render_template, make_response
+    Blueprint, request, jsonify, Response, current_app,
+    render_template, make_response, url_for, stream_with_context
 )
 from flask_login import login_required, current_user
-from weasyprint import HTML
 
-from .models import Customer, Invoice, Item, InvoiceItem
+from peewee import Case, fn, prefetch
+
+from .cache import TTLCache
+from .catalog import ItemGone, catalog_cache
+from .instrumentation import instrumentation
+from .models import (
+    db, Customer, Invoice, Item, InvoiceItem, Tombstone,
+    bury, current_version, parse_id, stamp
+)
+from .pdf_cache import pdf_cache
+from .reports import (
+    CLOSED_STATUSES, locked_invoices, locked_snapshot, record_change, snapshot
+)
+from .rendering import PDFRenderer, RendererBusy, pdf_renderer, zip_stream
+from .serialization import json_array_chunks
 
 api_bp = Blueprint("api", __name__)
 
+MAX_PAGE_SIZE = 1000
+PDF_BATCH_MAX = 1000
+# a merged PDF is built as one document, so keep it smaller
+PDF_BATCH_MAX_MERGED = 200
+
+# dashboard summaries per user id; dropped on any successful write
+summary_cache = TTLCache(maxsize=1024, ttl=30)
+
+# API field name -> model column, used for ?fields= projection
+CUSTOMER_FIELDS = {
+    "id": Customer.id,
+    "name": Customer.name,
+    "email": Customer.email,
+    "address": Customer.address,
+    "phone": Customer.phone,
+    "version": Customer.version,
+    "updated_at": Customer.updated_at,
+}
+ITEM_FIELDS = {
+    "id": Item.id,
+    "name": Item.name,
+    "description": Item.description,
+    "unit_price": Item.unit_price,
+    "version": Item.version,
+    "updated_at": Item.updated_at,
+}
+INVOICE_FIELDS = {
+    "id": Invoice.id,
+    "customer_id": Invoice.customer,
+    "issue_date": Invoice.issue_date,
+    "due_date": Invoice.due_date,
+    "status": Invoice.status,
+    "total": Invoice.total,
+    "version": Invoice.version,
+    "updated_at": Invoice.updated_at,
+}
+
 
 # -------- Helpers ----------------
+def replica_reads(view):
+    """
+    Run a read-only handler's queries on the read replica (if one is
+    configured). Goes under @login_required so the user is still loaded
+    from the primary.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with db.replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def db_stream(body):
+    """
+    stream_with_context(body()) for a streamed response that uses the
+    database. Flask runs teardown (closing connections, resetting the
+    tenant shard) before the body is read, so body() runs pinned to the
+    database the view was using (primary, replica or shard), which is
+    closed again at the end.
+    """
+    database = db.current
+
+    def run():
+        try:
+            with db.using(database):
+                yield from body()
+        finally:
+            if not database.is_closed():
+                database.close()
+    return stream_with_context(run())
+
+
 def parse_date(value):
     if not value:
         return None
@@ -22,6 +108,204 @@ def parse_date(value):
     return date.fromisoformat(value)
 
 
+def parse_list_args(columns):
+    """
+    Read the shared list parameters from the query string:
+
+    ?limit=50&cursor=<last id seen>&fields=id,name
+
+    Raises ValueError with a client-facing message on bad input.
+    """
+    args = request.args
+
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError("limit must be an integer")
+        if limit < 1:
+            raise ValueError("limit must be positive")
+        limit = min(limit, MAX_PAGE_SIZE)
+
+    cursor = args.get("cursor")
+    if cursor is not None:
+        try:
+            cursor = int(cursor)
+        except ValueError:
+            raise ValueError("invalid cursor")
+
+    fields = None
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+        unknown = [f for f in fields if f not in columns]
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(unknown)}")
+
+    return {"limit": limit, "cursor": cursor, "fields": fields}
+
+
+def paginate(query, model, limit, cursor):
+    """Keyset pagination on the primary key; fetches one extra row to
+    know whether there is a next page."""
+    if cursor is not None:
+        query = query.where(model.id > cursor)
+    query = query.order_by(model.id)
+    if limit is not None:
+        query = query.limit(limit + 1)
+    return query
+
+
+def projected_rows(query, columns, names):
+    """
+    Select only the named columns, as plain dicts straight from the
+    cursor: no model instances, and no per-field conversion since the JSON
+    provider encodes Decimal and date values itself.
+    """
+    return query.select(*[columns[n].alias(n) for n in names]).dicts()
+
+
+def list_response(query, model, columns, opts):
+    """Run a list query with pagination/projection applied and build the
+    JSON response. Paging info is returned in headers so the body stays a
+    plain array. A list without limit is streamed as it is read."""
+    limit = opts["limit"]
+    fields = opts["fields"] or list(columns)
+    query = paginate(query, model, limit, opts["cursor"])
+
+    if limit is None:
+        return Response(
+            db_stream(lambda: json_array_chunks(
+                projected_rows(query, columns, fields).iterator()
+            )),
+            mimetype="application/json",
+        )
+
+    # id is always selected so the cursor can be computed
+    names = fields if "id" in fields else ["id"] + fields
+    rows = list(projected_rows(query, columns, names))
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1]["id"]
+
+    if "id" not in fields:
+        for row in rows:
+            del row["id"]
+
+    response = jsonify(rows)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
+        args = request.args.to_dict()
+        args["cursor"] = next_cursor
+        next_url = url_for(request.endpoint, **args)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def conditional_response(etag, build):
+    """
+    304 if the client's If-None-Match already has etag, else build() the
+    response. Either way it is tagged and the client is told to
+    revalidate before reusing its copy.
+    """
+    if etag in request.if_none_match:
+        response = make_response("", 304)
+    else:
+        response = make_response(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def list_etag(model):
+    """
+    ETag for any list of the current user's rows of model, from two
+    indexed MAX() lookups: every write takes a new version and every
+    delete leaves a tombstone, so any change to the rows changes it.
+    """
+    table = model._meta.table_name
+    newest = (
+        model.select(fn.MAX(model.version))
+        .where(model.user == current_user)
+        .scalar()
+    )
+    buried = (
+        Tombstone.select(fn.MAX(Tombstone.version))
+        .where(
+            (Tombstone.user == current_user) &
+            (Tombstone.table_name == table)
+        )
+        .scalar()
+    )
+    return f"{table}-{current_user.id}-{newest or 0}-{buried or 0}"
+
+
+def changes_response(model, query, to_dict, load=list):
+    """
+    Delta feed for ?since=<cursor>&limit=N: the rows of query written
+    after the cursor, oldest change first, and the ids of rows deleted
+    since. Pass the returned cursor as the next since; since=0 returns
+    every row.
+    Raises ValueError with a client-facing message on bad input.
+    """
+    if set(request.args) - {"since", "limit"}:
+        raise ValueError("since only combines with limit")
+    try:
+        since = int(request.args["since"])
+        limit = int(request.args.get("limit", MAX_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("since and limit must be integers")
+    if since < 0 or limit < 1:
+        raise ValueError("since must be >= 0 and limit positive")
+    limit = min(limit, MAX_PAGE_SIZE)
+
+    # every write up to this version has committed (see next_version), so
+    # nothing can later appear below the cursor handed out
+    upto = current_version(current_user.id)
+    if since > upto:
+        return jsonify({"error": "cursor is ahead of the database, "
+                                 "sync again from since=0"}), 410
+
+    def window(upto):
+        return (
+            query
+            .where((model.version > since) & (model.version <= upto))
+            .order_by(model.version, model.id)
+        )
+
+    rows = load(window(upto).limit(limit + 1))
+    has_more = len(rows) > limit
+    if has_more:
+        # end the page on a version boundary, so the cursor never splits
+        # a write; a bulk write bigger than limit comes in one page
+        upto = rows[limit - 1].version
+        if rows[limit].version == upto:
+            rows = load(window(upto))
+        else:
+            rows = rows[:limit]
+
+    deleted = [
+        row_id for (row_id,) in
+        Tombstone.select(Tombstone.row_id)
+        .where(
+            (Tombstone.user == current_user) &
+            (Tombstone.table_name == model._meta.table_name) &
+            (Tombstone.version > since) &
+            (Tombstone.version <= upto)
+        )
+        .order_by(Tombstone.version)
+        .tuples()
+    ]
+    return jsonify({
+        "changed": [to_dict(row) for row in rows],
+        "deleted": deleted,
+        "cursor": upto,
+        "has_more": has_more,
+    })
+
+
 def customer_to_dict(c: Customer):
     return {
         "id": c.id,
@@ -29,6 +313,8 @@ def customer_to_dict(c: Customer):
         "email": c.email,
         "address": c.address,
         "phone": c.phone,
+        "version": c.version,
+        "updated_at": c.updated_at,
     }
 
 
@@ -37,7 +323,10 @@ def item_to_dict(it: Item):
         "id": it.id,
         "name": it.name,
         "description": it.description,
-        "unit_price": float(it.unit_price),
+        # still the raw request value right after a create/update
+        "unit_price": Decimal(str(it.unit_price)),
+        "version": it.version,
+        "updated_at": it.updated_at,
     }
 
 
@@ -48,39 +337,114 @@ def invoice_item_to_dict(li: InvoiceItem):
         "item_id": li.item_id,
         "item_name": li.item.name,
         "quantity": li.quantity,
-        "unit_price": float(li.unit_price),
-        "total": float(li.total),
+        "unit_price": li.unit_price,
+        "total": li.total,
+        "version": li.version,
+        "updated_at": li.updated_at,
     }
 
 
-def invoice_to_dict(inv: Invoice, include_items=False):
-    lines = list(inv.invoice_items)
+def invoice_to_dict(inv: Invoice, include_items=False, lines=None):
+    # Only touch the line items when they are needed; listing invoices
+    # must not cost one extra query per row.
+    if include_items and lines is None:
+        lines = list(invoice_lines(inv))
 
     # Prefer stored total; fall back to calculation if None
     if inv.total is not None:
         total = inv.total
     else:
+        if lines is None:
+            lines = list(invoice_lines(inv))
         total = sum(li.total for li in lines)
 
     data = {
         "id": inv.id,
         "customer_id": inv.customer_id,
-        "issue_date": inv.issue_date.isoformat() if inv.issue_date else None,
-        "due_date": inv.due_date.isoformat() if inv.due_date else None,
+        "issue_date": inv.issue_date,
+        "due_date": inv.due_date,
         "status": inv.status,
-        "total": float(total),
+        "total": total,
+        "version": inv.version,
+        "updated_at": inv.updated_at,
     }
     if include_items:
         data["items"] = [invoice_item_to_dict(li) for li in lines]
     return data
 
 
-def recalc_invoice_total(inv: Invoice):
-    """Recalculate and store invoice.total from its line items."""
-    lines = list(inv.invoice_items)
-    total = sum(li.total for li in lines)
-    inv.total = total
-    inv.save()
+def filter_invoices(query, args):
+    """Apply the invoice list filters from a request args mapping."""
+    if args.get("status"):
+        statuses = [st for st in args["status"].split(",") if st]
+        query = query.where(Invoice.status.in_(statuses))
+
+    if args.get("customer_id"):
+        customer_id = parse_id(args["customer_id"])
+        if customer_id is None:
+            raise ValueError("customer_id must be an integer")
+        query = query.where(Invoice.customer == customer_id)
+
+    ranges = [
+        ("issue_date_from", Invoice.issue_date, ">="),
+        ("issue_date_to", Invoice.issue_date, "<="),
+        ("due_date_from", Invoice.due_date, ">="),
+        ("due_date_to", Invoice.due_date, "<="),
+    ]
+    for name, column, op in ranges:
+        if not args.get(name):
+            continue
+        try:
+            value = parse_date(args[name])
+        except ValueError:
+            raise ValueError(f"{name} must be YYYY-MM-DD")
+        if op == ">=":
+            query = query.where(column >= value)
+        else:
+            query = query.where(column <= value)
+
+    return query
+
+
+def invoice_lines(inv):
+    """Line items of an invoice with their catalog item joined in (1 query)."""
+    return (
+        InvoiceItem
+        .select(InvoiceItem, Item)
+        .join(Item)
+        .where(InvoiceItem.invoice == inv)
+        .order_by(InvoiceItem.id)
+    )
+
+
+def invoice_etag(inv):
+    """
+    ETag for an invoice with its lines: the invoice's version covers the
+    lines (every line write stamps it, see adjust_invoice_total), the
+    catalog items' versions cover the item names shown on them.
+    """
+    items = (
+        Item.select(fn.MAX(Item.version))
+        .join(InvoiceItem)
+        .where(InvoiceItem.invoice == inv)
+        .scalar()
+    )
+    return f"invoice-{inv.id}-{inv.version}-{items or 0}"
+
+
+def adjust_invoice_total(invoice_id, delta):
+    """
+    Apply a line-item change to the stored total with a single atomic
+    UPDATE instead of re-summing every line. `flask check-totals` finds
+    and repairs any drift.
+    Also stamps the invoice (even when delta is 0): its lines changed.
+    """
+    (Invoice
+     .update(
+         total=fn.ROUND(Invoice.total + delta, 2), **stamp(current_user.id)
+     )
+     .where(Invoice.id == invoice_id)
+     .execute())
 
 
 # Utility: safe "get or 404" with user ownership
@@ -114,16 +478,107 @@ def get_invoice_for_user(invoice_id):
         return None
 
 
+def get_invoice_item_for_user(line_id):
+    # invoice and catalog item are joined so ownership checks and
+    # serialization don't trigger lazy lookups
+    try:
+        return (
+            InvoiceItem
+            .select(InvoiceItem, Invoice, Item)
+            .join(Invoice)
+            .switch(InvoiceItem)
+            .join(Item)
+            .where(
+                (InvoiceItem.id == line_id) &
+                (Invoice.user == current_user)
+            )
+            .get()
+        )
+    except InvoiceItem.DoesNotExist:
+        return None
+
+
+def resolve_catalog_items(item_ids):
+    """The current user's catalog items for item_ids, {id: Item}, from
+    the catalog cache (one query for the ones not cached). Ids that
+    aren't numbers are left for build_invoice_lines() to reject."""
+    item_ids = [i for i in item_ids if i]
+    if not item_ids:
+        return {}
+    return catalog_cache.get_many(current_user.id, item_ids)
+
+
+def build_invoice_lines(rows, catalog):
+    """
+    Turn request line rows into InvoiceItem field dicts (without the
+    invoice) and their summed total. Rows without item_id are skipped,
+    unit_price defaults to the catalog price.
+    Raises ValueError for an item_id that isn't a number or isn't in
+    catalog.
+    """
+    lines = []
+    total = Decimal("0")
+    for row in rows or []:
+        raw_id = row.get("item_id")
+        if not raw_id:
+            continue
+
+        item_id = parse_id(raw_id)
+        if item_id is None:
+            raise ValueError(f"invalid item_id {raw_id!r}")
+
+        catalog_item = catalog.get(item_id)
+        if not catalog_item:
+            raise ValueError(f"item {item_id} not found")
+
+        try:
+            quantity = int(row.get("quantity", 1))
+            unit_price = Decimal(
+                str(row.get("unit_price", catalog_item.unit_price))
+            )
+        except (TypeError, ValueError, InvalidOperation):
+            raise ValueError(f"invalid quantity or unit_price for item {item_id}")
+        lines.append({
+            "item": catalog_item.id,
+            "quantity": quantity,
+            "unit_price": unit_price,
+        })
+        total += quantity * unit_price
+    return lines, total
+
+
+def invoice_ids_for(condition):
+    """Ids of the current user's invoices matching condition."""
+    return [
+        inv_id for (inv_id,) in
+        Invoice.select(Invoice.id)
+        .where((Invoice.user == current_user) & condition)
+        .tuples()
+    ]
+
+
 # -------CUSTOMERS -------------
 
 @api_bp.route("/customers", methods=["GET"])
 @login_required
+@replica_reads
 def list_customers():
-    customers = [
-        customer_to_dict(c)
-        for c in Customer.select().where(Customer.user == current_user)
-    ]
-    return jsonify(customers)
+    """
+    Query params (all optional):
+    limit, cursor, fields=id,name,...
+    or since=<cursor>[&limit] for the changes since an earlier call
+    """
+    query = Customer.select().where(Customer.user == current_user)
+    try:
+        if "since" in request.args:
+            return changes_response(Customer, query, customer_to_dict)
+        opts = parse_list_args(CUSTOMER_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return conditional_response(list_etag(Customer), lambda: list_response(
+        query, Customer, CUSTOMER_FIELDS, opts
+    ))
 
 
 @api_bp.route("/customers", methods=["POST"])
@@ -145,11 +600,14 @@ def create_customer():
 
 @api_bp.route("/customers/<int:customer_id>", methods=["GET"])
 @login_required
+@replica_reads
 def get_customer(customer_id):
     c = get_customer_for_user(customer_id)
     if not c:
         return jsonify({"error": "not found"}), 404
-    return jsonify(customer_to_dict(c))
+    return conditional_response(
+        f"customer-{c.id}-{c.version}", lambda: jsonify(customer_to_dict(c))
+    )
 
 
 @api_bp.route("/customers/<int:customer_id>", methods=["PUT", "PATCH"])
@@ -164,6 +622,9 @@ def update_customer(customer_id):
         if field in data:
             setattr(c, field, data[field])
     c.save()
+
+    # customer details are printed on the PDF
+    pdf_cache.invalidate(*invoice_ids_for(Invoice.customer == c))
     return jsonify(customer_to_dict(c))
 
 
@@ -174,7 +635,12 @@ def delete_customer(customer_id):
     if not c:
         return jsonify({"error": "not found"}), 404
 
-    c.delete_instance(recursive=True)
+    invoice_ids = invoice_ids_for(Invoice.customer == c)
+    pdf_cache.invalidate(*invoice_ids)
+    with db.atomic():
+        bury(Customer, [c.id], current_user.id)
+        bury(Invoice, invoice_ids, current_user.id)
+        c.delete_instance(recursive=True)
     return jsonify({"message": "deleted"}), 200
 
 
@@ -182,12 +648,24 @@ def delete_customer(customer_id):
 
 @api_bp.route("/items", methods=["GET"])
 @login_required
+@replica_reads
 def list_items():
-    items = [
-        item_to_dict(it)
-        for it in Item.select().where(Item.user == current_user)
-    ]
-    return jsonify(items)
+    """
+    Query params (all optional):
+    limit, cursor, fields=id,name,...
+    or since=<cursor>[&limit] for the changes since an earlier call
+    """
+    query = Item.select().where(Item.user == current_user)
+    try:
+        if "since" in request.args:
+            return changes_response(Item, query, item_to_dict)
+        opts = parse_list_args(ITEM_FIELDS)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return conditional_response(list_etag(Item), lambda: list_response(
+        query, Item, ITEM_FIELDS, opts
+    ))
 
 
 @api_bp.route("/items", methods=["POST"])
@@ -219,11 +697,14 @@ def create_item():
 
 @api_bp.route("/items/<int:item_id>", methods=["GET"])
 @login_required
+@replica_reads
 def get_item(item_id):
     it = get_item_for_user(item_id)
     if not it:
         return jsonify({"error": "not found"}), 404
-    return jsonify(item_to_dict(it))
+    return conditional_response(
+        f"item-{it.id}-{it.version}", lambda: jsonify(item_to_dict(it))
+    )
 
 
 @api_bp.route("/items/<int:item_id>", methods=["PUT", "PATCH"])
@@ -238,6 +719,15 @@ def update_item(item_id):
         if field in data:
             setattr(it, field, data[field])
     it.save()
+    catalog_cache.forget(current_user.id, it.id)
+
+    # item names are printed on the PDF
+    pdf_cache.invalidate(*invoice_ids_for(
+        Invoice.id.in_(
+            InvoiceItem.select(InvoiceItem.invoice)
+            .where(InvoiceItem.item == it)
+        )
+    ))
     return jsonify(item_to_dict(it))
 
 
@@ -248,7 +738,38 @@ def delete_item(item_id):
     if not it:
         return jsonify({"error": "not found"}), 404
 
-    it.delete_instance(recursive=True)
+    with db.atomic():
+        # a write first: on SQLite it takes the write lock, so the lines
+        # read below can't change before they are deleted (and a read
+        # first would fail to upgrade if another write committed)
+        bury(Item, [it.id], current_user.id)
+        # invoices lose the lines that use this item, and their amounts
+        lines = InvoiceItem.select().where(InvoiceItem.item == it)
+        invoice_ids = [
+            inv_id for (inv_id,) in
+            lines.select(InvoiceItem.invoice).distinct().tuples()
+        ]
+        if invoice_ids:
+            before = locked_invoices(invoice_ids)
+            removed = (
+                InvoiceItem
+                .select(fn.SUM(InvoiceItem.quantity * InvoiceItem.unit_price))
+                .where(
+                    (InvoiceItem.invoice == Invoice.id) &
+                    (InvoiceItem.item == it)
+                )
+            )
+            (Invoice
+             .update(
+                 total=fn.ROUND(Invoice.total - removed, 2),
+                 **stamp(current_user.id),
+             )
+             .where(Invoice.id.in_(invoice_ids))
+             .execute())
+            for inv in Invoice.select().where(Invoice.id.in_(invoice_ids)):
+                record_change(snapshot(before[inv.id]), snapshot(inv))
+        it.delete_instance(recursive=True)
+    catalog_cache.forget(current_user.id, it.id)
     return jsonify({"message": "deleted"}), 200
 
 
@@ -256,12 +777,38 @@ def delete_item(item_id):
 
 @api_bp.route("/invoices", methods=["GET"])
 @login_required
+@replica_reads
 def list_invoices():
-    invoices = [
-        invoice_to_dict(inv)
-        for inv in Invoice.select().where(Invoice.user == current_user)
-    ]
-    return jsonify(invoices)
+    """
+    Query params (all optional):
+    limit, cursor, fields=id,status,...
+    status=sent[,paid], customer_id=1,
+    issue_date_from, issue_date_to, due_date_from, due_date_to (YYYY-MM-DD)
+    or since=<cursor>[&limit] for the changes since an earlier call (the
+    changed invoices come with their items)
+    """
+    query = Invoice.select().where(Invoice.user == current_user)
+    try:
+        if "since" in request.args:
+            return changes_response(
+                Invoice, query,
+                lambda inv: invoice_to_dict(
+                    inv, include_items=True, lines=inv.invoice_items
+                ),
+                load=lambda invoices: prefetch(
+                    invoices,
+                    InvoiceItem.select(InvoiceItem, Item).join(Item)
+                    .order_by(InvoiceItem.id),
+                ),
+            )
+        opts = parse_list_args(INVOICE_FIELDS)
+        query = filter_invoices(query, request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return conditional_response(list_etag(Invoice), lambda: list_response(
+        query, Invoice, INVOICE_FIELDS, opts
+    ))
 
 
 @api_bp.route("/invoices", methods=["POST"])
@@ -286,53 +833,54 @@ def create_invoice():
     if not customer_id:
         return jsonify({"error": "customer_id is required"}), 400
 
-    customer = get_customer_for_user(customer_id)
+    customer = get_customer_for_user(parse_id(customer_id))
     if not customer:
         return jsonify({"error": "customer not found"}), 400
 
-    inv = Invoice.create(
-        user=current_user,
-        customer=customer,
-        issue_date=parse_date(data.get("issue_date")) or date.today(),
-        due_date=parse_date(data.get("due_date")),
-        status=data.get("status") or "draft",
-    )
-
+    # resolve every catalog item up front so nothing is written on error
     items_data = data.get("items") or []
-    for row in items_data:
-        item_id = row.get("item_id")
-        quantity = row.get("quantity", 1)
-
-        if not item_id:
-            continue
-
-        catalog_item = get_item_for_user(item_id)
-        if not catalog_item:
-            return jsonify({"error": f"item {item_id} not found"}), 400
-
-        unit_price = row.get("unit_price", catalog_item.unit_price)
-
-        InvoiceItem.create(
-            invoice=inv,
-            item=catalog_item,
-            quantity=quantity,
-            unit_price=unit_price,
+    try:
+        lines, total = build_invoice_lines(
+            items_data,
+            resolve_catalog_items(row.get("item_id") for row in items_data),
         )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # 👇 recalc stored total after creating all items
-    recalc_invoice_total(inv)
+    try:
+        with db.atomic():
+            inv = Invoice.create(
+                user=current_user,
+                customer=customer,
+                issue_date=parse_date(data.get("issue_date")) or date.today(),
+                due_date=parse_date(data.get("due_date")),
+                status=data.get("status") or "draft",
+                total=total,
+            )
+            catalog_cache.check(current_user.id, [line["item"] for line in lines])
+            if lines:
+                version = stamp(current_user.id)
+                InvoiceItem.insert_many(
+                    [dict(line, invoice=inv.id, **version) for line in lines]
+                ).execute()
+            record_change(new=snapshot(inv))
+    except ItemGone as e:
+        return jsonify({"error": str(e)}), 400
 
-    inv = get_invoice_for_user(inv.id)
     return jsonify(invoice_to_dict(inv, include_items=True)), 201
 
 
 @api_bp.route("/invoices/<int:invoice_id>", methods=["GET"])
 @login_required
+@replica_reads
 def get_invoice(invoice_id):
     inv = get_invoice_for_user(invoice_id)
     if not inv:
         return jsonify({"error": "not found"}), 404
-    return jsonify(invoice_to_dict(inv, include_items=True))
+    return conditional_response(
+        invoice_etag(inv),
+        lambda: jsonify(invoice_to_dict(inv, include_items=True)),
+    )
 
 
 @api_bp.route("/invoices/<int:invoice_id>", methods=["PUT", "PATCH"])
@@ -356,7 +904,7 @@ def update_invoice(invoice_id):
     data = request.get_json() or {}
 
     if "customer_id" in data:
-        customer = get_customer_for_user(data["customer_id"])
+        customer = get_customer_for_user(parse_id(data["customer_id"]))
         if not customer:
             return jsonify({"error": "customer not found"}), 400
         inv.customer = customer
@@ -368,35 +916,42 @@ def update_invoice(invoice_id):
     if "status" in data:
         inv.status = data["status"]
 
-    inv.save()
-
-    # If items provided, replace all invoice line items
+    # If items provided, replace all invoice line items. Everything is
+    # validated before the write so a bad item can't leave the invoice
+    # half-written.
+    lines = None
     if "items" in data:
-        InvoiceItem.delete().where(InvoiceItem.invoice == inv).execute()
-        for row in data["items"] or []:
-            item_id = row.get("item_id")
-            quantity = row.get("quantity", 1)
-
-            if not item_id:
-                continue
-
-            catalog_item = get_item_for_user(item_id)
-            if not catalog_item:
-                return jsonify({"error": f"item {item_id} not found"}), 400
-
-            unit_price = row.get("unit_price", catalog_item.unit_price)
-
-            InvoiceItem.create(
-                invoice=inv,
-                item=catalog_item,
-                quantity=quantity,
-                unit_price=unit_price,
+        items_data = data["items"] or []
+        try:
+            lines, inv.total = build_invoice_lines(
+                items_data,
+                resolve_catalog_items(row.get("item_id") for row in items_data),
             )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # recalc total after changing items
-        recalc_invoice_total(inv)
-
-    inv = get_invoice_for_user(invoice_id)
+    try:
+        with db.atomic():
+            stored = locked_invoices([inv.id])[inv.id]
+            if lines is None:
+                # lines may have been added since inv was read
+                inv.total = stored.total
+            inv.save()
+            if lines is not None:
+                catalog_cache.check(
+                    current_user.id, [line["item"] for line in lines]
+                )
+                InvoiceItem.delete().where(InvoiceItem.invoice == inv).execute()
+                if lines:
+                    version = stamp(current_user.id)
+                    InvoiceItem.insert_many(
+                        [dict(line, invoice=inv.id, **version) for line in lines]
+                    ).execute()
+            record_change(snapshot(stored), snapshot(inv))
+    except ItemGone as e:
+        return jsonify({"error": str(e)}), 400
+
+    pdf_cache.invalidate(inv.id)
     return jsonify(invoice_to_dict(inv, include_items=True))
 
 
@@ -407,7 +962,11 @@ def delete_invoice(invoice_id):
     if not inv:
         return jsonify({"error": "not found"}), 404
 
-    inv.delete_instance(recursive=True)
+    pdf_cache.invalidate(inv.id)
+    with db.atomic():
+        record_change(old=locked_snapshot(inv.id))
+        bury(Invoice, [inv.id], current_user.id)
+        inv.delete_instance(recursive=True)
     return jsonify({"message": "deleted"}), 200
 
 
@@ -415,13 +974,15 @@ def delete_invoice(invoice_id):
 
 @api_bp.route("/invoices/<int:invoice_id>/items", methods=["GET"])
 @login_required
+@replica_reads
 def list_invoice_items(invoice_id):
     inv = get_invoice_for_user(invoice_id)
     if not inv:
         return jsonify({"error": "invoice not found"}), 404
 
-    items = [invoice_item_to_dict(li) for li in inv.invoice_items]
-    return jsonify(items)
+    return conditional_response(invoice_etag(inv), lambda: jsonify([
+        invoice_item_to_dict(li) for li in invoice_lines(inv)
+    ]))
 
 
 @api_bp.route("/invoices/<int:invoice_id>/items", methods=["POST"])
@@ -444,61 +1005,81 @@ def add_invoice_item(invoice_id):
     if not item_id:
         return jsonify({"error": "item_id is required"}), 400
 
-    catalog_item = get_item_for_user(item_id)
+    catalog_item = catalog_cache.get(current_user.id, item_id)
     if not catalog_item:
         return jsonify({"error": "item not found"}), 400
 
-    quantity = data.get("quantity", 1)
-    unit_price = data.get("unit_price", catalog_item.unit_price)
-
-    li = InvoiceItem.create(
-        invoice=inv,
-        item=catalog_item,
-        quantity=quantity,
-        unit_price=unit_price,
-    )
+    try:
+        (line,), delta = build_invoice_lines(
+            [data], {catalog_item.id: catalog_item}
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # 👇 recalc total after adding a line
-    recalc_invoice_total(inv)
+    try:
+        with db.atomic():
+            stored = locked_invoices([inv.id])[inv.id]
+            catalog_cache.check(current_user.id, [catalog_item.id])
+            li = InvoiceItem.create(
+                invoice=inv,
+                item=catalog_item,
+                quantity=line["quantity"],
+                unit_price=line["unit_price"],
+            )
+            # 👇 apply the new line to the stored total
+            adjust_invoice_total(inv.id, delta)
+            record_change(
+                snapshot(stored), snapshot(stored, total=stored.total + delta)
+            )
+    except ItemGone as e:
+        return jsonify({"error": str(e)}), 400
+    pdf_cache.invalidate(inv.id)
 
     return jsonify(invoice_item_to_dict(li)), 201
 
 
 @api_bp.route("/invoice-items/<int:line_id>", methods=["GET"])
 @login_required
+@replica_reads
 def get_invoice_item(line_id):
-    try:
-        li = InvoiceItem.get_by_id(line_id)
-    except InvoiceItem.DoesNotExist:
-        return jsonify({"error": "not found"}), 404
-
     # enforce ownership via invoice -> user
-    if li.invoice.user != current_user:
+    li = get_invoice_item_for_user(line_id)
+    if not li:
         return jsonify({"error": "not found"}), 404
 
-    return jsonify(invoice_item_to_dict(li))
+    return conditional_response(
+        f"invoice-item-{li.id}-{li.version}-{li.item.version}",
+        lambda: jsonify(invoice_item_to_dict(li)),
+    )
 
 
 @api_bp.route("/invoice-items/<int:line_id>", methods=["PUT", "PATCH"])
 @login_required
 def update_invoice_item(line_id):
-    try:
-        li = InvoiceItem.get_by_id(line_id)
-    except InvoiceItem.DoesNotExist:
-        return jsonify({"error": "not found"}), 404
-
-    if li.invoice.user != current_user:
+    li = get_invoice_item_for_user(line_id)
+    if not li:
         return jsonify({"error": "not found"}), 404
 
     data = request.get_json() or {}
-    if "quantity" in data:
-        li.quantity = data["quantity"]
-    if "unit_price" in data:
-        li.unit_price = data["unit_price"]
-    li.save()
-
-    # 👇 recalc total after updating a line
-    recalc_invoice_total(li.invoice)
+    old_total = li.total
+    try:
+        if "quantity" in data:
+            li.quantity = int(data["quantity"])
+        if "unit_price" in data:
+            li.unit_price = Decimal(str(data["unit_price"]))
+    except (TypeError, ValueError, InvalidOperation):
+        return jsonify({"error": "invalid quantity or unit_price"}), 400
+
+    with db.atomic():
+        stored = locked_invoices([li.invoice_id])[li.invoice_id]
+        li.save()
+        # 👇 apply the change of this line to the stored total
+        delta = li.total - old_total
+        adjust_invoice_total(li.invoice_id, delta)
+        record_change(
+            snapshot(stored), snapshot(stored, total=stored.total + delta)
+        )
+    pdf_cache.invalidate(li.invoice_id)
 
     return jsonify(invoice_item_to_dict(li))
 
@@ -506,48 +1087,401 @@ def update_invoice_item(line_id):
 @api_bp.route("/invoice-items/<int:line_id>", methods=["DELETE"])
 @login_required
 def delete_invoice_item(line_id):
-    try:
-        li = InvoiceItem.get_by_id(line_id)
-    except InvoiceItem.DoesNotExist:
+    li = get_invoice_item_for_user(line_id)
+    if not li:
         return jsonify({"error": "not found"}), 404
 
-    if li.invoice.user != current_user:
-        return jsonify({"error": "not found"}), 404
+    with db.atomic():
+        stored = locked_invoices([li.invoice_id])[li.invoice_id]
+        li.delete_instance()
+        # 👇 remove the line from the stored total
+        adjust_invoice_total(li.invoice_id, -li.total)
+        record_change(
+            snapshot(stored), snapshot(stored, total=stored.total - li.total)
+        )
+    pdf_cache.invalidate(li.invoice_id)
 
-    inv = li.invoice
-    li.delete_instance()
+    return "", 204
 
-    # 👇 recalc total after deleting a line
-    recalc_invoice_total(inv)
 
-    return "", 204
 
+# ---------- DASHBOARD -------------
 
+TOP_CUSTOMERS = 5
 
-# ---------  INVOICE PDF (WeasyPrint) -----
 
-@api_bp.route("/invoices/<int:invoice_id>/pdf", methods=["GET"])
+def build_summary(user):
+    """Counts and money totals for the dashboard, all done in SQL."""
+    owned = Invoice.user == user
+    today = date.today()
+    # anything issued and not yet paid is still owed
+    open_ = owned & Invoice.status.not_in(CLOSED_STATUSES)
+
+    by_status = {
+        row["status"]: {
+            "count": row["count"],
+            "total": float(row["total"] or 0),
+        }
+        for row in Invoice
+        .select(
+            Invoice.status,
+            fn.COUNT(Invoice.id).alias("count"),
+            fn.SUM(Invoice.total).alias("total"),
+        )
+        .where(owned)
+        .group_by(Invoice.status)
+        .dicts()
+    }
+
+    outstanding = (
+        Invoice
+        .select(
+            fn.COUNT(Invoice.id).alias("count"),
+            fn.SUM(Invoice.total).alias("total"),
+            fn.SUM(Case(None, [(Invoice.due_date < today, 1)], 0))
+            .alias("overdue_count"),
+            fn.SUM(Case(None, [(Invoice.due_date < today, Invoice.total)], 0))
+            .alias("overdue_total"),
+        )
+        .where(open_)
+        .dicts()
+        .get()
+    )
+
+    top_customers = [
+        {
+            "customer_id": row["id"],
+            "name": row["name"],
+            "invoices": row["invoices"],
+            "total": float(row["total"] or 0),
+        }
+        for row in Customer
+        .select(
+            Customer.id,
+            Customer.name,
+            fn.COUNT(Invoice.id).alias("invoices"),
+            fn.SUM(Invoice.total).alias("total"),
+        )
+        .join(Invoice)
+        .where(owned)
+        .group_by(Customer.id, Customer.name)
+        .order_by(fn.SUM(Invoice.total).desc())
+        .limit(TOP_CUSTOMERS)
+        .dicts()
+    ]
+
+    return {
+        "counts": {
+            "customers": Customer.select().where(Customer.user == user).count(),
+            "items": Item.select().where(Item.user == user).count(),
+            "invoices": sum(st["count"] for st in by_status.values()),
+        },
+        "revenue_by_status": by_status,
+        "revenue": by_status.get("paid", {}).get("total", 0.0),
+        "outstanding": {
+            "count": outstanding["count"],
+            "total": float(outstanding["total"] or 0),
+        },
+        "overdue": {
+            "count": outstanding["overdue_count"] or 0,
+            "total": float(outstanding["overdue_total"] or 0),
+        },
+        "top_customers": top_customers,
+    }
+
+
+@api_bp.route("/dashboard/summary", methods=["GET"])
 @login_required
-def invoice_pdf(invoice_id):
-    inv = get_invoice_for_user(invoice_id)
-    if not inv:
-        return jsonify({"error": "not found"}), 404
+def dashboard_summary():
+    summary = summary_cache.get(current_user.id)
+    if summary is None:
+        summary = build_summary(current_user.id)
+        summary_cache.set(
+            current_user.id, summary,
+            ttl=current_app.config.get("DASHBOARD_CACHE_TTL"),
+        )
+    return jsonify(summary)
+
+
+@api_bp.after_app_request
+def _drop_summary_on_write(response):
+    if (
+        request.method not in ("GET", "HEAD", "OPTIONS")
+        and response.status_code < 400
+        and current_user.is_authenticated
+    ):
+        summary_cache.pop(current_user.id)
+    return response
 
-    customer = inv.customer
-    items = list(inv.invoice_items)
+
+# ---------  INVOICE PDF (WeasyPrint) -----
+
+def render_invoice_html(invoice_id):
+    """Render invoice.html for one of the current user's invoices."""
+    try:
+        inv = (
+            Invoice
+            .select(Invoice, Customer)
+            .join(Customer)
+            .where(
+                (Invoice.id == invoice_id) &
+                (Invoice.user == current_user)
+            )
+            .get()
+        )
+    except Invoice.DoesNotExist:
+        return None, None
 
     html = render_template(
         "invoice.html",
         invoice=inv,
-        customer=customer,
-        items=items,
+        customer=inv.customer,
+        items=list(invoice_lines(inv)),
     )
+    return inv, html
 
-    pdf_bytes = HTML(string=html).write_pdf()
 
+def pdf_response(invoice_id, pdf_bytes, key):
     response = make_response(pdf_bytes)
     response.headers["Content-Type"] = "application/pdf"
     response.headers["Content-Disposition"] = (
-        f'inline; filename="invoice-{inv.id}.pdf"'
+        f'inline; filename="invoice-{invoice_id}.pdf"'
+    )
+    response.set_etag(key)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def renderer_busy():
+    response = jsonify({"error": "pdf renderer busy, retry later"})
+    response.status_code = 503
+    response.headers["Retry-After"] = "5"
+    return response
+
+
+@api_bp.route("/invoices/<int:invoice_id>/pdf", methods=["GET"])
+@login_required
+@replica_reads
+def invoice_pdf(invoice_id):
+    inv, html = render_invoice_html(invoice_id)
+    if not inv:
+        return jsonify({"error": "not found"}), 404
+
+    # the rendered HTML captures invoice, customer and line-item state,
+    # so its hash doubles as cache key and ETag
+    key = pdf_cache.key_for(html)
+    if key in request.if_none_match:
+        response = make_response("", 304)
+        response.set_etag(key)
+        return response
+
+    pdf_bytes = pdf_cache.get(inv.id, key)
+    if pdf_bytes is None:
+        try:
+            with instrumentation.timer("pdf"):
+                pdf_bytes = pdf_renderer.render(html)
+        except RendererBusy:
+            return renderer_busy()
+        except FutureTimeoutError:
+            return jsonify({
+                "error": "pdf rendering timed out",
+                "hint": f"use POST /invoices/{inv.id}/pdf/jobs",
+            }), 503
+        pdf_cache.put(inv.id, key, pdf_bytes)
+
+    return pdf_response(inv.id, pdf_bytes, key)
+
+
+@api_bp.route("/invoices/<int:invoice_id>/pdf/jobs", methods=["POST"])
+@login_required
+def create_pdf_job(invoice_id):
+    """Start rendering in the background; poll the returned status_url."""
+    inv, html = render_invoice_html(invoice_id)
+    if not inv:
+        return jsonify({"error": "not found"}), 404
+
+    key = pdf_cache.key_for(html)
+    cached = pdf_cache.get(inv.id, key)
+    try:
+        job = pdf_renderer.create_job(
+            current_user.id, inv.id, key, html=html, pdf_bytes=cached
+        )
+    except RendererBusy:
+        return renderer_busy()
+
+    if cached is None:
+        def _store(future):
+            if not future.cancelled() and future.exception() is None:
+                pdf_cache.put(inv.id, key, future.result())
+        job["future"].add_done_callback(_store)
+
+    response = jsonify(pdf_job_to_dict(job))
+    response.status_code = 202
+    response.headers["Location"] = url_for(
+        "api.get_pdf_job", invoice_id=inv.id, job_id=job["id"]
+    )
+    return response
+
+
+def pdf_job_to_dict(job):
+    status = PDFRenderer.job_status(job)
+    data = {
+        "id": job["id"],
+        "invoice_id": job["invoice_id"],
+        "status": status,
+        "status_url": url_for(
+            "api.get_pdf_job",
+            invoice_id=job["invoice_id"], job_id=job["id"],
+        ),
+    }
+    if status == "done":
+        data["download_url"] = url_for(
+            "api.download_pdf_job",
+            invoice_id=job["invoice_id"], job_id=job["id"],
+        )
+    elif status == "failed":
+        data["error"] = "rendering failed"
+    return data
+
+
+@api_bp.route("/invoices/<int:invoice_id>/pdf/jobs/<job_id>", methods=["GET"])
+@login_required
+def get_pdf_job(invoice_id, job_id):
+    job = pdf_renderer.get_job(job_id, current_user.id)
+    if not job or job["invoice_id"] != invoice_id:
+        return jsonify({"error": "not found"}), 404
+    return jsonify(pdf_job_to_dict(job))
+
+
+@api_bp.route(
+    "/invoices/<int:invoice_id>/pdf/jobs/<job_id>/download", methods=["GET"]
+)
+@login_required
+def download_pdf_job(invoice_id, job_id):
+    job = pdf_renderer.get_job(job_id, current_user.id)
+    if not job or job["invoice_id"] != invoice_id:
+        return jsonify({"error": "not found"}), 404
+
+    status = PDFRenderer.job_status(job)
+    if status != "done":
+        return jsonify(pdf_job_to_dict(job)), 409
+
+    return pdf_response(invoice_id, job["future"].result(), job["key"])
+
+
+def iter_invoices_for_pdf(invoice_ids, chunk_size=100):
+    """
+    Yield invoices (customer joined, lines prefetched) for the given ids in
+    order, loading chunk_size invoices per round of queries.
+    """
+    for start in range(0, len(invoice_ids), chunk_size):
+        chunk = invoice_ids[start:start + chunk_size]
+        invoices = (
+            Invoice
+            .select(Invoice, Customer)
+            .join(Customer)
+            .where(Invoice.id.in_(chunk))
+        )
+        lines = (
+            InvoiceItem
+            .select(InvoiceItem, Item)
+            .join(Item)
+            .order_by(InvoiceItem.id)
+        )
+        by_id = {inv.id: inv for inv in prefetch(invoices, lines)}
+        for invoice_id in chunk:
+            if invoice_id in by_id:
+                yield by_id[invoice_id]
+
+
+@api_bp.route("/invoices/pdf-batch", methods=["POST"])
+@login_required
+def invoice_pdf_batch():
+    """
+    Render many invoices at once. JSON:
+    {
+      "ids": [1, 2, 3],              # or, same filters as GET /invoices:
+      "filters": {"status": "sent", "issue_date_from": "2025-11-01"},
+      "format": "zip"                # "zip" (default) or "pdf" (merged)
+    }
+    """
+    data = request.get_json() or {}
+    fmt = data.get("format") or "zip"
+    if fmt not in ("zip", "pdf"):
+        return jsonify({"error": "format must be zip or pdf"}), 400
+    max_size = PDF_BATCH_MAX if fmt == "zip" else PDF_BATCH_MAX_MERGED
+    too_many = f"at most {max_size} invoices per batch"
+
+    query = Invoice.select(Invoice.id).where(Invoice.user == current_user)
+    if data.get("ids") is not None:
+        if not isinstance(data["ids"], list):
+            return jsonify({"error": "ids must be a list"}), 400
+        if len(data["ids"]) > max_size:
+            return jsonify({"error": too_many}), 400
+        ids = [parse_id(i) for i in data["ids"]]
+        if None in ids:
+            return jsonify({"error": "ids must be integers"}), 400
+        query = query.where(Invoice.id.in_(ids))
+    else:
+        filters = {k: str(v) for k, v in (data.get("filters") or {}).items()}
+        try:
+            query = filter_invoices(query, filters)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    # one over the cap is enough to know a filter matched too many
+    invoice_ids = [
+        inv_id for (inv_id,) in
+        query.order_by(Invoice.id).limit(max_size + 1).tuples()
+    ]
+    if not invoice_ids:
+        return jsonify({"error": "no invoices matched"}), 404
+    if len(invoice_ids) > max_size:
+        return jsonify({"error": too_many}), 400
+
+    if fmt == "pdf":
+        html = render_template(
+            "invoice_batch.html",
+            invoices=[
+                {"invoice": inv, "customer": inv.customer,
+                 "lines": inv.invoice_items}
+                for inv in iter_invoices_for_pdf(invoice_ids)
+            ],
+        )
+        try:
+            with instrumentation.timer("pdf"):
+                pdf_bytes = pdf_renderer.render(
+                    html, timeout=pdf_renderer.timeout * len(invoice_ids)
+                )
+        except RendererBusy:
+            return renderer_busy()
+        except FutureTimeoutError:
+            return jsonify({
+                "error": "pdf rendering timed out",
+                "hint": 'use "format": "zip" or fewer invoices per batch',
+            }), 503
+        response = make_response(pdf_bytes)
+        response.headers["Content-Type"] = "application/pdf"
+        response.headers["Content-Disposition"] = (
+            'attachment; filename="invoices.pdf"'
+        )
+        return response
+
+    def documents():
+        for inv in iter_invoices_for_pdf(invoice_ids):
+            html = render_template(
+                "invoice.html",
+                invoice=inv,
+                customer=inv.customer,
+                items=inv.invoice_items,
+            )
+            yield f"invoice-{inv.id}.pdf", html
+
+    body = db_stream(
+        lambda: zip_stream(pdf_renderer.render_many(documents()))
+    )
+    response = Response(body, mimetype="application/zip")
+    response.headers["Content-Disposition"] = (
+        'attachment; filename="invoices.zip"'
     )
     return response
@@ -0,0 +1,105 @@
+from functools import reduce
+import operator
+import re
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required, current_user
+from peewee import SqliteDatabase
+
+from .models import db, Customer, Invoice, Item, SEARCH_INDEXES
+from .routes import (
+    customer_to_dict, item_to_dict, invoice_to_dict, replica_reads
+)
+
+search_bp = Blueprint("search", __name__)
+
+SEARCH_MAX_LIMIT = 50
+SEARCH_TYPES = ("customers", "items", "invoices")
+
+
+def search_terms(q):
+    # the same word split FTS5's unicode61 tokenizer does; also drops
+    # quotes and operators, so user input can't break the MATCH syntax
+    return re.findall(r"\w+", q or "")
+
+
+def ranked_matches(model, terms, limit):
+    """
+    The current user's rows of model matching every term as a word
+    prefix, best bm25 rank first.
+    """
+    table = model._meta.table_name
+    if not isinstance(db.current, SqliteDatabase):
+        # no FTS5 (e.g. PostgreSQL): unranked substring match instead
+        columns = [getattr(model, c) for c in SEARCH_INDEXES[table]]
+        cond = reduce(operator.and_, [
+            reduce(operator.or_, [col.contains(t) for col in columns])
+            for t in terms
+        ])
+        return list(
+            model.select()
+            .where((model.user == current_user) & cond)
+            .order_by(model.id)
+            .limit(limit)
+        )
+
+    match = " ".join(f'"{t}"*' for t in terms)
+    return list(model.raw(
+        f"SELECT t.* FROM {table}_fts AS f "
+        f"JOIN {table} AS t ON t.id = f.rowid "
+        f"WHERE {table}_fts MATCH ? AND t.user_id = ? "
+        f"ORDER BY f.rank LIMIT ?",
+        match, current_user.id, limit,
+    ))
+
+
+@search_bp.route("/search", methods=["GET"])
+@login_required
+@replica_reads
+def search():
+    """
+    Type-ahead search. Query params:
+    q=acme bil (every word matches as a prefix, best matches first),
+    types=customers,items,invoices (default: all), limit=10 (per type, max 50)
+    Invoices are those of the matching customers (or the invoice whose id
+    is q), newest first.
+    """
+    types = [t for t in request.args.get("types", ",".join(SEARCH_TYPES)).split(",") if t]
+    if not types or any(t not in SEARCH_TYPES for t in types):
+        return jsonify({"error": "types must be customers, items or invoices"}), 400
+    try:
+        limit = min(int(request.args.get("limit", 10)), SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "limit must be an integer"}), 400
+    if limit < 1:
+        return jsonify({"error": "limit must be positive"}), 400
+
+    q = request.args.get("q", "")
+    terms = search_terms(q)
+    result = {t: [] for t in types}
+    if not terms:
+        return jsonify(result)
+
+    customers = []
+    if "customers" in types or "invoices" in types:
+        customers = ranked_matches(Customer, terms, limit)
+    if "customers" in types:
+        result["customers"] = [customer_to_dict(c) for c in customers]
+    if "items" in types:
+        result["items"] = [
+            item_to_dict(it) for it in ranked_matches(Item, terms, limit)
+        ]
+    if "invoices" in types:
+        cond = Invoice.customer.in_([c.id for c in customers])
+        number = q.strip()
+        # isdigit() alone also takes "²" and other digits int() refuses
+        if number.isascii() and number.isdigit() and len(number) < 19:
+            cond |= Invoice.id == int(number)
+        invoices = (
+            Invoice.select()
+            .where((Invoice.user == current_user) & cond)
+            .order_by(Invoice.issue_date.desc(), Invoice.id.desc())
+            .limit(limit)
+        )
+        result["invoices"] = [invoice_to_dict(inv) for inv in invoices]
+    return jsonify(result)
@@ -0,0 +1,97 @@
+import threading
+import time
+import uuid
+
+from itsdangerous import BadData, URLSafeTimedSerializer
+
+
+class TokenAuth:
+    """
+    Signed, expiring bearer tokens for API clients. Checking one takes the
+    secret key, the in-memory revocation list and, when a
+    generation_loader is registered, the user's token generation (from
+    the user cache), but no session.
+
+    Access tokens authenticate requests; refresh tokens can only be traded
+    for a new pair at /auth/token/refresh.
+    """
+
+    def __init__(self, access_ttl=900, refresh_ttl=30 * 24 * 3600):
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self._serializer = None
+        # jti -> unix time the token expires anyway
+        self._revoked = {}
+        self._lock = threading.Lock()
+        self._generation_loader = None
+
+    def init_app(self, app):
+        cfg = app.config
+        self.access_ttl = int(cfg.get("TOKEN_TTL", self.access_ttl))
+        self.refresh_ttl = int(cfg.get("TOKEN_REFRESH_TTL", self.refresh_ttl))
+        self._serializer = URLSafeTimedSerializer(
+            cfg["SECRET_KEY"], salt="api-token"
+        )
+
+    def generation_loader(self, callback):
+        """
+        Register callback(user_id) -> the user's current token generation,
+        or None for a user that no longer exists. Tokens carry the
+        generation they were issued under and stop verifying once it
+        changes (on a password change).
+        """
+        self._generation_loader = callback
+        return callback
+
+    def _dump(self, user, kind):
+        return self._serializer.dumps({
+            "uid": user.id,
+            "name": user.username,
+            "gen": user.token_generation,
+            "typ": kind,
+            "jti": uuid.uuid4().hex,
+        })
+
+    def issue(self, user):
+        return {
+            "access_token": self._dump(user, "access"),
+            "refresh_token": self._dump(user, "refresh"),
+            "token_type": "Bearer",
+            "expires_in": self.access_ttl,
+        }
+
+    def verify(self, token, kind="access"):
+        """The claims of a valid, unrevoked token of this kind, or None."""
+        max_age = self.access_ttl if kind == "access" else self.refresh_ttl
+        try:
+            claims, signed_at = self._serializer.loads(
+                token, max_age=max_age, return_timestamp=True
+            )
+        except BadData:  # bad signature, expired or malformed
+            return None
+        if claims.get("typ") != kind or self.is_revoked(claims["jti"]):
+            return None
+        if self._generation_loader is not None and (
+            claims.get("gen", 0) != self._generation_loader(claims["uid"])
+        ):
+            return None
+        claims["exp"] = signed_at.timestamp() + max_age
+        return claims
+
+    def revoke(self, claims):
+        with self._lock:
+            self._prune()
+            self._revoked[claims["jti"]] = claims["exp"]
+
+    def is_revoked(self, jti):
+        with self._lock:
+            return jti in self._revoked
+
+    def _prune(self):
+        # an expired token fails verification by itself
+        now = time.time()
+        for jti in [j for j, exp in self._revoked.items() if exp <= now]:
+            del self._revoked[jti]
+
+
+api_tokens = TokenAuth()
@@ -0,0 +1,5 @@
+"""
+Benchmarks for the API: seed a synthetic dataset, drive every route in
+app/routes.py with a weighted mix of requests and report throughput and
+latency percentiles as JSON. See `python -m bench --help`.
+"""
@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+
+import click
+
+from .load import OPS, run_worker, select_ops
+from .report import build_report, compare
+
+
+@click.group()
+def cli():
+    """Seed, load-test and compare runs. The database is the app's own
+    (DATABASE_URL, DB_SHARDS, ...), so point it at a scratch copy."""
+
+
+@cli.command()
+@click.option("--users", default=10, show_default=True)
+@click.option("--customers", default=5000, show_default=True,
+              help="In total, split between the users.")
+@click.option("--items", default=2000, show_default=True,
+              help="In total, split between the users.")
+@click.option("--invoices", default=100000, show_default=True,
+              help="In total, split between the users.")
+@click.option("--max-lines", default=5, show_default=True,
+              help="Lines per invoice are 1..max-lines.")
+@click.option("--password", default="bench", show_default=True)
+@click.option("--seed", default=1, show_default=True)
+def seed(users, customers, items, invoices, max_lines, password, seed):
+    """Insert the synthetic dataset (users bench-1 ... bench-N)."""
+    from app import create_app
+    from .seed import seed_dataset
+
+    app = create_app()
+    with app.app_context():
+        try:
+            counts = seed_dataset(
+                users=users, customers=customers, items=items,
+                invoices=invoices, max_lines=max_lines, password=password,
+                seed=seed,
+            )
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    click.echo(json.dumps(counts))
+
+
+@cli.command()
+@click.option("--url", help="A running server (e.g. http://127.0.0.1:8000); "
+                            "default: the app in this process.")
+@click.option("--threads", default=8, show_default=True,
+              help="Concurrent clients per process.")
+@click.option("--processes", default=1, show_default=True)
+@click.option("--duration", default=30.0, show_default=True,
+              help="Seconds measured, after the warmup.")
+@click.option("--warmup", default=5.0, show_default=True,
+              help="Seconds run before measuring.")
+@click.option("--requests", type=int,
+              help="Stop after this many measured requests instead.")
+@click.option("--op", "ops", multiple=True,
+              help="Only ops matching this glob, e.g. 'GET /invoices*'.")
+@click.option("--users", default=10, show_default=True,
+              help="Seeded bench users to spread the clients over.")
+@click.option("--password", default="bench", show_default=True)
+@click.option("--seed", default=1, show_default=True)
+@click.option("--output", "-o", type=click.Path(dir_okay=False),
+              help="Write the JSON report here instead of stdout.")
+def run(url, threads, processes, duration, warmup, requests, ops, users,
+        password, seed, output):
+    """Drive the API with the op mix and report throughput and p50/p95/p99."""
+    try:
+        op_names = select_ops(ops)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    options = {
+        "url": url, "op_names": op_names, "threads": threads,
+        "duration": duration, "warmup": warmup,
+        "requests": requests and -(-requests // processes),
+        "users": users, "password": password, "seed": seed,
+    }
+    started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+    if processes == 1:
+        results = [run_worker(options, 0)]
+    else:
+        # spawned (every process builds its own app and connections), and
+        # not daemonic like multiprocessing.Pool's, so the app's PDF pool
+        # can start its workers
+        with ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            results = list(pool.map(
+                run_worker, [options] * processes, range(processes)
+            ))
+
+    samples = [sample for worker_samples, _ in results for sample in worker_samples]
+    elapsed = max(worker_elapsed for _, worker_elapsed in results)
+    report = build_report(samples, elapsed, {
+        "started_at": started_at,
+        "target": url or "in-process",
+        "threads": threads,
+        "processes": processes,
+        "duration_s": None if requests else duration,
+        "warmup_s": warmup,
+        "requests_limit": requests,
+        "users": users,
+        "seed": seed,
+        "ops": op_names,
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    })
+
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+        total = report["total"]
+        click.echo(
+            f"{total['requests']} requests, {total['throughput_rps']}/s, "
+            f"p50 {total['p50_ms']} ms, p95 {total['p95_ms']} ms, "
+            f"p99 {total['p99_ms']} ms, {total['errors']} error(s) -> {output}",
+            err=True,
+        )
+    else:
+        click.echo(text)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command("compare")
+@click.argument("base", type=click.File())
+@click.argument("new", type=click.File())
+def compare_command(base, new):
+    """Per-route throughput and latency of NEW against BASE."""
+    for line in compare(json.load(base), json.load(new)):
+        click.echo(line)
+
+
+@cli.command("ops")
+def list_ops():
+    """The ops in the mix, with their weights."""
+    for name, (weight, _) in OPS.items():
+        click.echo(f"{weight:>3}  {name}")
+
+
+if __name__ == "__main__":
+    cli()
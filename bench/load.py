@@ -0,0 +1,534 @@
+from datetime import date, timedelta
+from fnmatch import fnmatch
+import http.client
+import itertools
+import json
+import random
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+# line ids remembered per session for the invoice-items routes
+MAX_KNOWN_LINES = 1000
+# rows per page a syncing client asks the ?since= feed for
+FEED_PAGE_SIZE = 500
+PDF_BATCH_SIZE = 10
+# seconds to wait for a background PDF job before downloading it
+PDF_JOB_WAIT = 60
+
+
+class AppTransport:
+    """Requests through the app's test client: no server or network."""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None, headers=None):
+        response = self.client.open(
+            path, method=method, json=body, headers=headers
+        )
+        try:
+            # read streamed bodies to the end, as a real client would
+            return response.status_code, response.get_data()
+        finally:
+            response.close()
+
+
+class HTTPTransport:
+    """Requests to a running server over one keep-alive connection."""
+
+    def __init__(self, base_url, timeout=120):
+        parts = urlsplit(base_url)
+        connection = (
+            http.client.HTTPSConnection if parts.scheme == "https"
+            else http.client.HTTPConnection
+        )
+        self.connection = connection(parts.netloc, timeout=timeout)
+        self.prefix = parts.path.rstrip("/")
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        data = None
+        if body is not None:
+            data = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        try:
+            self.connection.request(method, self.prefix + path, data, headers)
+            response = self.connection.getresponse()
+            return response.status, response.read()
+        except (OSError, http.client.HTTPException):
+            # status 0 counts as an error; reconnects on the next request
+            self.connection.close()
+            return 0, b""
+
+
+def loads(data):
+    try:
+        return json.loads(data)
+    except ValueError:
+        return None
+
+
+class Session:
+    """
+    One simulated API client, logged in as a bench user with a bearer
+    token. Ops make their setup calls with call() and their one measured
+    request with measure(); rows the session created itself are the only
+    ones it deletes, so the seeded data stays put.
+    """
+
+    def __init__(self, transport, username, password, rng):
+        self.transport = transport
+        self.username = username
+        self.password = password
+        self.rng = rng
+        self.op = None
+        self.record_from = 0.0
+        self.samples = []
+        self.login()
+
+        self.customers = self.ids("/customers")
+        self.items = self.ids("/items")
+        self.invoices = self.ids("/invoices")
+        if not (self.customers and self.items and self.invoices):
+            raise RuntimeError(f"{username} has no data; run `bench seed` first")
+        self.lines = []
+        self.created = {"customers": [], "items": [], "invoices": [], "lines": []}
+        self.line_invoice = None
+        self.jobs = []
+        self.feed_cursor = 0
+
+    def login(self):
+        status, data = self.transport.request("POST", "/auth/token", {
+            "username": self.username, "password": self.password,
+        })
+        if status != 200:
+            raise RuntimeError(f"login as {self.username} failed ({status})")
+        tokens = json.loads(data)
+        self.token = tokens["access_token"]
+        # renewed a little early so no measured request gets a 401
+        self.token_expires = time.monotonic() + tokens["expires_in"] - 30
+
+    def headers(self):
+        if time.monotonic() > self.token_expires:
+            self.login()
+        return {"Authorization": f"Bearer {self.token}"}
+
+    def call(self, method, path, body=None):
+        """A request that isn't measured: (status, parsed JSON or None)."""
+        status, data = self.transport.request(method, path, body, self.headers())
+        return status, loads(data) if 200 <= status < 300 else None
+
+    def measure(self, method, path, body=None):
+        """The op's measured request; recorded under the op's name once
+        the warmup is over. Returns (status, raw body)."""
+        headers = self.headers()
+        started = time.perf_counter()
+        status, data = self.transport.request(method, path, body, headers)
+        elapsed = time.perf_counter() - started
+        if time.monotonic() >= self.record_from:
+            self.samples.append((self.op, status, elapsed))
+        return status, data
+
+    def ids(self, path):
+        status, rows = self.call("GET", path + "?fields=id")
+        if status != 200:
+            raise RuntimeError(f"GET {path} failed ({status})")
+        return [row["id"] for row in rows]
+
+    def pick(self, ids):
+        return self.rng.choice(ids)
+
+    def page_cursor(self, ids):
+        # start a page somewhere in the list, not always at the top
+        return self.pick(ids) - 1
+
+    def remember_lines(self, invoice):
+        if invoice and invoice.get("items"):
+            self.lines.extend(line["id"] for line in invoice["items"])
+            del self.lines[:-MAX_KNOWN_LINES]
+
+    def line(self):
+        while not self.lines:
+            _, invoice = self.call("GET", f"/invoices/{self.pick(self.invoices)}")
+            self.remember_lines(invoice)
+        return self.pick(self.lines)
+
+    def own(self, kind):
+        """Take a row of `kind` this session created, creating one if needed."""
+        if not self.created[kind]:
+            CREATE[kind](self)
+        return self.created[kind].pop()
+
+    def own_invoice(self):
+        """An invoice this session created to add (and delete) lines on;
+        kept apart from the ones it deletes."""
+        if self.line_invoice is None:
+            _, invoice = self.call("POST", "/invoices", self.invoice_body())
+            self.line_invoice = invoice["id"]
+        return self.line_invoice
+
+    def invoice_body(self):
+        return {
+            "customer_id": self.pick(self.customers),
+            "due_date": "2030-01-31",
+            "status": "sent",
+            "items": [
+                {"item_id": item_id, "quantity": self.rng.randint(1, 10)}
+                for item_id in self.rng.sample(
+                    self.items, min(self.rng.randint(1, 5), len(self.items))
+                )
+            ],
+        }
+
+
+def create_customer(s):
+    _, customer = s.call("POST", "/customers", {"name": "Bench Customer"})
+    s.created["customers"].append(customer["id"])
+
+
+def create_item(s):
+    _, item = s.call("POST", "/items", {"name": "Bench Item", "unit_price": 10})
+    s.created["items"].append(item["id"])
+
+
+def create_invoice(s):
+    _, invoice = s.call("POST", "/invoices", s.invoice_body())
+    s.created["invoices"].append(invoice["id"])
+
+
+def create_line(s):
+    _, line = s.call("POST", f"/invoices/{s.own_invoice()}/items", {
+        "item_id": s.pick(s.items),
+    })
+    s.created["lines"].append(line["id"])
+
+
+CREATE = {
+    "customers": create_customer,
+    "items": create_item,
+    "invoices": create_invoice,
+    "lines": create_line,
+}
+
+
+# -------- Ops ----------------
+# name (method and route, as in routes.py) -> (weight in the mix, function)
+
+OPS = {}
+
+
+def op(name, weight):
+    def register(fn):
+        OPS[name] = (weight, fn)
+        return fn
+    return register
+
+
+@op("GET /customers", 5)
+def list_customers(s):
+    s.measure("GET", "/customers?" + urlencode({
+        "limit": 50, "cursor": s.page_cursor(s.customers),
+    }))
+
+
+@op("POST /customers", 2)
+def post_customer(s):
+    status, data = s.measure("POST", "/customers", {
+        "name": f"Bench {s.rng.randint(1, 10**6)}",
+        "email": f"bench{s.rng.randint(1, 10**6)}@example.com",
+    })
+    if status == 201:
+        s.created["customers"].append(loads(data)["id"])
+
+
+@op("GET /customers/<id>", 5)
+def get_customer(s):
+    s.measure("GET", f"/customers/{s.pick(s.customers)}")
+
+
+@op("PATCH /customers/<id>", 2)
+def patch_customer(s):
+    s.measure("PATCH", f"/customers/{s.pick(s.customers)}", {
+        "phone": f"+1-555-{s.rng.randint(0, 9999):04d}",
+    })
+
+
+@op("DELETE /customers/<id>", 1)
+def delete_customer(s):
+    s.measure("DELETE", f"/customers/{s.own('customers')}")
+
+
+@op("GET /items", 5)
+def list_items(s):
+    s.measure("GET", "/items?" + urlencode({
+        "limit": 50, "cursor": s.page_cursor(s.items),
+    }))
+
+
+@op("POST /items", 2)
+def post_item(s):
+    status, data = s.measure("POST", "/items", {
+        "name": f"Bench item {s.rng.randint(1, 10**6)}",
+        "unit_price": s.rng.randint(100, 50000) / 100,
+    })
+    if status == 201:
+        s.created["items"].append(loads(data)["id"])
+
+
+@op("GET /items/<id>", 5)
+def get_item(s):
+    s.measure("GET", f"/items/{s.pick(s.items)}")
+
+
+@op("PATCH /items/<id>", 2)
+def patch_item(s):
+    s.measure("PATCH", f"/items/{s.pick(s.items)}", {
+        "description": f"revision {s.rng.randint(1, 10**6)}",
+    })
+
+
+@op("DELETE /items/<id>", 1)
+def delete_item(s):
+    s.measure("DELETE", f"/items/{s.own('items')}")
+
+
+@op("GET /invoices", 8)
+def list_invoices(s):
+    params = s.rng.choice([
+        {},
+        {"status": s.rng.choice(["draft", "sent", "paid"])},
+        {"customer_id": s.pick(s.customers)},
+        quarter(s.rng),
+    ])
+    s.measure("GET", "/invoices?" + urlencode(dict(params, limit=50)))
+
+
+def quarter(rng):
+    """Issue date filters for 90 days within the seeded two years."""
+    end = date.today() - timedelta(days=rng.randrange(640))
+    return {
+        "issue_date_from": (end - timedelta(days=90)).isoformat(),
+        "issue_date_to": end.isoformat(),
+    }
+
+
+@op("GET /invoices (unpaged)", 1)
+def list_all_invoices(s):
+    s.measure("GET", "/invoices")
+
+
+@op("GET /invoices?since=", 2)
+def invoice_feed(s):
+    # a client syncing page by page, then polling for changes
+    status, data = s.measure("GET", "/invoices?" + urlencode({
+        "since": s.feed_cursor, "limit": FEED_PAGE_SIZE,
+    }))
+    if status == 200:
+        s.feed_cursor = loads(data)["cursor"]
+
+
+@op("POST /invoices", 4)
+def post_invoice(s):
+    status, data = s.measure("POST", "/invoices", s.invoice_body())
+    if status == 201:
+        s.created["invoices"].append(loads(data)["id"])
+
+
+@op("GET /invoices/<id>", 8)
+def get_invoice(s):
+    status, data = s.measure("GET", f"/invoices/{s.pick(s.invoices)}")
+    if status == 200 and len(s.lines) < MAX_KNOWN_LINES:
+        s.remember_lines(loads(data))
+
+
+@op("PATCH /invoices/<id>", 2)
+def patch_invoice(s):
+    s.measure("PATCH", f"/invoices/{s.pick(s.invoices)}", {
+        "status": s.rng.choice(["sent", "paid"]),
+    })
+
+
+@op("DELETE /invoices/<id>", 1)
+def delete_invoice(s):
+    s.measure("DELETE", f"/invoices/{s.own('invoices')}")
+
+
+@op("GET /invoices/<id>/items", 4)
+def list_invoice_items(s):
+    s.measure("GET", f"/invoices/{s.pick(s.invoices)}/items")
+
+
+@op("POST /invoices/<id>/items", 2)
+def post_invoice_item(s):
+    status, data = s.measure("POST", f"/invoices/{s.own_invoice()}/items", {
+        "item_id": s.pick(s.items), "quantity": s.rng.randint(1, 10),
+    })
+    if status == 201:
+        s.created["lines"].append(loads(data)["id"])
+
+
+@op("GET /invoice-items/<id>", 4)
+def get_invoice_item(s):
+    s.measure("GET", f"/invoice-items/{s.line()}")
+
+
+@op("PATCH /invoice-items/<id>", 2)
+def patch_invoice_item(s):
+    s.measure("PATCH", f"/invoice-items/{s.line()}", {
+        "quantity": s.rng.randint(1, 10),
+    })
+
+
+@op("DELETE /invoice-items/<id>", 1)
+def delete_invoice_item(s):
+    s.measure("DELETE", f"/invoice-items/{s.own('lines')}")
+
+
+@op("GET /dashboard/summary", 3)
+def dashboard(s):
+    s.measure("GET", "/dashboard/summary")
+
+
+@op("GET /invoices/<id>/pdf", 2)
+def invoice_pdf(s):
+    s.measure("GET", f"/invoices/{s.pick(s.invoices)}/pdf")
+
+
+@op("POST /invoices/<id>/pdf/jobs", 1)
+def post_pdf_job(s):
+    status, data = s.measure("POST", f"/invoices/{s.pick(s.invoices)}/pdf/jobs")
+    if status == 202:
+        s.jobs.append(loads(data)["status_url"])
+
+
+def pdf_job(s):
+    if not s.jobs:
+        _, job = s.call("POST", f"/invoices/{s.pick(s.invoices)}/pdf/jobs")
+        s.jobs.append(job["status_url"])
+    return s.jobs.pop()
+
+
+@op("GET /invoices/<id>/pdf/jobs/<job_id>", 1)
+def get_pdf_job(s):
+    s.measure("GET", pdf_job(s))
+
+
+@op("GET /invoices/<id>/pdf/jobs/<job_id>/download", 1)
+def download_pdf_job(s):
+    status_url = pdf_job(s)
+    deadline = time.monotonic() + PDF_JOB_WAIT
+    while time.monotonic() < deadline:
+        _, job = s.call("GET", status_url)
+        if not job or job["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.05)
+    s.measure("GET", status_url + "/download")
+
+
+@op("POST /invoices/pdf-batch", 1)
+def pdf_batch(s):
+    s.measure("POST", "/invoices/pdf-batch", {
+        "ids": s.rng.sample(s.invoices, min(PDF_BATCH_SIZE, len(s.invoices))),
+        "format": s.rng.choice(["zip", "pdf"]),
+    })
+
+
+def select_ops(patterns):
+    """The ops whose names match any of the glob patterns (all without)."""
+    names = [
+        name for name in OPS
+        if not patterns or any(fnmatch(name, p) for p in patterns)
+    ]
+    if not names:
+        raise ValueError(f"no op matches {', '.join(patterns)}")
+    return names
+
+
+# -------- Runner ----------------
+
+def run_load(make_transport, op_names, threads=8, duration=30, warmup=5,
+             requests=None, users=10, password="bench", seed=1, worker=0):
+    """
+    Run the op mix from `threads` sessions, each logged in as one of the
+    bench users, for `duration` seconds (or until `requests` measured
+    requests) after `warmup` seconds. Returns the (op, status, seconds)
+    samples and the measured wall time.
+    """
+    sessions = []
+    for n in range(threads):
+        index = worker * threads + n
+        sessions.append(Session(
+            make_transport(),
+            f"bench-{index % users + 1}",
+            password,
+            random.Random(f"{seed}-{index}"),
+        ))
+
+    weights = [OPS[name][0] for name in op_names]
+    budget = itertools.count() if requests else None
+    record_from = time.monotonic() + warmup
+    stop_at = record_from + duration if not requests else None
+
+    def work(s):
+        s.record_from = record_from
+        while True:
+            now = time.monotonic()
+            if stop_at is not None and now >= stop_at:
+                return
+            if budget is not None and now >= record_from \
+                    and next(budget) >= requests:
+                return
+            s.op = s.rng.choices(op_names, weights)[0]
+            recorded = len(s.samples)
+            started = time.perf_counter()
+            try:
+                OPS[s.op][1](s)
+            except Exception:
+                # setup or a response the op relies on broke: count it as
+                # a failed request unless the measured one was recorded
+                if now >= record_from and len(s.samples) == recorded:
+                    s.samples.append((s.op, 0, time.perf_counter() - started))
+
+    pool = [
+        threading.Thread(target=work, args=(s,), daemon=True)
+        for s in sessions
+    ]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.monotonic() - record_from
+
+    samples = [sample for s in sessions for sample in s.samples]
+    return samples, elapsed
+
+
+def run_worker(options, worker=0):
+    """run_load() for one process of `bench run`, with the options it was
+    given; against options["url"], or an app built in this process."""
+    if options["url"]:
+        def make_transport():
+            return HTTPTransport(options["url"])
+    else:
+        from app import create_app
+
+        app = create_app()
+
+        def make_transport():
+            return AppTransport(app)
+
+    try:
+        return run_load(
+            make_transport, options["op_names"],
+            threads=options["threads"], duration=options["duration"],
+            warmup=options["warmup"], requests=options["requests"],
+            users=options["users"], password=options["password"],
+            seed=options["seed"], worker=worker,
+        )
+    finally:
+        if not options["url"]:
+            from app.rendering import pdf_renderer
+
+            # a pool process waits for its own children before it exits
+            pdf_renderer.shutdown()
@@ -0,0 +1,88 @@
+from collections import Counter, defaultdict
+import math
+
+
+def percentile(sorted_values, q):
+    """The q-th percentile (0-100) of sorted values, interpolated."""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * q / 100
+    low, high = math.floor(rank), math.ceil(rank)
+    return sorted_values[low] + (
+        sorted_values[high] - sorted_values[low]
+    ) * (rank - low)
+
+
+def summarize(samples, elapsed):
+    """Throughput and latency (ms) of (op, status, seconds) samples."""
+    latencies = sorted(seconds * 1000 for _, _, seconds in samples)
+    errors = sum(1 for _, status, _ in samples if not ok(status))
+
+    def ms(value):
+        return None if value is None else round(value, 2)
+
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / elapsed, 2) if elapsed else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "max_ms": ms(latencies[-1]) if latencies else None,
+        "statuses": dict(sorted(
+            Counter(str(status) for _, status, _ in samples).items()
+        )),
+    }
+
+
+def ok(status):
+    # 0 is a request that failed before a response (connection error)
+    return 200 <= status < 400
+
+
+def build_report(samples, elapsed, meta):
+    by_op = defaultdict(list)
+    for sample in samples:
+        by_op[sample[0]].append(sample)
+    return dict(
+        meta,
+        elapsed_s=round(elapsed, 2),
+        total=summarize(samples, elapsed),
+        routes={
+            op: summarize(op_samples, elapsed)
+            for op, op_samples in sorted(by_op.items())
+        },
+    )
+
+
+def compare(base, new):
+    """Lines comparing two reports' throughput and p50/p95/p99, per route."""
+    def change(old, now):
+        if old is None or now is None:
+            return "n/a"
+        if old == 0:
+            return f"{now:.2f}"
+        return f"{now:.2f} ({(now - old) / old * 100:+.1f}%)"
+
+    rows = [("route", "rps", "p50 ms", "p95 ms", "p99 ms", "errors")]
+    routes = [("total", base["total"], new["total"])] + [
+        (op, base["routes"].get(op), new["routes"][op])
+        for op in new["routes"]
+    ]
+    for op, old, now in routes:
+        old = old or {}
+        rows.append((
+            op,
+            *(
+                change(old.get(key), now[key])
+                for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+            ),
+            f"{old.get('errors', 'n/a')} -> {now['errors']}",
+        ))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in rows
+    ]
@@ -0,0 +1,166 @@
+from datetime import date, timedelta
+from decimal import Decimal
+import random
+import time
+
+from peewee import fn
+
+from app.commands import tenant_databases
+from app.imports import insert_rows
+from app.models import (
+    db, User, Customer, Invoice, Item, InvoiceItem, stamp
+)
+from app.passwords import password_hasher
+from app.reports import rebuild_rollups
+
+# rows per INSERT transaction
+SEED_CHUNK_SIZE = 1000
+
+STATUSES = ("draft", "sent", "paid")
+STATUS_WEIGHTS = (1, 5, 4)
+
+WORDS = (
+    "acme", "global", "north", "blue", "river", "summit", "delta", "pixel",
+    "harbor", "cedar", "orbit", "atlas", "lumen", "granite", "maple", "nova",
+)
+
+
+def seed_dataset(users=10, customers=5000, items=2000, invoices=100000,
+                 max_lines=5, days=730, password="bench", seed=1):
+    """
+    Insert a synthetic dataset: `users` users named bench-1.., sharing
+    `customers`, `items` and `invoices` between them, each invoice with
+    1..max_lines lines and an issue date within the last `days` days.
+    The same arguments (and day) give the same data. Returns the row counts.
+    """
+    names = [f"bench-{n}" for n in range(1, users + 1)]
+    if User.select().where(User.username.in_(names)).exists():
+        raise ValueError("bench users already exist; seed a fresh database")
+
+    rng = random.Random(seed)
+    password_hash = password_hasher.hash(password)
+    counts = dict.fromkeys(("users", "customers", "items", "invoices", "lines"), 0)
+    started = time.perf_counter()
+
+    for n, username in enumerate(names):
+        user = User.create(username=username, password_hash=password_hash)
+        counts["users"] += 1
+        share = {
+            "customers": split(customers, users, n),
+            "items": split(items, users, n),
+            "invoices": split(invoices, users, n),
+        }
+        for _ in tenant_databases(user.id):
+            seed_user(user.id, share, max_lines, days, rng, counts)
+            rebuild_rollups(user.id)
+
+    for _ in tenant_databases():
+        # fresh planner statistics, as after migrate-indexes
+        db.execute_sql("ANALYZE")
+    counts["seconds"] = round(time.perf_counter() - started, 2)
+    return counts
+
+
+def split(total, parts, n):
+    """The n-th of `parts` near-equal shares of total."""
+    return total // parts + (1 if n < total % parts else 0)
+
+
+def seed_user(user_id, share, max_lines, days, rng, counts):
+    insert_chunked(user_id, Customer, [
+        {
+            "user": user_id,
+            "name": company(rng),
+            "email": f"billing{n}.{user_id}@example.com",
+            "address": f"{rng.randint(1, 999)} {rng.choice(WORDS).title()} St",
+            "phone": f"+1-555-{rng.randint(0, 9999):04d}",
+        }
+        for n in range(share["customers"])
+    ])
+    insert_chunked(user_id, Item, [
+        {
+            "user": user_id,
+            "name": f"{rng.choice(WORDS).title()} {rng.choice(WORDS)} {n}",
+            "description": " ".join(rng.choices(WORDS, k=6)),
+            "unit_price": Decimal(rng.randint(100, 50000)) / 100,
+        }
+        for n in range(share["items"])
+    ])
+    counts["customers"] += share["customers"]
+    counts["items"] += share["items"]
+
+    customer_ids = owned_ids(Customer, user_id)
+    prices = dict(
+        Item.select(Item.id, Item.unit_price).where(Item.user == user_id).tuples()
+    )
+    item_ids = sorted(prices)
+    if not customer_ids or not item_ids:
+        return
+
+    today = date.today()
+    remaining = share["invoices"]
+    while remaining:
+        size = min(SEED_CHUNK_SIZE, remaining)
+        remaining -= size
+        invoices, lines = [], []
+        for _ in range(size):
+            issued = today - timedelta(days=rng.randrange(days))
+            picked = [
+                (item_id, rng.randint(1, 10), prices[item_id])
+                for item_id in rng.sample(item_ids, min(
+                    rng.randint(1, max_lines), len(item_ids)
+                ))
+            ]
+            invoices.append({
+                "user": user_id,
+                "customer": rng.choice(customer_ids),
+                "issue_date": issued,
+                "due_date": issued + timedelta(days=30),
+                "status": rng.choices(STATUSES, STATUS_WEIGHTS)[0],
+                "total": sum(qty * price for _, qty, price in picked),
+            })
+            lines.append(picked)
+
+        with db.atomic():
+            version = stamp(user_id)
+            last_id = Invoice.select(fn.MAX(Invoice.id)).scalar() or 0
+            insert_rows(Invoice, [dict(row, **version) for row in invoices])
+            # ids come out in insert order, so they pair up with `lines`
+            new_ids = [
+                inv_id for (inv_id,) in
+                Invoice.select(Invoice.id)
+                .where((Invoice.user == user_id) & (Invoice.id > last_id))
+                .order_by(Invoice.id)
+                .tuples()
+            ]
+            insert_rows(InvoiceItem, [
+                dict(version, invoice=inv_id, item=item_id,
+                     quantity=qty, unit_price=price)
+                for inv_id, picked in zip(new_ids, lines)
+                for item_id, qty, price in picked
+            ])
+        counts["invoices"] += size
+        counts["lines"] += sum(len(picked) for picked in lines)
+
+
+def insert_chunked(user_id, model, rows):
+    for start in range(0, len(rows), SEED_CHUNK_SIZE):
+        with db.atomic():
+            version = stamp(user_id)
+            insert_rows(model, [
+                dict(row, **version)
+                for row in rows[start:start + SEED_CHUNK_SIZE]
+            ])
+
+
+def owned_ids(model, user_id):
+    return [
+        row_id for (row_id,) in
+        model.select(model.id).where(model.user == user_id)
+        .order_by(model.id).tuples()
+    ]
+
+
+def company(rng):
+    suffix = rng.choice(("Ltd", "Inc", "GmbH", "LLC", "& Co"))
+    return f"{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {suffix}"
@@ -0,0 +1,44 @@
+import itertools
+import os
+import tempfile
+
+import pytest
+
+# app.models opens the database at import time, so configure it first
+_tmp = tempfile.mkdtemp(prefix="invoice-api-tests-")
+os.environ["DATABASE_PATH"] = os.path.join(_tmp, "test.db")
+os.environ.pop("DATABASE_URL", None)
+os.environ.pop("DB_SHARDS", None)
+os.environ["PDF_CACHE_DIR"] = os.path.join(_tmp, "pdf-cache")
+os.environ["PDF_WORKERS"] = "0"
+# cheap hashes; the tests log in a lot
+os.environ["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+os.environ["LOGIN_MAX_ATTEMPTS_IP"] = "100000"
+
+from app import create_app  # noqa: E402
+
+_app = create_app()
+_app.config["TESTING"] = True
+_usernames = (f"user{n}" for n in itertools.count(1))
+
+
+@pytest.fixture
+def app():
+    return _app
+
+
+@pytest.fixture
+def make_client(app):
+    """A test client logged in (by session cookie) as a new user."""
+    def make():
+        client = app.test_client()
+        credentials = {"username": next(_usernames), "password": "secret"}
+        assert client.post("/auth/register", json=credentials).status_code == 201
+        assert client.post("/auth/login", json=credentials).status_code == 200
+        return client
+    return make
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
@@ -0,0 +1,92 @@
+import os
+import sqlite3
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.auth import UserCache
+from app.cache import SQLiteCache
+from app.models import User
+from app.passwords import password_hasher
+
+
+def test_shared_user_cache_leaves_the_password_hash_out(tmp_path):
+    user = User.create(username="cached", password_hash="pbkdf2:secret-hash")
+    cache = UserCache()
+    path = os.path.join(tmp_path, "users.db")
+    cache.backend = SQLiteCache(path)
+
+    assert cache.get(user.id).username == "cached"  # miss, then stored
+    cached = cache.get(user.id)  # hit
+    assert (cached.id, cached.username) == (user.id, "cached")
+    assert not cached.password_hash
+
+    stored = sqlite3.connect(path).execute("SELECT value FROM cache").fetchall()
+    assert stored and not any("secret-hash" in value for (value,) in stored)
+
+
+def test_password_change_invalidates_earlier_tokens(app):
+    client = app.test_client()
+    credentials = {"username": "rotating", "password": "old-secret"}
+    assert client.post("/auth/register", json=credentials).status_code == 201
+    tokens = client.post("/auth/token", json=credentials).json
+
+    def bearer(token):
+        return {"Authorization": f"Bearer {token}"}
+
+    old = bearer(tokens["access_token"])
+    assert client.get("/customers?limit=1", headers=old).status_code == 200
+
+    r = client.post("/auth/password", headers=old, json={
+        "password": "old-secret", "new_password": "new-secret",
+    })
+    assert r.status_code == 200
+
+    # like any unauthenticated request: redirected to the login view
+    assert client.get("/customers?limit=1", headers=old).status_code == 302
+    r = client.post("/auth/token/refresh", json={
+        "refresh_token": tokens["refresh_token"],
+    })
+    assert r.status_code == 401
+
+    credentials["password"] = "new-secret"
+    new = client.post("/auth/token", json=credentials).json
+    r = client.get("/customers?limit=1", headers=bearer(new["access_token"]))
+    assert r.status_code == 200
+
+
+def test_repeated_failed_logins_are_throttled(app):
+    client = app.test_client()
+    credentials = {"username": "guessed", "password": "secret"}
+    client.post("/auth/register", json=credentials)
+
+    wrong = dict(credentials, password="wrong")
+    limit = app.config["LOGIN_MAX_ATTEMPTS_USER"]
+    for _ in range(limit):
+        assert client.post("/auth/login", json=wrong).status_code == 401
+
+    # refused before the password is checked, right or wrong
+    r = client.post("/auth/login", json=credentials)
+    assert r.status_code == 429
+    assert r.headers["Retry-After"] == str(app.config["LOGIN_THROTTLE_WINDOW"])
+
+    other = {"username": "not-guessed", "password": "secret"}
+    client.post("/auth/register", json=other)
+    assert client.post("/auth/login", json=other).status_code == 200
+
+
+def test_login_upgrades_an_outdated_password_hash(app):
+    old_hash = generate_password_hash("secret", "pbkdf2:sha256:500")
+    user = User.create(username="outdated", password_hash=old_hash)
+
+    client = app.test_client()
+    r = client.post("/auth/login", json={
+        "username": "outdated", "password": "secret",
+    })
+    assert r.status_code == 200
+
+    user = User.get_by_id(user.id)
+    assert user.password_hash != old_hash
+    assert user.password_hash.startswith(password_hasher.method + "$")
+    assert check_password_hash(user.password_hash, "secret")
+    # a rehash isn't a password change: issued tokens stay valid
+    assert user.token_generation == 0
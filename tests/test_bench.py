@@ -0,0 +1,24 @@
+from bench.load import OPS, AppTransport, run_load
+from bench.report import build_report
+from bench.seed import seed_dataset
+
+
+def test_bench_seeds_and_reports_a_short_run(app):
+    with app.app_context():
+        counts = seed_dataset(
+            users=2, customers=6, items=4, invoices=10, max_lines=2,
+        )
+    assert {k: counts[k] for k in ("users", "customers", "items", "invoices")} \
+        == {"users": 2, "customers": 6, "items": 4, "invoices": 10}
+    assert 10 <= counts["lines"] <= 20
+
+    # WeasyPrint can't run here, so the PDF ops are left out
+    ops = [name for name in OPS if "pdf" not in name]
+    samples, elapsed = run_load(
+        lambda: AppTransport(app), ops, threads=2, warmup=0, requests=40,
+        users=2,
+    )
+    report = build_report(samples, elapsed, {"ops": ops})
+    assert report["total"]["requests"] >= 40
+    assert report["total"]["errors"] == 0, report["total"]["statuses"]
+    assert set(report["routes"]) <= set(ops)
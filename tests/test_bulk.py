@@ -0,0 +1,71 @@
+def test_bulk_customers_keep_fields_missing_from_the_first_row(client):
+    r = client.post("/customers/bulk", json=[
+        {"name": "A"},
+        {"name": "B", "email": "b@example.com", "phone": "555"},
+    ])
+    assert r.status_code == 200
+    ids = [row["id"] for row in r.json["results"]]
+
+    a, b = (client.get(f"/customers/{i}").json for i in ids)
+    assert a["email"] is None
+    assert b["email"] == "b@example.com"
+    assert b["phone"] == "555"
+
+
+def test_bulk_items_keep_fields_missing_from_the_first_row(client):
+    r = client.post("/items/bulk", json=[
+        {"name": "Plain", "unit_price": 1},
+        {"name": "Described", "unit_price": 2, "description": "details"},
+    ])
+    ids = [row["id"] for row in r.json["results"]]
+    assert client.get(f"/items/{ids[1]}").json["description"] == "details"
+
+
+def test_bulk_invoices_keep_fields_missing_from_the_first_row(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    r = client.post("/invoices/bulk", json=[
+        {"customer_id": customer},
+        {"customer_id": customer, "due_date": "2030-01-31", "status": "sent"},
+    ])
+    assert r.status_code == 200
+    ids = [row["id"] for row in r.json["results"]]
+
+    first, second = (client.get(f"/invoices/{i}").json for i in ids)
+    assert first["due_date"] is None
+    assert first["status"] == "draft"
+    assert second["due_date"] == "2030-01-31"
+    assert second["status"] == "sent"
+
+
+def test_bulk_item_updates_evict_the_catalog_cache(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 3}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+    client.post(f"/invoices/{inv}/items", json={"item_id": item})  # cached
+
+    r = client.post("/items/bulk", json=[{"id": item, "unit_price": 4}])
+    assert r.json["updated"] == 1
+    line = client.post(f"/invoices/{inv}/items", json={"item_id": item}).json
+    assert line["unit_price"] == 4
+
+
+def test_bulk_rows_take_string_ids(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    r = client.post("/customers/bulk", json=[{"id": str(customer), "name": "D"}])
+    assert r.json["results"][0]["status"] == "updated"
+    assert client.get(f"/customers/{customer}").json["name"] == "D"
+
+    r = client.post("/invoices/bulk", json=[
+        {"id": str(inv), "status": "sent"},
+        {"customer_id": str(customer)},
+    ])
+    assert [row["status"] for row in r.json["results"]] == ["updated", "created"]
+    assert client.get(f"/invoices/{inv}").json["status"] == "sent"
+
+    r = client.post("/invoices/bulk", json=[{"id": "²"}, {"customer_id": 1.5}])
+    assert r.status_code == 400
+    assert [row["error"] for row in r.json["results"]] == [
+        "not found", "customer not found",
+    ]
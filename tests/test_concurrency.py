@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from app.models import InvoiceItem
+from app.reports import rebuild_rollups
+
+THREADS = 8
+WRITES = 10
+
+
+def login(app, credentials):
+    client = app.test_client()
+    assert client.post("/auth/login", json=credentials).status_code == 200
+    return client
+
+
+def test_concurrent_writes_lose_nothing(app):
+    credentials = {"username": "concurrent", "password": "secret"}
+    owner = app.test_client()
+    assert owner.post("/auth/register", json=credentials).status_code == 201
+    owner = login(app, credentials)
+
+    customer = owner.post("/customers", json={"name": "C"}).json["id"]
+    item = owner.post("/items", json={"name": "I", "unit_price": 1}).json["id"]
+    invoice = owner.post("/invoices", json={
+        "customer_id": customer, "status": "sent",
+    }).json["id"]
+
+    def writer(n):
+        # each thread its own client, so the requests run in parallel
+        # against the connection pool
+        client = login(app, credentials)
+        statuses = []
+        for i in range(WRITES):
+            r = client.post(f"/invoices/{invoice}/items", json={
+                "item_id": item, "quantity": 1, "unit_price": f"{n}.{i:02d}",
+            })
+            statuses.append((r.status_code, r.get_data(as_text=True)))
+            r = client.patch(f"/invoices/{invoice}", json={
+                "due_date": f"2030-01-{n + 1:02d}",
+            })
+            statuses.append((r.status_code, r.get_data(as_text=True)))
+        return statuses
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        results = [
+            result for statuses in pool.map(writer, range(THREADS))
+            for result in statuses
+        ]
+
+    failures = [(status, body) for status, body in results if status >= 300]
+    assert not failures
+    assert not any("database is locked" in body for _, body in results)
+
+    lines = owner.get(f"/invoices/{invoice}/items").json
+    assert len(lines) == THREADS * WRITES
+    # no line's amount was lost from the stored total, including to the
+    # due date updates saving the invoice in between
+    total = Decimal(str(owner.get(f"/invoices/{invoice}").json["total"]))
+    assert total == sum(Decimal(str(li["unit_price"])) for li in lines)
+
+    versions = [
+        v for (v,) in
+        InvoiceItem.select(InvoiceItem.version)
+        .where(InvoiceItem.invoice == invoice).tuples()
+    ]
+    assert len(set(versions)) == len(versions)
+
+    # the rollups kept up with every write
+    report = owner.get("/reports/revenue?group_by=customer,status").json
+    assert report == [{
+        "customer_id": customer, "status": "sent", "invoices": 1,
+        "total": float(total),
+    }]
+    rebuild_rollups()
+    assert owner.get("/reports/revenue?group_by=customer,status").json == report
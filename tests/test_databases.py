@@ -0,0 +1,42 @@
+from app.models import Customer, Shards, create_tables, db, make_database
+
+
+def test_read_handlers_go_to_the_replica_and_writes_to_the_primary(
+    client, monkeypatch, tmp_path,
+):
+    replica = make_database(str(tmp_path / "replica.db"), pool=False)
+    with db.using(replica):
+        create_tables()
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+
+    monkeypatch.setattr(db, "replica", replica)
+    # the replica hasn't caught up with the write above
+    assert client.get(f"/customers/{customer}").status_code == 404
+    r = client.patch(f"/customers/{customer}", json={"name": "D"})
+    assert r.status_code == 200
+
+    monkeypatch.setattr(db, "replica", None)
+    assert client.get(f"/customers/{customer}").json["name"] == "D"
+    replica.close()
+
+
+def test_tenant_rows_are_routed_to_their_users_shard(app, monkeypatch, tmp_path):
+    shards = Shards(str(tmp_path), count=4)
+    monkeypatch.setattr(db, "shards", shards)
+
+    clients = {}
+    for name in ("shard-a", "shard-b"):
+        client = app.test_client()
+        credentials = {"username": name, "password": "secret"}
+        user_id = client.post("/auth/register", json=credentials).json["id"]
+        client.post("/auth/login", json=credentials)
+        clients[user_id] = client
+        client.post("/customers", json={"name": name})
+
+    a, b = clients
+    assert shards.key_for(a) != shards.key_for(b)
+    for user_id, client in clients.items():
+        with db.using(shards.for_user(user_id)):
+            assert [c.user_id for c in Customer.select()] == [user_id]
+        assert len(client.get("/customers?limit=10").json) == 1
+    assert not Customer.select().where(Customer.user.in_([a, b])).exists()
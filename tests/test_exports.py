@@ -0,0 +1,79 @@
+import csv
+from decimal import Decimal
+import io
+import json
+
+from app.exports import export_rows
+from app.serialization import json_default
+
+
+def test_decimals_are_always_json_numbers(app):
+    assert json_default(Decimal("12.50")) == 12.5
+    # wider than a double holds exactly: still a number, not a string
+    wide = app.json.dumps({"total": Decimal("12345678901234567.89")})
+    assert isinstance(json.loads(wide)["total"], float)
+
+
+def test_exports_encode_values_like_the_api(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 1}).json["id"]
+    inv = client.post("/invoices", json={
+        "customer_id": customer, "issue_date": "2025-03-01",
+        "items": [{"item_id": item, "quantity": 3, "unit_price": "2.50"}],
+    }).json
+
+    (exported,) = [
+        json.loads(line) for line in
+        client.get("/export/invoices.ndjson").get_data(as_text=True).splitlines()
+    ]
+    assert exported["total"] == inv["total"] == 7.5
+    assert exported["issue_date"] == inv["issue_date"] == "2025-03-01"
+    assert exported["items"][0]["unit_price"] == 2.5
+
+    rows = client.get("/export/invoices.csv").get_data(as_text=True).splitlines()
+    assert rows[1].split(",")[6:8] == ["draft", "7.5"]
+
+
+def test_exports_list_every_line_across_batches(client, monkeypatch):
+    # one invoice per keyset batch
+    monkeypatch.setattr(export_rows, "__defaults__", (1,))
+    customer = client.post("/customers", json={
+        "name": "C", "email": "c@example.com",
+    }).json["id"]
+    a = client.post("/items", json={"name": "A", "unit_price": 2}).json["id"]
+    b = client.post("/items", json={"name": "B", "unit_price": 3}).json["id"]
+    sent = client.post("/invoices", json={
+        "customer_id": customer, "status": "sent",
+        "items": [{"item_id": a, "quantity": 2}, {"item_id": b}],
+    }).json["id"]
+    empty = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    r = client.get("/export/invoices.csv")
+    assert r.mimetype == "text/csv"
+    assert 'filename="invoices.csv"' in r.headers["Content-Disposition"]
+    rows = list(csv.DictReader(io.StringIO(r.get_data(as_text=True))))
+    assert [
+        (row["invoice_id"], row["item_name"], row["quantity"], row["line_total"])
+        for row in rows
+    ] == [
+        (str(sent), "A", "2", "4.0"),
+        (str(sent), "B", "1", "3.0"),
+        (str(empty), "", "", ""),
+    ]
+    assert {row["customer_email"] for row in rows} == {"c@example.com"}
+
+    r = client.get("/export/invoices.ndjson")
+    invoices = [json.loads(line) for line in r.get_data(as_text=True).splitlines()]
+    assert [(inv["id"], inv["total"]) for inv in invoices] == [
+        (sent, 7), (empty, 0),
+    ]
+    assert [
+        (line["item_id"], line["quantity"], line["total"])
+        for line in invoices[0]["items"]
+    ] == [(a, 2, 4), (b, 1, 3)]
+    assert invoices[1]["items"] == []
+
+    # the GET /invoices filters apply
+    r = client.get("/export/invoices.ndjson?status=sent")
+    assert len(r.get_data(as_text=True).splitlines()) == 1
+    assert client.get("/export/invoices.csv?customer_id=x").status_code == 400
@@ -0,0 +1,31 @@
+def import_csv(client, path, body):
+    r = client.post(path, data=body, content_type="text/csv")
+    assert r.status_code == 200
+    return r.json
+
+
+def test_customer_import_keys_file_and_stored_rows_alike(client):
+    client.post("/customers", json={"name": "Acme", "email": "a@acme.test"})
+    client.post("/customers", json={"name": "Plain"})
+
+    report = import_csv(client, "/import/customers", "\n".join([
+        "name,email",
+        "Acme,",  # no email: keyed by name, unlike the stored Acme
+        "Other,A@ACME.TEST",  # the stored Acme's email
+        "PLAIN,",
+        "New,n@example.com",
+        "new again,N@example.com",
+    ]))
+    assert report["created"] == 2
+    assert report["duplicates"] == 3
+
+    names = sorted(c["name"] for c in client.get("/customers?limit=10").json)
+    assert names == ["Acme", "Acme", "New", "Plain"]
+
+
+def test_import_dedupes_across_chunks(client, monkeypatch):
+    monkeypatch.setattr("app.imports.IMPORT_CHUNK_SIZE", 2)
+    report = import_csv(client, "/import/items", "\n".join([
+        "name,unit_price", "A,1", "B,2", "c,3", "a,4", "C,5", "D,6",
+    ]))
+    assert (report["created"], report["duplicates"]) == (4, 2)
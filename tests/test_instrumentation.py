@@ -0,0 +1,34 @@
+from flask import Flask
+
+from app.instrumentation import Instrumentation, instrumentation
+from app.models import query_hooks
+
+
+def test_instrumentation_is_off_by_default(client):
+    assert not instrumentation.enabled
+    assert instrumentation._query_done not in query_hooks
+    r = client.get("/customers?limit=1")
+    assert r.status_code == 200
+    assert "Server-Timing" not in r.headers
+    assert client.get("/metrics").status_code == 404
+
+
+def test_metrics_count_requests_when_enabled(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config["INSTRUMENTATION"] = True
+    app.add_url_rule("/ping/<int:n>", "ping", lambda n: "pong")
+    instruments = Instrumentation()
+    instruments.init_app(app)
+    try:
+        client = app.test_client()
+        r = client.get("/ping/1")
+        assert r.headers["Server-Timing"].startswith('db;dur=')
+        client.get("/ping/2")
+
+        metrics = client.get("/metrics").get_data(as_text=True)
+        assert (
+            'http_requests_total{method="GET",route="/ping/<int:n>",'
+            'status="200"} 2'
+        ) in metrics
+    finally:
+        query_hooks.remove(instruments._query_done)
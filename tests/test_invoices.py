@@ -0,0 +1,92 @@
+from app.models import Item
+
+
+def test_string_item_ids_resolve_to_catalog_items(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 7}).json["id"]
+
+    r = client.post("/invoices", json={
+        "customer_id": customer,
+        "items": [{"item_id": str(item), "quantity": 2}],
+    })
+    assert r.status_code == 201
+    assert r.json["total"] == 14
+
+    r = client.put(f"/invoices/{r.json['id']}", json={
+        "items": [{"item_id": str(item), "quantity": 3}],
+    })
+    assert r.status_code == 200
+    assert r.json["total"] == 21
+
+    r = client.post("/invoices/bulk", json=[
+        {"customer_id": customer, "items": [{"item_id": str(item)}]},
+    ])
+    assert r.json["results"][0]["status"] == "created"
+
+
+def test_non_numeric_item_ids_are_rejected(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    r = client.post("/invoices", json={
+        "customer_id": customer, "items": [{"item_id": "abc"}],
+    })
+    assert r.status_code == 400
+    assert "item_id" in r.json["error"]
+
+
+def test_add_invoice_item_with_a_string_item_id(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 4}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    for item_id in (str(item), str(item)):  # a cache miss, then a hit
+        r = client.post(f"/invoices/{inv}/items", json={"item_id": item_id})
+        assert r.status_code == 201
+    assert client.get(f"/invoices/{inv}").json["total"] == 8
+
+    r = client.post(f"/invoices/{inv}/items", json={"item_id": "abc"})
+    assert r.status_code == 400
+
+
+def test_deleting_an_item_takes_its_lines_out_of_invoice_totals(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    kept = client.post("/items", json={"name": "K", "unit_price": 10}).json["id"]
+    gone = client.post("/items", json={"name": "G", "unit_price": 2.5}).json["id"]
+    inv = client.post("/invoices", json={
+        "customer_id": customer,
+        "items": [
+            {"item_id": kept, "quantity": 2},
+            {"item_id": gone, "quantity": 1},
+            {"item_id": gone, "quantity": 1},
+        ],
+    }).json["id"]
+    assert client.get(f"/invoices/{inv}").json["total"] == 25
+
+    assert client.delete(f"/items/{gone}").status_code == 200
+    invoice = client.get(f"/invoices/{inv}").json
+    assert invoice["total"] == 20
+    assert [line["item_id"] for line in invoice["items"]] == [kept]
+
+
+def test_lines_for_an_item_deleted_by_another_worker_are_rejected(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 40}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+    # the line's write caches the item; removing the line doesn't evict it
+    line = client.post(f"/invoices/{inv}/items", json={"item_id": item}).json
+    client.delete(f"/invoice-items/{line['id']}")
+
+    # deleted behind this process's catalog cache
+    Item.delete().where(Item.id == item).execute()
+
+    r = client.post(f"/invoices/{inv}/items", json={"item_id": item})
+    assert r.status_code == 400
+    r = client.post("/invoices", json={
+        "customer_id": customer, "items": [{"item_id": item}],
+    })
+    assert r.status_code == 400
+    r = client.post("/invoices/bulk", json=[
+        {"customer_id": customer, "items": [{"item_id": item}]},
+    ])
+    assert r.json["results"][0]["status"] == "error"
+    invoice = client.get(f"/invoices/{inv}").json
+    assert (invoice["total"], invoice["items"]) == (0, [])
@@ -0,0 +1,77 @@
+def walk(client, url):
+    """Every row of a paged list, following the Link headers."""
+    rows, pages = [], 0
+    while url:
+        r = client.get(url)
+        assert r.status_code == 200
+        rows += r.json
+        pages += 1
+        url = None
+        if "Link" in r.headers:
+            assert r.headers["X-Next-Cursor"] == str(r.json[-1]["id"])
+            url = r.headers["Link"].split(">")[0].lstrip("<")
+    return rows, pages
+
+
+def test_keyset_pages_cover_the_list_once(client):
+    ids = [
+        client.post("/customers", json={"name": f"C{n}"}).json["id"]
+        for n in range(5)
+    ]
+    rows, pages = walk(client, "/customers?limit=2&fields=id,name")
+    assert [row["id"] for row in rows] == ids
+    assert pages == 3
+    # the other arguments are carried over to the next page
+    assert all(set(row) == {"id", "name"} for row in rows)
+
+    last = client.get(f"/customers?limit=2&cursor={ids[-1]}")
+    assert last.json == []
+    assert "X-Next-Cursor" not in last.headers
+
+
+def test_fields_project_the_rows(client):
+    client.post("/customers", json={"name": "C", "email": "c@example.com"})
+    assert client.get("/customers?limit=5&fields=email").json == [
+        {"email": "c@example.com"}
+    ]
+    rows = client.get("/customers?limit=5&fields=id, name").json
+    assert list(rows[0]) == ["id", "name"]
+
+
+def test_invoice_filters(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    other = client.post("/customers", json={"name": "D"}).json["id"]
+    for customer_id, status, issued in [
+        (customer, "sent", "2025-01-10"),
+        (customer, "paid", "2025-02-10"),
+        (other, "sent", "2025-03-10"),
+    ]:
+        client.post("/invoices", json={
+            "customer_id": customer_id, "status": status, "issue_date": issued,
+        })
+
+    def issued(query):
+        r = client.get(f"/invoices?limit=10&fields=issue_date&{query}")
+        assert r.status_code == 200
+        return [row["issue_date"] for row in r.json]
+
+    assert issued("status=sent") == ["2025-01-10", "2025-03-10"]
+    assert issued("status=sent,paid&customer_id=" + str(customer)) == [
+        "2025-01-10", "2025-02-10",
+    ]
+    assert issued("issue_date_from=2025-02-01&issue_date_to=2025-02-28") == [
+        "2025-02-10",
+    ]
+
+
+def test_bad_list_arguments_are_a_400(client):
+    for url, error in [
+        ("/customers?cursor=abc", "invalid cursor"),
+        ("/customers?limit=0", "limit must be positive"),
+        ("/customers?limit=ten", "limit must be an integer"),
+        ("/items?fields=id,secret", "unknown fields: secret"),
+        ("/invoices?customer_id=x", "customer_id must be an integer"),
+        ("/invoices?due_date_to=31.01.2025", "due_date_to must be YYYY-MM-DD"),
+    ]:
+        r = client.get(url)
+        assert (r.status_code, r.json["error"]) == (400, error), url
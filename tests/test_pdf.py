@@ -0,0 +1,138 @@
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from app.pdf_cache import PDFCache, pdf_cache
+from app.rendering import pdf_renderer
+
+
+def fake_renders(monkeypatch):
+    """Replace rendering (WeasyPrint needs system libraries) and record
+    the HTML of every render."""
+    rendered = []
+
+    def render(html, timeout=None):
+        rendered.append(html)
+        return b"%PDF-" + str(len(rendered)).encode()
+
+    monkeypatch.setattr(pdf_renderer, "render", render)
+    return rendered
+
+
+def test_pdf_cache_key_changes_with_the_stylesheet(tmp_path):
+    stylesheet = tmp_path / "invoice.css"
+    stylesheet.write_text("body { color: black }")
+    before = PDFCache(stylesheet=str(stylesheet)).key_for("<p>invoice</p>")
+
+    stylesheet.write_text("body { color: red }")
+    after = PDFCache(stylesheet=str(stylesheet)).key_for("<p>invoice</p>")
+    assert after != before
+
+
+def test_merged_batch_timeout_is_a_503_with_a_hint(client, monkeypatch):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    def timed_out(html, timeout=None):
+        raise FutureTimeoutError()
+
+    monkeypatch.setattr(pdf_renderer, "render", timed_out)
+    r = client.post("/invoices/pdf-batch", json={"ids": [inv], "format": "pdf"})
+    assert r.status_code == 503
+    assert r.json["error"] == "pdf rendering timed out"
+    assert "zip" in r.json["hint"]
+
+
+def test_pdf_cache_drops_an_invoices_entries_and_evicts_lru(tmp_path):
+    cache = PDFCache(directory=str(tmp_path), max_bytes=25)
+    cache.put(1, "a", b"x" * 10)
+    cache.put(1, "b", b"x" * 10)  # replaces invoice 1's older entry
+    cache.put(2, "c", b"x" * 10)
+    assert cache.get(1, "a") is None
+    assert cache.get(1, "b") == cache.get(2, "c") == b"x" * 10
+
+    cache.invalidate(2)
+    assert cache.get(2, "c") is None
+    assert cache.get(1, "b") is not None
+
+    cache.put(3, "d", b"x" * 10)
+    cache.put(4, "e", b"x" * 10)
+    cache.put(5, "f", b"x" * 10)  # 40 bytes stored: the oldest go
+    assert cache.get(1, "b") is None
+    assert cache.get(5, "f") is not None
+
+
+def test_pdf_batch_rejects_bad_and_oversized_id_lists(client, monkeypatch):
+    monkeypatch.setattr("app.routes.PDF_BATCH_MAX", 2)
+    for ids in (["1", "x"], [1, None], [{"id": 1}], [1.5]):
+        r = client.post("/invoices/pdf-batch", json={"ids": ids})
+        assert (r.status_code, r.json["error"]) == (400, "ids must be integers")
+
+    r = client.post("/invoices/pdf-batch", json={"ids": [1, 2, 3]})
+    assert (r.status_code, r.json["error"]) == (
+        400, "at most 2 invoices per batch",
+    )
+
+
+def test_pdf_etag_round_trip_and_invalidation_on_edit(client, monkeypatch):
+    rendered = fake_renders(monkeypatch)
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    first = client.get(f"/invoices/{inv}/pdf")
+    assert first.status_code == 200
+    assert first.mimetype == "application/pdf"
+    etag = first.headers["ETag"]
+
+    r = client.get(f"/invoices/{inv}/pdf", headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.headers["ETag"] == etag
+    # served from the disk cache, not rendered again
+    assert client.get(f"/invoices/{inv}/pdf").data == first.data
+    assert len(rendered) == 1
+
+    client.patch(f"/invoices/{inv}", json={"due_date": "2030-01-31"})
+    assert pdf_cache.get(inv, etag.strip('"')) is None
+    r = client.get(f"/invoices/{inv}/pdf", headers={"If-None-Match": etag})
+    assert r.status_code == 200
+    assert r.headers["ETag"] != etag
+    assert len(rendered) == 2
+
+
+def test_pdf_job_renders_in_the_background(make_client, monkeypatch):
+    client, other = make_client(), make_client()
+    monkeypatch.setattr("app.rendering.render_pdf", lambda html: b"%PDF-job")
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    r = client.post(f"/invoices/{inv}/pdf/jobs")
+    assert r.status_code == 202
+    assert r.headers["Location"] == r.json["status_url"]
+
+    job = client.get(r.json["status_url"]).json
+    assert job["status"] == "done"
+    download = client.get(job["download_url"])
+    assert download.data == b"%PDF-job"
+    assert download.headers["ETag"]
+
+    # jobs are private to the user who started them
+    assert other.get(r.json["status_url"]).status_code == 404
+
+
+def test_a_full_render_queue_is_a_503_with_retry_after(client, monkeypatch):
+    class StuckPool:
+        def submit(self, fn, *args):
+            return Future()  # never finishes, so its slot stays taken
+
+    monkeypatch.setattr(pdf_renderer, "workers", 1)
+    monkeypatch.setattr(pdf_renderer, "max_queue", 1)
+    monkeypatch.setattr(pdf_renderer, "_get_executor", lambda: StuckPool())
+    monkeypatch.setattr(pdf_renderer, "_pending", 0)
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    assert client.post(f"/invoices/{inv}/pdf/jobs").json["status"] == "queued"
+    for r in (
+        client.post(f"/invoices/{inv}/pdf/jobs"),
+        client.get(f"/invoices/{inv}/pdf"),
+    ):
+        assert r.status_code == 503
+        assert r.headers["Retry-After"] == "5"
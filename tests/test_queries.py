@@ -0,0 +1,57 @@
+from contextlib import contextmanager
+
+import pytest
+
+from app.models import query_hooks
+
+ENDPOINTS = [
+    "/invoices",
+    "/invoices?since=0",
+    "/invoices/{id}",
+    "/invoices/{id}/items",
+]
+
+
+@contextmanager
+def count_queries():
+    """The SQL queries run in the block, as a list of statements."""
+    queries = []
+
+    def hook(event):
+        queries.append(event.sql)
+
+    query_hooks.append(hook)
+    try:
+        yield queries
+    finally:
+        query_hooks.remove(hook)
+
+
+def add_invoice(client, customer, item, lines):
+    return client.post("/invoices", json={
+        "customer_id": customer,
+        "items": [{"item_id": item, "quantity": n + 1} for n in range(lines)],
+    }).json["id"]
+
+
+def queries_for(client, url):
+    client.get(url)  # warm the user and catalog caches
+    with count_queries() as queries:
+        assert client.get(url).status_code == 200
+    return len(queries)
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_invoice_reads_run_a_fixed_number_of_queries(client, url):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 5}).json["id"]
+
+    inv = add_invoice(client, customer, item, lines=1)
+    few = queries_for(client, url.format(id=inv))
+
+    for _ in range(5):
+        add_invoice(client, customer, item, lines=8)
+    big = add_invoice(client, customer, item, lines=20)
+    many = queries_for(client, url.format(id=big))
+
+    assert many == few
@@ -0,0 +1,44 @@
+import pytest
+
+from app.commands import full_scans, hot_queries, query_plan
+
+
+@pytest.fixture
+def plans(app):
+    with app.app_context():
+        yield [(sql, query_plan(sql, params)) for sql, params in hot_queries(1)]
+
+
+def plan_for(plans, *fragments):
+    """The plan of the one hot query whose SQL has every fragment."""
+    (plan,) = [
+        plan for sql, plan in plans
+        if all(fragment in sql for fragment in fragments)
+    ]
+    return plan
+
+
+def test_hot_queries_do_not_scan_whole_tables(plans):
+    for sql, plan in plans:
+        assert not full_scans(plan), (sql, plan)
+
+
+def test_list_pages_use_the_user_index_in_id_order(plans):
+    for table in ("customer", "item", "invoice"):
+        plan = plan_for(plans, f'FROM "{table}"', '"id" > ', "LIMIT")
+        assert not any("TEMP B-TREE" in line for line in plan), plan
+
+
+def test_import_duplicate_checks_only_read_indexes(plans):
+    customers = plan_for(plans, 'SELECT "t1"."name", "t1"."email" FROM "customer"')
+    items = plan_for(plans, 'SELECT "t1"."name" FROM "item"')
+    assert any(
+        "COVERING INDEX customer_user_id_name_email" in line for line in customers
+    ), customers
+    assert any("COVERING INDEX item_user_id_name" in line for line in items), items
+
+
+def test_invoice_lines_come_from_the_invoice_index_in_order(plans):
+    plan = plan_for(plans, 'FROM "invoiceitem"', 'ORDER BY "t1"."id"')
+    assert any("invoiceitem_invoice_id" in line for line in plan), plan
+    assert not any("TEMP B-TREE" in line for line in plan), plan
@@ -0,0 +1,78 @@
+from decimal import Decimal
+
+from app.models import Customer
+from app.reports import rebuild_rollups
+
+
+def revenue(client):
+    return client.get("/reports/revenue?group_by=month,customer,status").json
+
+
+def test_rollups_match_a_rebuild_with_sub_cent_prices(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    item = client.post("/items", json={"name": "I", "unit_price": 1}).json["id"]
+
+    # 3 x 233.235 = 699.705, stored unrounded
+    inv = client.post("/invoices", json={
+        "customer_id": customer, "issue_date": "2025-03-01", "status": "sent",
+        "items": [{"item_id": item, "quantity": 3, "unit_price": "233.235"}],
+    }).json
+    assert [row["total"] for row in revenue(client)] == [699.71]
+
+    line = client.post(f"/invoices/{inv['id']}/items", json={
+        "item_id": item, "quantity": 1, "unit_price": "0.005",
+    }).json
+    client.patch(f"/invoice-items/{line['id']}", json={"quantity": 3})
+    client.post("/invoices", json={
+        "customer_id": customer, "issue_date": "2025-03-02", "status": "sent",
+        "items": [{"item_id": item, "quantity": 1, "unit_price": "0.125"}],
+    })
+    client.patch(f"/invoices/{inv['id']}", json={"due_date": "2025-04-01"})
+
+    maintained = revenue(client)
+    assert [row["total"] for row in maintained] == [
+        float(Decimal("699.72") + Decimal("0.13"))
+    ]
+
+    rebuild_rollups()
+    assert revenue(client) == maintained
+
+
+def test_deleting_an_item_updates_the_rollups(client):
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    kept = client.post("/items", json={"name": "K", "unit_price": 10}).json["id"]
+    gone = client.post("/items", json={"name": "G", "unit_price": 5}).json["id"]
+    client.post("/invoices", json={
+        "customer_id": customer, "issue_date": "2025-05-01", "status": "sent",
+        "due_date": "2025-06-01",
+        "items": [{"item_id": kept, "quantity": 2}, {"item_id": gone}],
+    })
+    assert [row["total"] for row in revenue(client)] == [25]
+
+    client.delete(f"/items/{gone}")
+    assert [row["total"] for row in revenue(client)] == [20]
+    assert client.get("/reports/aging").json["buckets"]["90+"]["total"] == 20
+    assert client.get("/dashboard/summary").json["outstanding"]["total"] == 20
+    maintained = revenue(client)
+    rebuild_rollups()
+    assert revenue(client) == maintained
+
+
+def test_dashboard_summary_is_cached_until_the_users_next_write(make_client):
+    client, other = make_client(), make_client()
+    customer = client.post("/customers", json={"name": "C"}).json["id"]
+    assert client.get("/dashboard/summary").json["counts"]["customers"] == 1
+
+    # a row written behind the API is only seen once the cache is dropped
+    user_id = Customer.get_by_id(customer).user_id
+    Customer.create(user=user_id, name="Direct")
+    other.post("/customers", json={"name": "Someone else's"})
+    assert client.get("/dashboard/summary").json["counts"]["customers"] == 1
+
+    assert client.post("/customers", json={}).status_code == 400
+    assert client.get("/dashboard/summary").json["counts"]["customers"] == 1
+
+    client.post("/invoices", json={"customer_id": customer, "status": "sent"})
+    summary = client.get("/dashboard/summary").json
+    assert summary["counts"]["customers"] == 2
+    assert summary["outstanding"]["count"] == 1
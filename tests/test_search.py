@@ -0,0 +1,16 @@
+import pytest
+
+
+def test_search_finds_an_invoice_by_its_id(client):
+    customer = client.post("/customers", json={"name": "Zed"}).json["id"]
+    inv = client.post("/invoices", json={"customer_id": customer}).json["id"]
+
+    r = client.get(f"/search?q= {inv} &types=invoices")
+    assert [found["id"] for found in r.json["invoices"]] == [inv]
+
+
+@pytest.mark.parametrize("q", ["²", "١٢", "9" * 30])
+def test_search_ignores_numbers_that_are_not_invoice_ids(client, q):
+    r = client.get("/search", query_string={"q": q, "types": "invoices"})
+    assert r.status_code == 200
+    assert r.json == {"invoices": []}
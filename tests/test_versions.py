@@ -0,0 +1,14 @@
+def test_each_user_has_their_own_version_counter(make_client):
+    a, b = make_client(), make_client()
+    for name in ("x", "y", "z"):
+        a.post("/customers", json={"name": name})
+    cursor = a.get("/customers?since=0").json["cursor"]
+    assert cursor == 3
+
+    # b's versions start from 1, and b's writes don't move a's feed
+    b.post("/customers", json={"name": "b"})
+    (changed,) = b.get("/customers?since=0").json["changed"]
+    assert changed["version"] == 1
+    assert a.get(f"/customers?since={cursor}").json == {
+        "changed": [], "deleted": [], "cursor": cursor, "has_more": False,
+    }